@@ -0,0 +1,25 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Benchmark suite for FRETBursts based on airspeed velocity (asv).
+
+The benchmarks time (`time_*`) and memory-profile (`peakmem_*`) each stage
+of the analysis pipeline on synthetic datasets generated with
+:mod:`fretbursts.simulate` (1-spot, 8-spot, 48-spot, usALEX) of increasing
+size. Where FRETBursts has a pure-python and an optimized (Cython)
+implementation both are measured.
+
+Run the suite for the current commit with::
+
+    asv run
+
+or compare two commits with::
+
+    asv continuous master HEAD
+
+The results are stored as JSON files in `.asv/results` (one file per
+machine and commit) and can be browsed with `asv publish; asv preview`.
+"""
@@ -0,0 +1,61 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Benchmarks of the low-level burst search functions (pure-python and
+Cython) on the timestamps of a single spot.
+"""
+
+from fretbursts.burstsearch import burstsearchlib as bslib
+
+from common import get_data, durations
+
+
+def _get_backend(name):
+    if name == 'cython':
+        if not hasattr(bslib, 'bsearch_c'):
+            raise NotImplementedError  # asv skips the benchmark
+        return bslib.bsearch_c, bslib.mch_count_ph_in_bursts_c
+    return bslib.bsearch_py, bslib.mch_count_ph_in_bursts_py
+
+
+class BurstSearch:
+    params = ([10, 100], ['python', 'cython'])
+    param_names = ['duration_s', 'backend']
+    timeout = 300
+
+    def setup(self, duration_s, backend):
+        self.bsearch, self.count_ph = _get_backend(backend)
+        d = get_data('1spot', duration_s)
+        self.ph = d.ph_times_m[0]
+        self.mask = d.A_em[0]
+        self.T = int(10/150e3/d.clk_p)  # 10 photons at 150 kcps
+        self.mburst = self.bsearch(self.ph, 10, 10, self.T, verbose=False)
+
+    def time_bsearch(self, duration_s, backend):
+        self.bsearch(self.ph, 10, 10, self.T, verbose=False)
+
+    def peakmem_bsearch(self, duration_s, backend):
+        self.bsearch(self.ph, 10, 10, self.T, verbose=False)
+
+    def time_count_ph_in_bursts(self, duration_s, backend):
+        self.count_ph([self.mburst], [self.mask])
+
+
+class BurstAnd:
+    params = durations
+    param_names = ['duration_s']
+
+    def setup(self, duration_s):
+        d = get_data('1spot', duration_s)
+        ph = d.ph_times_m[0]
+        T = int(10/150e3/d.clk_p)
+        self.bursts_d = bslib.bsearch(ph[~d.A_em[0]], 10, 10, T,
+                                      verbose=False)
+        self.bursts_a = bslib.bsearch(ph[d.A_em[0]], 10, 10, T,
+                                      verbose=False)
+
+    def time_burst_and(self, duration_s):
+        bslib.burst_and(self.bursts_d, self.bursts_a)
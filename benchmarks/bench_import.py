@@ -0,0 +1,19 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Benchmarks of the package import time (each run in a new interpreter).
+"""
+
+
+class ImportTime:
+    def timeraw_import_fretbursts(self):
+        return "import fretbursts"
+
+    def timeraw_import_loader(self):
+        return "from fretbursts import loader"
+
+    def timeraw_import_all(self):
+        return "from fretbursts import *"
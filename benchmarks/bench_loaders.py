@@ -0,0 +1,94 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Benchmarks of the data loaders on simulated HDF5-Ph-Data files.
+"""
+
+import os
+import tempfile
+
+from fretbursts import loader, simulate, hdf5
+
+from common import datasets, durations, get_hdf5_file
+
+
+class LoadHDF5:
+    params = (sorted(datasets), durations)
+    param_names = ['dataset', 'duration_s']
+    timeout = 600
+
+    def setup(self, name, duration_s):
+        self.fname = get_hdf5_file(name, duration_s)
+
+    def teardown(self, name, duration_s):
+        os.remove(self.fname)
+
+    def _load(self):
+        d = loader.hdf5(self.fname)
+        if d.ALEX:
+            loader.usalex_apply_period(d)
+        d.data_file.close()
+
+    def time_hdf5(self, name, duration_s):
+        self._load()
+
+    def peakmem_hdf5(self, name, duration_s):
+        self._load()
+
+
+class ALEXPeriod:
+    params = durations
+    param_names = ['duration_s']
+
+    def setup(self, duration_s):
+        self.d = simulate.simulate_data(duration_s=duration_s, alex=True,
+                                        apply_period=False)
+
+    def time_usalex_apply_period(self, duration_s):
+        loader.usalex_apply_period(self.d, delete_ph_t=False)
+
+
+class StoreHDF5:
+    """Write and read throughput of the HDF5 files for each compression.
+    """
+    compressions = {
+        'zlib': hdf5.default_compression,
+        'blosc_lz4': hdf5.fast_compression,
+        'none': dict(complevel=0),
+    }
+    params = (['8spot', 'usalex'], sorted(compressions), [None, 2**16])
+    param_names = ['dataset', 'compression', 'chunksize']
+    timeout = 600
+
+    def setup(self, name, compression, chunksize):
+        # Raw ALEX data (before the alternation selection) as in the files
+        self.d = simulate.simulate_data(duration_s=durations[-1],
+                                        apply_period=False, **datasets[name])
+        fd, self.fname = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fd)
+        os.remove(self.fname)
+        self._store(compression, chunksize)
+
+    def teardown(self, name, compression, chunksize):
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+
+    def _store(self, compression, chunksize):
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+        hdf5.store(self.d, compression=self.compressions[compression],
+                   h5_fname=self.fname, chunksize=chunksize, verbose=False)
+        self.d.data_file.close()
+
+    def time_store(self, name, compression, chunksize):
+        self._store(compression, chunksize)
+
+    def time_read(self, name, compression, chunksize):
+        d = loader.hdf5(self.fname)
+        d.data_file.close()
+
+    def track_file_size_MB(self, name, compression, chunksize):
+        return os.path.getsize(self.fname)/1e6
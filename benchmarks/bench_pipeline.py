@@ -0,0 +1,97 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Benchmarks of the analysis pipeline stages of :class:`Data` on simulated
+1-spot, 8-spot, 48-spot and usALEX measurements.
+"""
+
+import fretbursts.burstlib as bl
+import fretbursts.select_bursts as select_bursts
+
+from common import (datasets, durations, bg_kwargs, bs_kwargs, get_data,
+                    get_data_bursts)
+
+
+class Background:
+    params = (sorted(datasets), durations)
+    param_names = ['dataset', 'duration_s']
+    timeout = 600
+
+    def setup(self, name, duration_s):
+        self.d = get_data(name, duration_s)
+
+    def time_calc_bg(self, name, duration_s):
+        self.d.calc_bg(**bg_kwargs)
+
+    def peakmem_calc_bg(self, name, duration_s):
+        self.d.calc_bg(**bg_kwargs)
+
+
+class BurstSearch:
+    params = (sorted(datasets), durations, [False, True])
+    param_names = ['dataset', 'duration_s', 'pure_python']
+    timeout = 600
+
+    def setup(self, name, duration_s, pure_python):
+        self.d = get_data(name, duration_s)
+        self.d.calc_bg(**bg_kwargs)
+
+    def time_burst_search_t(self, name, duration_s, pure_python):
+        self.d.burst_search_t(pure_python=pure_python, **bs_kwargs)
+
+    def peakmem_burst_search_t(self, name, duration_s, pure_python):
+        self.d.burst_search_t(pure_python=pure_python, **bs_kwargs)
+
+
+class BurstData:
+    params = (sorted(datasets), durations)
+    param_names = ['dataset', 'duration_s']
+    timeout = 600
+
+    def setup(self, name, duration_s):
+        self.d = get_data_bursts(name, duration_s)
+
+    def time_calc_ph_num(self, name, duration_s):
+        self.d.calc_ph_num(alex_all=True)
+
+    def time_calc_ph_num_python(self, name, duration_s):
+        self.d.calc_ph_num(alex_all=True, pure_python=True)
+
+    def time_fuse_bursts(self, name, duration_s):
+        self.d.fuse_bursts(ms=0, mute=True)
+
+    def peakmem_fuse_bursts(self, name, duration_s):
+        self.d.fuse_bursts(ms=0, mute=True)
+
+    def time_select_size(self, name, duration_s):
+        bl.Sel(self.d, select_bursts.size, th1=20)
+
+    def peakmem_select_size(self, name, duration_s):
+        bl.Sel(self.d, select_bursts.size, th1=20)
+
+    def time_copy(self, name, duration_s):
+        self.d.copy(mute=True)
+
+
+class Corrections:
+    """Corrections on a copy of uncorrected burst data.
+
+    `corrections()` does nothing on already corrected data, so each call
+    corrects a fresh copy: subtract `time_copy` to get the corrections time.
+    """
+    params = (sorted(datasets), durations)
+    param_names = ['dataset', 'duration_s']
+    timeout = 600
+
+    def setup(self, name, duration_s):
+        self.d = get_data_bursts(name, duration_s)
+        self.d.calc_ph_num(alex_all=True)   # uncorrected burst counts
+
+    def time_copy(self, name, duration_s):
+        self.d.copy(mute=True)
+
+    def time_corrections(self, name, duration_s):
+        self.d.copy(mute=True).corrections(mute=True)
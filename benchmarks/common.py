@@ -0,0 +1,59 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Synthetic datasets shared by the benchmarks.
+
+The datasets are simulated in the benchmark `setup()` (not timed). Each
+dataset is identified by a name (`datasets` keys) and by the measurement
+duration, used to scale the number of photons.
+"""
+
+import os
+import tempfile
+
+from fretbursts import simulate
+import fretbursts.background as bg
+
+
+# Simulation arguments for each dataset (see fretbursts.simulate)
+datasets = {
+    '1spot': dict(num_spots=1),
+    '8spot': dict(num_spots=8),
+    '48spot': dict(num_spots=48),
+    'usalex': dict(num_spots=1, alex=True),
+}
+
+# Measurement durations (seconds), about 150k photons per spot every 10 s
+durations = [10, 100]
+
+# Default analysis parameters
+bg_kwargs = dict(fun=bg.exp_fit, time_s=10, tail_min_us=300)
+bs_kwargs = dict(L=10, m=10, F=6, mute=True)
+
+
+def get_data(name, duration_s, seed=1):
+    """Return a simulated Data object with the photon data only."""
+    return simulate.simulate_data(duration_s=duration_s, seed=seed,
+                                  **datasets[name])
+
+def get_data_bursts(name, duration_s, seed=1):
+    """Return a simulated Data object with background and bursts."""
+    d = get_data(name, duration_s, seed=seed)
+    d.calc_bg(**bg_kwargs)
+    d.burst_search_t(**bs_kwargs)
+    return d
+
+def get_hdf5_file(name, duration_s, seed=1):
+    """Save a simulated measurement in a temporary HDF5 file.
+
+    Returns the file name, the caller is responsible for deleting it.
+    """
+    fd, fname = tempfile.mkstemp(suffix='.hdf5')
+    os.close(fd)
+    os.remove(fname)
+    simulate.simulate_hdf5(fname, duration_s=duration_s, seed=seed,
+                           verbose=False, **datasets[name])
+    return fname
@@ -42,34 +42,28 @@ def citation(bar=True):
         print('-------------------------------------------------------------')
 
 
+import sys
+import types
 import warnings
+import importlib
+from pkgutil import find_loader
 
-try:
-    import pandas
-except ImportError:
-    has_pandas = False
+# Optional dependencies are checked without importing them (import is slow),
+# they are imported only when the modules that need them are used.
+has_pandas = find_loader('pandas') is not None
+if not has_pandas:
     warnings.warn((' - Cannot import pandas. Some functionality will not be '
                    'available.'))
-else:
-    has_pandas = True
 
-try:
-    import matplotlib
-except ImportError:
-    has_matplotlib = False
+has_matplotlib = find_loader('matplotlib') is not None
+if not has_matplotlib:
     warnings.warn((' - Cannot import matplotlib. Plotting will not be '
                    'available.'))
-else:
-    has_matplotlib = True
 
-try:
-    import lmfit
-except ImportError:
-    has_lmfit = False
+has_lmfit = find_loader('lmfit') is not None
+if not has_lmfit:
     warnings.warn((' - Cannot import lmfit. Some fitting functionalities '
                    ' will not be available.'))
-else:
-    has_lmfit = True
 
 
 __all__numpy = ["np", "r_", "zeros"]
@@ -82,12 +76,16 @@ __all__matplotlib = [
 __all_local_names = [
         # Local modules
         "loader", "select_bursts", "bl", "bg", "bpl", "bext", "bg_cache",
-        "hdf5", "fretmath", "mfit", "citation",
+        "hdf5", "fretmath", "mfit", "rasp", "simulate",
+        "backends",
+        "citation",
 
         # Classes, functions, variables
         "Data", "Sel", "Sel_mask", "Sel_mask_apply", "gui_fname", "Ph_sel",
         "download_file",
+        ]
 
+__all__plot = [
         # Standalone plots or plots as a function of ch
         "mch_plot_bg", "plot_alternation_hist",
 
@@ -112,51 +110,75 @@ __all__ = __all__numpy + __all_local_names
 import numpy as np
 from numpy import r_, zeros
 
-if has_matplotlib:
-    __all__ += __all__matplotlib
-    from matplotlib import rcParams
-    import matplotlib.pyplot as plt
-    from matplotlib.pyplot import plot, hist, grid, xlim, ylim, gca, gcf
-
 # Import plain module names
-import loader, hdf5, select_bursts, fretmath
+import loader, hdf5, fretmath
 
 # Import modules with custom names
-import background as bg
 import burstlib as bl
 
 # Import objects
 from .burstlib import Data, Sel, Sel_mask, Sel_mask_apply
 from .ph_sel import Ph_sel
 
-
-if has_matplotlib and has_pandas and has_lmfit:
-    import mfit
-    import burstlib_ext as bext
-    import burst_plot as bpl
-    from burst_plot import (
-            # Standalone plots as a function of ch
-            mch_plot_bg, plot_alternation_hist,
-
-            # Single-ch plots used in multi-ch plots through `dplot`
-            timetrace, timetrace_single, ratetrace, ratetrace_single,
-            timetrace_fret, timetrace_bg,
-            hist_width, hist_size, hist_size_all, hist_fret, hist_burst_data,
-            hist2d_alex, hist_S, hist_sbr, hist_asymmetry,
-            hist_bg_single, hist_bg, hist_ph_delays, hist_mdelays,
-            hist_mrates, hist_rate_in_burst, hist_burst_delays,
-            scatter_width_size, scatter_rate_da, scatter_fret_size,
-            scatter_fret_nd_na, scatter_fret_width, scatter_da,
-            scatter_naa_nt, scatter_alex,
-
-            # Wrapper functions that create a plot for each channel
-            dplot, dplot_48ch, dplot_8ch, dplot_1ch,
-            )
-
-from .utils.gui import gui_fname
-
 from .utils.misc import download_file
 
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
+
+
+## Lazy loaded names
+#  The following names are imported on first access. They are listed as
+#  `name: (module, attribute)`, when attribute is None `name` is the module.
+_lazy_names = {
+    'select_bursts': ('fretbursts.select_bursts', None),
+    'bg': ('fretbursts.background', None),
+    'bg_cache': ('fretbursts.bg_cache', None),
+    'rasp': ('fretbursts.rasp', None),
+    'simulate': ('fretbursts.simulate', None),
+    'mfit': ('fretbursts.mfit', None),
+    'bext': ('fretbursts.burstlib_ext', None),
+    'bpl': ('fretbursts.burst_plot', None),
+    'gui_fname': ('fretbursts.utils.gui', 'gui_fname'),
+    'matplotlib': ('matplotlib', None),
+    'plt': ('matplotlib.pyplot', None),
+    'rcParams': ('matplotlib', 'rcParams'),
+    }
+for _name in ['plot', 'hist', 'grid', 'xlim', 'ylim', 'gca', 'gcf']:
+    _lazy_names[_name] = ('matplotlib.pyplot', _name)
+for _name in __all__plot:
+    _lazy_names[_name] = ('fretbursts.burst_plot', _name)
+del _name
+
+if has_matplotlib:
+    __all__ += __all__matplotlib
+if has_matplotlib and has_pandas and has_lmfit:
+    __all__ += __all__plot
+
+
+class _LazyPackage(types.ModuleType):
+    """Module type of `fretbursts` importing the names in `_lazy_names` on
+    first access (plotting, GUI, fitting and pandas-dependent modules).
+    """
+    def __getattr__(self, name):
+        if name not in _lazy_names:
+            raise AttributeError("'module' object has no attribute '%s'" %
+                                 name)
+        module_name, attr = _lazy_names[name]
+        value = importlib.import_module(module_name)
+        if attr is not None:
+            value = getattr(value, attr)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_names))
+
+
+# Replace this module with a `_LazyPackage` instance with the same content.
+# A reference to the original module is kept because, in python 2, a
+# module being deallocated clears its globals (used by the functions above).
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+_package._original_module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,220 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Registry of the compute backends for the core kernels.
+
+Each *kernel* (i.e. 'bsearch', the burst search) can have several
+implementations, one for each *backend*:
+
+- 'numpy': pure python/numpy implementation, always available. It is the
+  reference implementation.
+- 'cython': compiled implementation, available when the Cython extensions
+  have been built (`python setup.py build_ext --inplace`).
+- 'numba': JIT-compiled implementation, available when numba is installed.
+
+The implementations are registered with a string `'module:function'` and
+imported only when first requested. A backend is *available* for a kernel
+if its implementation can be imported.
+
+The backend is selected globally with :func:`set_backend` (or temporarily
+with the :class:`use_backend` context manager) or per-call passing
+`backend='name'` to the :class:`fretbursts.burstlib.Data` methods. When no
+backend is selected (default) or when the selected backend is not available
+for a kernel, the first available backend in :data:`preference` is used.
+
+Use :func:`info` to know which implementation is active for each kernel.
+
+Example::
+
+    from fretbursts import backends
+    backends.info()                 # active and available backends
+    backends.set_backend('numpy')   # use the pure python kernels
+    d.burst_search_t(L=10, m=10, F=6, backend='cython')   # per-call
+"""
+
+import importlib
+
+from utils.progress import logger
+
+
+# Known backends in the default order of preference
+preference = ['cython', 'numba', 'numpy']
+
+# kernel -> {backend: 'module:function' or function}
+_registry = {}
+
+# Cache of the loaded implementations (None if not available)
+_loaded = {}
+
+# Globally selected backend (None means automatic selection)
+_selected = [None]
+
+
+def register(kernel, backend, func):
+    """Register the implementation `func` for `kernel` and `backend`.
+
+    Arguments:
+        kernel (string): name of the kernel.
+        backend (string): name of the backend (one of :data:`preference`).
+        func (function or string): the implementation or a string
+            'module:function' to import it on first use.
+    """
+    if backend not in preference:
+        raise ValueError("Unknown backend '%s'. Valid values: %s." %
+                         (backend, preference))
+    _registry.setdefault(kernel, {})[backend] = func
+    _loaded.pop((kernel, backend), None)
+
+def kernels():
+    """Return the sorted list of the registered kernels."""
+    return sorted(_registry)
+
+def _load(kernel, backend):
+    """Return the implementation of `kernel` for `backend` or None."""
+    key = (kernel, backend)
+    if key not in _loaded:
+        func = _registry[kernel].get(backend)
+        if isinstance(func, basestring):
+            module_name, func_name = func.split(':')
+            try:
+                func = getattr(importlib.import_module(module_name),
+                               func_name)
+            except ImportError:
+                func = None
+        _loaded[key] = func
+    return _loaded[key]
+
+def available(kernel):
+    """Return the list of the available backends for `kernel`."""
+    if kernel not in _registry:
+        raise KeyError("Unknown kernel '%s'." % kernel)
+    return [b for b in preference if _load(kernel, b) is not None]
+
+def set_backend(backend=None):
+    """Select globally the `backend`. If None, restore automatic selection.
+    """
+    if backend is not None and backend not in preference:
+        raise ValueError("Unknown backend '%s'. Valid values: %s." %
+                         (backend, preference))
+    _selected[0] = backend
+
+def get_backend():
+    """Return the globally selected backend (None for automatic)."""
+    return _selected[0]
+
+class use_backend(object):
+    """Context manager selecting globally a backend inside a `with` block.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        self.previous = get_backend()
+        set_backend(self.backend)
+
+    def __exit__(self, *exc_info):
+        set_backend(self.previous)
+
+def get_name(kernel, backend=None):
+    """Return the name of the backend used for `kernel`.
+
+    Arguments:
+        kernel (string): name of the kernel.
+        backend (string or None): requested backend. If None, uses the
+            global selection (see :func:`set_backend`).
+    """
+    if backend is None:
+        backend = _selected[0]
+    elif backend not in preference:
+        raise ValueError("Unknown backend '%s'. Valid values: %s." %
+                         (backend, preference))
+    available_backends = available(kernel)
+    if backend in available_backends:
+        return backend
+    if backend is not None:
+        logger.info("Backend '%s' not available for '%s', using '%s'.",
+                    backend, kernel, available_backends[0])
+    return available_backends[0]
+
+def get(kernel, backend=None):
+    """Return the implementation of `kernel` for the requested `backend`.
+
+    If `backend` is None uses the global selection. If the backend is not
+    available, falls back to the first available in :data:`preference`.
+    """
+    return _load(kernel, get_name(kernel, backend))
+
+def info():
+    """Return a dict with the active and available backends for each kernel.
+    """
+    return {kernel: dict(active=get_name(kernel),
+                         available=available(kernel))
+            for kernel in kernels()}
+
+
+##
+# Registration of the built-in kernels
+#
+_bslib = 'fretbursts.burstsearch.burstsearchlib'
+_bslib_c = 'fretbursts.burstsearch.burstsearchlib_c'
+_bslib_numba = 'fretbursts.burstsearch.burstsearchlib_numba'
+
+# Burst search
+register('bsearch', 'numpy', _bslib + ':bsearch_py')
+register('bsearch', 'cython', _bslib_c + ':bsearch_c')
+register('bsearch', 'numba', _bslib_numba + ':bsearch_numba')
+
+# Photon counting in bursts (segmented sum of a photon mask)
+register('mch_count_ph_in_bursts', 'numpy',
+         _bslib + ':mch_count_ph_in_bursts_py')
+register('mch_count_ph_in_bursts', 'cython',
+         _bslib_c + ':mch_count_ph_in_bursts_c')
+register('mch_count_ph_in_bursts', 'numba',
+         _bslib_numba + ':mch_count_ph_in_bursts_numba')
+
+# Burst intersection (AND gate)
+register('burst_and', 'numpy', _bslib + ':burst_and')
+register('burst_and', 'numba', _bslib_numba + ':burst_and_numba')
+
+# Burst fusion (single-channel)
+register('fuse_bursts', 'numpy', 'fretbursts.burstlib:fuse_bursts_iter')
+register('fuse_bursts', 'numba', _bslib_numba + ':fuse_bursts_numba')
+
+# Max photon rate in each burst (segmented max)
+register('b_rate_max', 'numpy', 'fretbursts.burstlib:b_rate_max')
+register('b_rate_max', 'numba', _bslib_numba + ':b_rate_max_numba')
+
+# Order of the bursts of all the channels (k-way merge)
+register('merge_bursts_order', 'numpy', _bslib + ':merge_bursts_order')
+register('merge_bursts_order', 'numba',
+         _bslib_numba + ':merge_bursts_order_numba')
+
+# Timestamps unwrapping and D/A merging of 8-spot data files
+register('unwind_uni', 'numpy',
+         'fretbursts.dataload.multi_ch_reader:unwind_uni_c')
+register('unwind_uni', 'cython', 'fretbursts.dataload.opt.uni:unwind_uni_o')
+register('unwind_uni', 'numba',
+         'fretbursts.dataload.opt.uni_numba:unwind_uni_numba')
+
+# Linear merge of sorted timestamps (D/A pairs and k-way)
+register('merge_da', 'numpy', 'fretbursts.dataload.multi_ch_reader:merge_da')
+register('merge_da', 'cython', 'fretbursts.dataload.opt.uni:merge_da_c')
+register('merge_da', 'numba',
+         'fretbursts.dataload.opt.uni_numba:merge_da_numba')
+register('merge_timestamps', 'numpy',
+         'fretbursts.dataload.multi_ch_reader:merge_timestamps')
+register('merge_timestamps', 'numba',
+         'fretbursts.dataload.opt.uni_numba:merge_timestamps_numba')
+
+# Grouping of the photons by detector (manta 48-spot data)
+register('demux_detectors', 'numpy',
+         'fretbursts.dataload.manta_reader:demux_detectors')
+register('demux_detectors', 'numba',
+         'fretbursts.dataload.opt.uni_numba:demux_detectors_numba')
+
+# Background fits (selected by `Data.calc_bg` for the built-in functions)
+register('bg.exp_fit', 'numpy', 'fretbursts.background:exp_fit')
+register('bg.exp_cdf_fit', 'numpy', 'fretbursts.background:exp_cdf_fit')
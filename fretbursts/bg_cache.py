@@ -14,6 +14,7 @@ the :class:`Data` attribute `.bg_data_file`.
 import os
 import numpy as np
 from fretbursts.utils.misc import pprint
+from fretbursts.utils.progress import logger
 
 
 def remove_cache(dx):
@@ -82,18 +83,15 @@ def bg_save_hdf5(dx):
                                          os.path.basename(group_name),
                                          createparents=True)
     # Save arrays and scalars
-    pprint('\n - Saving arrays/scalars: ')
     for name, info in bg_arrays_info.items():
-        pprint(name + ', ')
+        logger.debug(' - Saving array/scalar: %s', name)
         arr = np.array(dx[name])
         dx.bg_data_file.create_array(bg_group, name, obj=arr, title=info)
 
     # Save the attributes
-    pprint('\n - Saving HDF5 attributes: ')
     for attr in bg_attr_names:
-        pprint(attr + ', ')
+        logger.debug(' - Saving HDF5 attribute: %s', attr)
         bg_group._v_attrs[attr] = dx[attr]
-    pprint('\n')
     dx.bg_data_file.flush()
 
 def bg_load_hdf5(dx, group_name):
@@ -110,32 +108,28 @@ def bg_load_hdf5(dx, group_name):
     bg_group = dx.bg_data_file.get_node(group_name)
 
     # Load arrays and scalars
-    pprint('\n - Loading arrays/scalars: ')
     for node in bg_group._f_list_nodes():
         name = node.name
-        pprint(name + ', ')
+        logger.debug(' - Loading array/scalar: %s', name)
         #title = node.title
         arr = bg_group._f_get_child(name)
         bg_arrays[name] = arr.read()
     dx.add(**bg_arrays)
 
     # Load the attributes
-    pprint('\n - Loading HDF5 attributes: ')
     for attr in bg_group._v_attrs._f_list():
-        pprint(attr + ', ')
+        logger.debug(' - Loading HDF5 attribute: %s', attr)
         bg_attrs[attr] = bg_group._v_attrs[attr]
     dx.add(**bg_attrs)
 
-    pprint('\n - Generating additional fields: ')
     in_map = ['', '_dd', '_ad', '_da', '_aa']
     out_map = ['_m', '_dd', '_ad', '_da', '_aa']
     new_attrs = {}
     for in_s, out_s in zip(in_map, out_map):
         assert 'bg' + in_s in dx
-        pprint('bg' + in_s + ', ')
+        logger.debug(' - Generating rate%s from bg%s', out_s, in_s)
         new_attrs['rate' + out_s] = [bg.mean() for bg in dx['bg' + in_s]]
     dx.add(**new_attrs)
-    pprint('\n')
 
 def _get_bg_groupname(dx, time_s=None):
     """Get the HDF5 group name for the background data.
@@ -0,0 +1,228 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+This module provides functions to store and load burst search results
+(burst data, photon counts, FRET and stoichiometry) to and from an HDF5 file.
+
+Each burst search is saved in a group under `/bursts` whose name is derived
+from a *signature* of the search: the timestamps fingerprint, the hash of
+the background rates and all the parameters affecting the results
+(`m`, `L`, `F`, `P`, `min_rate_cps`, `ph_sel`, the corrections, ...).
+The signature is also saved as group attribute and checked before loading.
+
+At most :data:`max_cache_entries` burst searches are kept in the file,
+the least recently used are removed first.
+
+The functions here assume to find an open pyTables file reference in
+the :class:`Data` attribute `.bg_data_file` (the same file used to cache
+the background, see :mod:`fretbursts.bg_cache`).
+"""
+
+import time
+import hashlib
+import numpy as np
+from fretbursts.utils.misc import pprint
+from fretbursts.utils.progress import logger
+from fretbursts.ph_sel import Ph_sel
+
+
+# Max number of burst searches stored in the cache
+max_cache_entries = 10
+
+# Per-channel burst data (lists of arrays, one array per channel)
+_burst_arrays_info = dict(
+    mburst = 'Burst data: start, width, size, istart, iend, end',
+    bp = 'Background period of each burst',
+    nd = 'Number of donor photons in each burst',
+    na = 'Number of acceptor photons in each burst',
+    nt = 'Total number of photons in each burst',
+    nda = 'Number of donor photons in each burst during A_ex',
+    naa = 'Number of acceptor photons in each burst during A_ex',
+    E = 'FRET efficiency of each burst',
+    S = 'Stoichiometry of each burst',
+    max_rate = 'Max photon rate in each burst',
+    sbr = 'Signal to background ratio of each burst',
+    TT = 'Burst search time threshold in each background period',
+    bg_bs = 'Background rates used for the burst search threshold',
+)
+
+# Burst search parameters and correction flags (saved as attributes)
+_burst_attr_names = ['m', 'L', 'F', 'P', 'min_rate_cps', 'ph_sel', 'T',
+                     'FF', 'PP', 'rate_th', 'bg_corrected',
+                     'leakage_corrected', 'dir_ex_corrected', 'dithering',
+                     'lsb']
+
+
+def remove_cache(dx):
+    """Remove all the saved burst data."""
+    assert 'bg_data_file' in dx
+    pprint(' * Removing all the cached burst data ... ')
+    if '/bursts' in dx.bg_data_file:
+        dx.bg_data_file.remove_node('/bursts', recursive=True)
+        dx.bg_data_file.flush()
+    pprint('[DONE]\n')
+
+def _as_attr(value):
+    """Convert a parameter to a value comparable in a signature."""
+    if value is None or np.isscalar(value):
+        return value
+    return np.asarray(value).tolist()
+
+def _bg_hash(dx):
+    """Return an hash of the background rates and periods (or None)."""
+    if 'bg' not in dx:
+        return None
+    m = hashlib.md5()
+    for name in ['bg', 'bg_dd', 'bg_ad', 'bg_da', 'bg_aa']:
+        if name in dx:
+            for bg in dx[name]:
+                m.update(np.ascontiguousarray(bg, dtype='float64').data)
+    for lim in dx.Lim:
+        m.update(np.ascontiguousarray(lim, dtype='int64').data)
+    return m.hexdigest()
+
+def get_burst_signature(dx, L, m, P, F, min_rate_cps, ph_sel, nofret=False,
+                        max_rate=False, dither=False):
+    """Return the signature (a dict) of a burst search on `dx`.
+
+    The signature contains the fingerprint of the timestamps, the hash of
+    the background and all the parameters of :meth:`Data.burst_search_t`
+    affecting the results, including the correction coefficients used to
+    compute E and S.
+    """
+    return dict(ph_hash=dx.ph_times_fingerprint(), bg_hash=_bg_hash(dx),
+                L=L, m=m, P=_as_attr(P), F=_as_attr(F),
+                min_rate_cps=_as_attr(min_rate_cps), ph_sel=str(ph_sel),
+                nofret=nofret, max_rate=max_rate, dither=dither,
+                leakage=_as_attr(dx.leakage), gamma=_as_attr(dx.gamma),
+                dir_ex=_as_attr(dx.dir_ex), chi_ch=_as_attr(dx.chi_ch))
+
+def _get_burst_groupname(signature):
+    """Get the HDF5 group name for the burst search with `signature`."""
+    key = hashlib.md5(repr(sorted(signature.items()))).hexdigest()
+    return '/bursts/search_%s' % key[:16]
+
+def _burst_is_cached(dx, signature):
+    """Returns wheter bursts with given `signature` are in the disk cache.
+    """
+    if 'bg_data_file' in dx:
+        groupname = _get_burst_groupname(signature)
+        if groupname in dx.bg_data_file:
+            group = dx.bg_data_file.get_node(groupname)
+            if signature == group._v_attrs.signature:
+                return True
+    return False
+
+def burst_save_hdf5(dx, signature):
+    """Save the burst data of `dx` to the HDF5 file with `signature`."""
+    assert 'bg_data_file' in dx
+    assert 'mburst' in dx
+    h5file = dx.bg_data_file
+    if '/bursts' not in h5file:
+        h5file.create_group('/', 'bursts', title='Burst search data')
+
+    group_name = _get_burst_groupname(signature)
+    if group_name in h5file:
+        h5file.remove_node(group_name, recursive=True)
+    group = h5file.create_group('/bursts', group_name.split('/')[-1])
+
+    # Save the per-channel arrays, a sub-group for each field
+    for name, info in _burst_arrays_info.items():
+        if name not in dx:
+            continue
+        logger.debug(' - Saving per-channel arrays: %s', name)
+        field_group = h5file.create_group(group, name, title=info)
+        for ich, arr in enumerate(dx[name]):
+            h5file.create_array(field_group, 'ch%d' % ich,
+                                obj=np.asarray(arr))
+
+    # Save the attributes
+    for attr in _burst_attr_names:
+        if attr in dx:
+            logger.debug(' - Saving HDF5 attribute: %s', attr)
+            group._v_attrs[attr] = dx[attr]
+    group._v_attrs.signature = signature
+    group._v_attrs.last_access = time.time()
+    _limit_cache_size(dx)
+    h5file.flush()
+
+def burst_load_hdf5(dx, group_name):
+    """Load burst data from a HDF5 file."""
+    assert 'bg_data_file' in dx
+    if group_name not in dx.bg_data_file:
+        print 'Group "%s" not found in the HDF5 file.' % group_name
+        return
+    group = dx.bg_data_file.get_node(group_name)
+
+    # Load the per-channel arrays
+    burst_arrays = dict()
+    for field_group in group._f_iter_nodes('Group'):
+        name = field_group._v_name
+        logger.debug(' - Loading per-channel arrays: %s', name)
+        burst_arrays[name] = [field_group._f_get_child('ch%d' % ich).read()
+                              for ich in range(dx.nch)]
+    dx.add(**burst_arrays)
+
+    # Load the attributes
+    burst_attrs = dict()
+    for attr in _burst_attr_names:
+        if attr in group._v_attrs:
+            logger.debug(' - Loading HDF5 attribute: %s', attr)
+            burst_attrs[attr] = group._v_attrs[attr]
+    dx.add(**burst_attrs)
+    group._v_attrs.last_access = time.time()
+
+def list_cache(dx):
+    """Return a list of (group name, signature, size in bytes) of the cached
+    burst searches, the most recently used first.
+    """
+    if 'bg_data_file' not in dx or '/bursts' not in dx.bg_data_file:
+        return []
+    entries = []
+    h5file = dx.bg_data_file
+    for group in h5file.get_node('/bursts')._f_iter_nodes('Group'):
+        size = sum(array.size_in_memory for array in
+                   h5file.walk_nodes(group, 'Leaf'))
+        entries.append((group._v_attrs.last_access, group._v_pathname,
+                        group._v_attrs.signature, size))
+    entries.sort(reverse=True)
+    return [entry[1:] for entry in entries]
+
+def _limit_cache_size(dx, max_entries=None):
+    """Remove the least recently used burst searches beyond `max_entries`.
+    """
+    if max_entries is None:
+        max_entries = max_cache_entries
+    for group_name, _, _ in list_cache(dx)[max_entries:]:
+        logger.debug(' - Removing from burst cache: %s', group_name)
+        dx.bg_data_file.remove_node(group_name, recursive=True)
+
+def burst_search_cache(dx, L=10, m=10, P=None, F=6., min_rate_cps=None,
+                       nofret=False, max_rate=False, dither=False,
+                       ph_sel=Ph_sel('all'), recompute=False, mute=False,
+                       **kwargs):
+    """Cached version of `.burst_search_t()` method."""
+    signature = get_burst_signature(dx, L=L, m=m, P=P, F=F,
+                                    min_rate_cps=min_rate_cps, ph_sel=ph_sel,
+                                    nofret=nofret, max_rate=max_rate,
+                                    dither=dither)
+    if _burst_is_cached(dx, signature) and not recompute:
+        # Bursts found in cache. Load them.
+        pprint(' * Loading bursts from cache ... ', mute)
+        dx.delete_burst_data()
+        burst_load_hdf5(dx, _get_burst_groupname(signature))
+        dx.bg_data_file.flush()
+        pprint(' [DONE]\n', mute)
+    else:
+        # Bursts not found in cache. Compute them.
+        pprint(' * No cached bursts, recomputing:\n', mute)
+        dx.burst_search_t(L=L, m=m, P=P, F=F, min_rate_cps=min_rate_cps,
+                          nofret=nofret, max_rate=max_rate, dither=dither,
+                          ph_sel=ph_sel, mute=mute, **kwargs)
+        if 'bg_data_file' in dx:
+            pprint(' * Storing bursts to disk ... ', mute)
+            burst_save_hdf5(dx, signature)
+            pprint(' [DONE]\n', mute)
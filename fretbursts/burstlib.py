@@ -18,19 +18,28 @@ For usage example see the IPython Notebooks in sub-folder "notebooks".
 
 import os
 import hashlib
+import functools
+import weakref
 import numpy as np
 import copy
 from numpy import zeros, size, r_
-import scipy.stats as SS
 
 from utils.misc import pprint, clk_to_s, deprecate
-from poisson_threshold import find_optimal_T_bga
-import fret_fit
+from utils.lazy import LazyModule, lazy_function
+from utils.profiling import profiled
+from utils.progress import logger
+from utils import progress
+from utils import profiling
+from utils import fingerprint
+from utils import ragged
 import bg_cache
+import burst_cache
+import backends
 from ph_sel import Ph_sel
 from fretmath import gamma_correct_E, gamma_uncorrect_E
 
 from burstsearch import burstsearchlib as bslib
+from dataload.lazy_arrays import H5Array, is_on_disk, iter_slices
 from burstsearch.burstsearchlib import (
         itstart, iwidth, inum_ph, iistart, iiend, itend,
         # Burst search function
@@ -42,40 +51,61 @@ from burstsearch.burstsearchlib import (
         mch_count_ph_in_bursts
         )
 
-import background as bg
 import select_bursts
 import fit
-from fit.gaussian_fitting import (gaussian_fit_hist,
-                                  gaussian_fit_cdf,
-                                  two_gaussian_fit_hist,
-                                  two_gaussian_fit_hist_min,
-                                  two_gaussian_fit_hist_min_ab,
-                                  two_gaussian_fit_EM,
-                                  two_gauss_mix_pdf,
-                                  two_gauss_mix_ab,)
+
+# Modules depending on scipy are imported on first use
+SS = LazyModule('scipy.stats')
+bg = LazyModule('fretbursts.background')
+fret_fit = LazyModule('fretbursts.fret_fit')
+find_optimal_T_bga = lazy_function('fretbursts.poisson_threshold',
+                                   'find_optimal_T_bga')
+_gf = 'fretbursts.fit.gaussian_fitting'
+gaussian_fit_hist = lazy_function(_gf, 'gaussian_fit_hist')
+gaussian_fit_cdf = lazy_function(_gf, 'gaussian_fit_cdf')
+two_gaussian_fit_hist = lazy_function(_gf, 'two_gaussian_fit_hist')
+two_gaussian_fit_hist_min = lazy_function(_gf, 'two_gaussian_fit_hist_min')
+two_gaussian_fit_hist_min_ab = lazy_function(_gf,
+                                             'two_gaussian_fit_hist_min_ab')
+two_gaussian_fit_EM = lazy_function(_gf, 'two_gaussian_fit_EM')
+two_gauss_mix_pdf = lazy_function(_gf, 'two_gauss_mix_pdf')
+two_gauss_mix_ab = lazy_function(_gf, 'two_gauss_mix_ab')
 
 
 # Redefine some old functions that have been renamed so old scripts will not
 # break but will print a warning
-bg_calc_exp = deprecate(bg.exp_fit, 'bg_calc_exp', 'bg.exp_fit')
-bg_calc_exp_cdf = deprecate(bg.exp_fit, 'bg_calc_exp_cdf', 'bg.exp_cdf_fit')
+bg_calc_exp = deprecate(lazy_function('fretbursts.background', 'exp_fit'),
+                        'bg_calc_exp', 'bg.exp_fit')
+bg_calc_exp_cdf = deprecate(lazy_function('fretbursts.background', 'exp_fit'),
+                            'bg_calc_exp_cdf', 'bg.exp_cdf_fit')
 
 
-def _get_bsearch_func(pure_python=False):
+def _get_bsearch_func(pure_python=False, backend=None, num_threads=None):
     if pure_python:
-        # return the python version
-        return bslib.bsearch_py
-    else:
-        # or what is available
-        return bsearch
+        # force the python version
+        backend = 'numpy'
+    bsearch = backends.get('bsearch', backend)
+    if num_threads is not None and num_threads != 1:
+        bsearch = functools.partial(bslib.bsearch_parallel, bsearch=bsearch,
+                                    num_threads=num_threads)
+    return bsearch
+
+def _get_bg_fit_func(fun, backend=None):
+    """Return the implementation of the background fit `fun` for `backend`.
+
+    The built-in fits (i.e. `bg.exp_fit`) are the 'bg.*' kernels of
+    :mod:`backends`, other (user-defined) functions are returned unchanged.
+    """
+    kernel = 'bg.' + getattr(fun, '__name__', '')
+    if kernel in backends.kernels() and fun is backends.get(kernel, 'numpy'):
+        fun = backends.get(kernel, backend)
+    return fun
 
-def _get_mch_count_ph_in_bursts_func(pure_python=False):
+def _get_mch_count_ph_in_bursts_func(pure_python=False, backend=None):
     if pure_python:
-        # return the python version
-        return bslib.mch_count_ph_in_bursts_py
-    else:
-        # or what is available
-        return mch_count_ph_in_bursts
+        # force the python version
+        backend = 'numpy'
+    return backends.get('mch_count_ph_in_bursts', backend)
 ### - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 ##  GLOBAL VARIABLES
 ##
@@ -87,7 +117,9 @@ def _get_mch_count_ph_in_bursts_func(pure_python=False):
 #  BURST SELECTION FUNCTIONS
 #
 
-def Select_bursts(d_orig, filter_fun, negate=False, nofret=False, **kwargs):
+@profiled
+def Select_bursts(d_orig, filter_fun, negate=False, nofret=False, lazy=False,
+                  **kwargs):
     """Uses `filter_fun` to select a sub-set of bursts from `d_orig`.
 
     Arguments:
@@ -97,6 +129,11 @@ def Select_bursts(d_orig, filter_fun, negate=False, nofret=False, **kwargs):
             of the selection returned by `filter_fun`. Default `False`.
         nofret (boolean): If True do not recompute burst correction and FRET
             efficiencies in the new retuerned object. Default `False`.
+        lazy (boolean): If True, returns a *selection view* storing only
+            the indexes of the selected bursts. The burst fields are
+            extracted from `d_orig` only when accessed. As in
+            :meth:`Data.copy`, the burst arrays of `d_orig` become
+            read-only. See :func:`Sel_mask_apply`. Default `False`.
 
     Kwargs:
         Any additional keyword argument is passed to `filter_fun()`.
@@ -114,7 +151,8 @@ def Select_bursts(d_orig, filter_fun, negate=False, nofret=False, **kwargs):
     """
     Masks, str_sel = Sel_mask(d_orig, filter_fun, negate=negate,
             return_str=True, **kwargs)
-    d_sel = Sel_mask_apply(d_orig, Masks, nofret=nofret, str_sel=str_sel)
+    d_sel = Sel_mask_apply(d_orig, Masks, nofret=nofret, str_sel=str_sel,
+                           lazy=lazy)
     return d_sel
 
 # Alias for :func:`Select_bursts`
@@ -132,16 +170,24 @@ def Sel_mask(d_orig, filter_fun, negate=False, return_str=False, **kwargs):
     """
     ## Create the list of bool masks for the bursts selection
     M = [filter_fun(d_orig,i,**kwargs) for i in range(d_orig.nch)]
-    Masks = [-m[0] if negate else m[0] for m in M]
+    Masks = [~m[0] if negate else m[0] for m in M]
     str_sel = M[0][1]
     if return_str: return Masks, str_sel
     else: return Masks
 
-def Sel_mask_apply(d_orig, Masks, nofret=False, str_sel=''):
+def Sel_mask_apply(d_orig, Masks, nofret=False, str_sel='', lazy=False):
     """Returns a new Data object with bursts select according to Masks.
     Note that 'ph_times_m' is shared to save RAM, but `mburst`, `nd`, `na`,
     `nt`, `bp` (and `naa` if ALEX) are new objects.
 
+    With `lazy=True` the new object is a *selection view*: for each burst
+    field it stores only the (int32) indexes of the selected bursts in each
+    channel and the arrays are extracted the first time the field is
+    accessed. The selected bursts are referred to the first non-lazy
+    object, so chained lazy selections only compose the indexes. In this
+    case E and S are selected from `d_orig` and not recomputed. The burst
+    arrays of `d_orig` are shared and set read-only (see :meth:`Data.copy`).
+
     Use this function only if you want to apply a selection from one object
     to a second object. Otherwise use :func:`Select_bursts`.
 
@@ -149,8 +195,23 @@ def Sel_mask_apply(d_orig, Masks, nofret=False, str_sel=''):
         :func:`Select_bursts`, :func:`Sel_mask`,
     """
     ## Attributes of ds point to the same objects of d_orig
-    ds = Data(**d_orig)
+    ds = d_orig._shallow_copy()
+
+    if lazy:
+        ds.delete(*[name for name in Data.burst_fields if name in ds])
+        ds._sel_pending = _sel_index(d_orig, Masks)
+    else:
+        _sel_copy(ds, d_orig, Masks)
 
+    # Recompute E and S
+    if not nofret and not (lazy and 'E' in d_orig):
+        ds.calc_fret(count_ph=False)
+    # Add the annotation about the filter function
+    ds.s = list(d_orig.s+[str_sel]) # using append would modify also d_orig
+    return ds
+
+def _sel_copy(ds, d_orig, Masks):
+    """Copy in `ds` the burst fields of `d_orig` selected by `Masks`."""
     ## Copy the per-burst fields that must be filtered
     used_fields = [field for field in Data.burst_fields if field in d_orig]
     for name in used_fields:
@@ -168,12 +229,33 @@ def Sel_mask_apply(d_orig, Masks, nofret=False, str_sel=''):
             # On the contrary slicing only makes a new view of the array
             ds[name][ich] = d_orig[name][ich][mask]
 
-    # Recompute E and S
-    if not nofret:
-        ds.calc_fret(count_ph=False)
-    # Add the annotation about the filter function
-    ds.s = list(d_orig.s+[str_sel]) # using append would modify also d_orig
-    return ds
+def _sel_index(d_orig, Masks):
+    """Return the lazy selection of the burst fields of `d_orig` by `Masks`.
+
+    Returns a dict {field: (source, index)} where `source` is a per-channel
+    list of arrays and `index` a per-channel list of int32 arrays with the
+    indexes of the selected elements of `source` (see :meth:`Data.copy` for
+    the read-only sharing of the arrays). An element of `source` can also
+    be a list of arrays, concatenated only when the field is accessed (see
+    :meth:`Data.collapse`). When `d_orig` is itself a selection view the
+    indexes are composed with the ones of `d_orig`.
+    """
+    index = [np.flatnonzero(mask).astype(np.int32) for mask in Masks]
+    parent_pending = d_orig.__dict__.get('_sel_pending', {})
+    composed = {}
+    pending = {}
+    for name in Data.burst_fields:
+        if dict.__contains__(d_orig, name):
+            pending[name] = (_cow_share(d_orig[name]), index)
+        elif name in parent_pending:
+            source, parent_index = parent_pending[name]
+            # Fields selected together share the same index list
+            key = id(parent_index)
+            if key not in composed:
+                composed[key] = [p_index[i_sel] for p_index, i_sel in
+                                 zip(parent_index, index)]
+            pending[name] = (source, composed[key])
+    return pending
 
 
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -249,6 +331,13 @@ def ph_in_bursts_mask(ph_data_size, bursts):
         mask[start:stop] = True
     return mask
 
+def _searchsorted(ph, values):
+    """Like `np.searchsorted(ph, values)` but supports also on-disk arrays.
+    """
+    if not hasattr(ph, 'searchsorted'):
+        ph = H5Array(ph)
+    return ph.searchsorted(values)
+
 def b_rate_max(ph_data, bursts, m, mask=None):
     """Returns the max m-photons rate reached inside each burst.
 
@@ -273,7 +362,7 @@ def b_rate_max(ph_data, bursts, m, mask=None):
     return np.asfarray(burst_rates)  # NOTE: np.asfarray converts None to nan
 
 
-def fuse_bursts_direct(mburst, ms=0, clk_p=12.5e-9, verbose=True):
+def fuse_bursts_direct(mburst, ms=0, clk_p=12.5e-9, verbose=False):
     """Fuse bursts separated by less than `ms` (milli-secs).
 
     This function is a direct implementation using a single loop.
@@ -286,7 +375,8 @@ def fuse_bursts_direct(mburst, ms=0, clk_p=12.5e-9, verbose=True):
             minimum waiting time between bursts (in millisec). Burst closer
             than that will be fuse in asingle burst.
         clk_p (float): clock period or timestamp units in seconds.
-        verbose (bool): if True print a summary of fused bursts.
+        verbose (bool): if True log a summary of fused bursts (logger
+            'fretbursts', level INFO).
 
     Returns:
         new_bursts (2D array): new array of burst data
@@ -331,11 +421,12 @@ def fuse_bursts_direct(mburst, ms=0, clk_p=12.5e-9, verbose=True):
 
     init_nburst = mburst.shape[0]
     delta_b = init_nburst - len(fused_bursts)
-    pprint(" --> END Fused %d bursts (%.1f%%)\n\n" %\
-            (delta_b, 100.*delta_b/init_nburst), mute=-verbose)
+    if verbose:
+        logger.info(" --> END Fused %d bursts (%.1f%%)",
+                    delta_b, 100.*delta_b/init_nburst)
     return np.array(fused_bursts)
 
-def fuse_bursts_iter(bursts, ms=0, clk_p=12.5e-9, verbose=True):
+def fuse_bursts_iter(bursts, ms=0, clk_p=12.5e-9, verbose=False):
     """Fuse bursts separated by less than `ms` (milli-secs).
 
     This function calls iteratively :func:`b_fuse` until there are no more
@@ -348,7 +439,8 @@ def fuse_bursts_iter(bursts, ms=0, clk_p=12.5e-9, verbose=True):
             minimum waiting time between bursts (in millisec). Burst closer
             than that will be fused in a single burst.
         clk_p (float): clock period or timestamp units in seconds.
-        verbose (bool): if True print a summary of fused bursts.
+        verbose (bool): if True log a summary of fused bursts (logger
+            'fretbursts', level INFO).
 
     Returns:
         new_bursts (2D array): new array of burst data
@@ -363,8 +455,9 @@ def fuse_bursts_iter(bursts, ms=0, clk_p=12.5e-9, verbose=True):
         bursts = b_fuse(bursts, ms=ms, clk_p=clk_p)
         new_nburst = bursts.shape[0]
     delta_b = init_nburst-nburst
-    pprint(" --> END Fused %d bursts (%.1f%%, %d iter)\n\n" %\
-            (delta_b, 100.*delta_b/init_nburst, z), mute=-verbose)
+    if verbose:
+        logger.info(" --> END Fused %d bursts (%.1f%%, %d iter)",
+                    delta_b, 100.*delta_b/init_nburst, z)
     return bursts
 
 def b_fuse(mburst, ms=0, clk_p=12.5e-9):
@@ -437,19 +530,26 @@ def b_fuse(mburst, ms=0, clk_p=12.5e-9):
     reorder = new_burst[:, itstart].argsort()
     return new_burst[reorder, :]
 
-def mch_fuse_bursts(MBurst, ms=0, clk_p=12.5e-9, verbose=True):
+def mch_fuse_bursts(MBurst, ms=0, clk_p=12.5e-9, verbose=False,
+                    backend=None):
     """Multi-ch version of `fuse_bursts`. `MBurst` is a list of arrays.
+
+    The single-channel fusion function is chosen according to `backend`
+    (see :mod:`fretbursts.backends`).
     """
+    fuse_bursts_ch = backends.get('fuse_bursts', backend)
     mburst = [b.copy() for b in MBurst] # safety copy
     new_mburst = []
-    ch = 0
-    for mb in mburst:
-        ch += 1
-        pprint(" - - - - - CHANNEL %2d - - - - \n" % ch, -verbose)
+    nch = len(mburst)
+    for ich, mb in enumerate(mburst):
+        if verbose:
+            logger.info(" - - - - - CHANNEL %2d - - - - ", ich + 1)
         if mb.size == 0:
-            continue
-        new_bursts = fuse_bursts_iter(mb, ms=ms, clk_p=clk_p, verbose=verbose)
-        new_mburst.append(new_bursts)
+            new_mburst.append(mb)   # keep the channels aligned
+        else:
+            new_mburst.append(fuse_bursts_ch(mb, ms=ms, clk_p=clk_p,
+                                             verbose=verbose))
+        progress.report('fuse_bursts', (ich + 1.)/nch, ich)
     return new_mburst
 
 def burst_stats(mburst, clk_p=12.5*1e9):
@@ -514,6 +614,25 @@ def mask_empty(mask):
         # Bolean array
         return not mask.any()
 
+def _cow_share(values):
+    """Return a copy of the per-channel list `values` sharing the arrays.
+
+    Used for copy-on-write copies (see :meth:`Data.copy`). The numpy arrays
+    in `values` (i.e. of the original object) are set read-only and the
+    returned list contains read-only views of the same data. Other items
+    (i.e. lists of tuples) are copied.
+    """
+    if not isinstance(values, list):
+        return copy.deepcopy(values)
+    shared = []
+    for value in values:
+        if type(value) is np.ndarray:
+            value.flags.writeable = False
+            shared.append(value.view())
+        else:
+            shared.append(copy.deepcopy(value))
+    return shared
+
 class DataContainer(dict):
     """
     Generic class for storing data.
@@ -717,6 +836,117 @@ class Data(DataContainer):
         init_kw.update(**kwargs)
         DataContainer.__init__(self, **init_kw)
 
+    ##
+    # Lazy burst selections (see :func:`Sel_mask_apply`)
+    #
+    def _materialize(self, name):
+        """Extract the selected bursts of a field of a selection view.
+
+        Returns False if `name` is not a pending field of a selection view.
+        """
+        pending = self.__dict__.get('_sel_pending')
+        if not pending or name not in pending:
+            return False
+        source, index = pending.pop(name)
+        values_list = []
+        for values, i_sel in zip(source, index):
+            if isinstance(values, list):
+                # Per-channel arrays of a lazy collapse (see `collapse`)
+                values = ragged.concatenate(values)[0]
+            values_list.append(values[i_sel])
+        self.add(**{name: values_list})
+        return True
+
+    def __getitem__(self, name):
+        try:
+            return dict.__getitem__(self, name)
+        except KeyError:
+            if not self._materialize(name):
+                raise
+            return dict.__getitem__(self, name)
+
+    def __contains__(self, name):
+        return (dict.__contains__(self, name) or
+                name in self.__dict__.get('_sel_pending', ()))
+
+    def add(self, **kwargs):
+        """Adds or updates elements (attributes and/or dict entries). """
+        pending = self.__dict__.get('_sel_pending')
+        if pending:
+            for name in kwargs:
+                pending.pop(name, None)
+        DataContainer.add(self, **kwargs)
+
+    def delete(self, *args):
+        """Delete an element (attribute and/or dict entry). """
+        pending = self.__dict__.get('_sel_pending', {})
+        # Fields of a selection view not yet extracted are only in `pending`
+        lazy_names = [name for name in args if name in pending and
+                      not dict.__contains__(self, name)]
+        for name in args:
+            pending.pop(name, None)
+        DataContainer.delete(self, *[name for name in args
+                                     if name not in lazy_names])
+
+    ##
+    # Flat storage of the burst fields (see :mod:`fretbursts.utils.ragged`)
+    #
+    def flatten_bursts(self):
+        """Store each burst field in a single array with all the channels.
+
+        After this call the per-channel arrays of the burst fields (i.e.
+        `d.nd[ich]`) are views of one flat array per field. The flat
+        arrays and the channel offsets are returned by :meth:`burst_flat`
+        and are used by some methods to process all the channels at once.
+        The flat layout of a field is lost when its per-channel arrays are
+        replaced (i.e. by a new burst search) and :meth:`burst_flat` falls
+        back to concatenating the arrays.
+        """
+        for name in self.burst_fields:
+            if name in self:
+                self._add_flat(name, *ragged.concatenate(self[name]))
+
+    def _add_flat(self, name, flat, offsets):
+        """Add the burst field `name` as views of the array `flat`."""
+        self.add(**{name: ragged.split(flat, offsets)})
+        self.__dict__.setdefault('_burst_flat', {})[name] = (flat, offsets)
+
+    def _get_flat(self, *names):
+        """Return the flat arrays of the burst fields `names` and the offsets.
+
+        Returns None if any of the fields has not the flat layout.
+        """
+        flat_fields = self.__dict__.get('_burst_flat', {})
+        flats = []
+        for name in names:
+            if name not in flat_fields or name not in self:
+                return None
+            flat, offsets = flat_fields[name]
+            if not ragged.is_split(self[name], flat, offsets):
+                flat_fields.pop(name)
+                return None
+            flats.append(flat)
+        return flats, offsets
+
+    def burst_flat(self, name):
+        """Return the burst field `name` as a flat array (all the channels).
+
+        Returns:
+            A read-only array with the concatenated bursts of all the
+            channels and an array of offsets (size `nch` + 1): the bursts
+            of channel `ich` are `flat[offsets[ich]:offsets[ich+1]]`. When
+            the field has the flat layout (see :meth:`flatten_bursts`) no
+            data is copied.
+        """
+        flat_offsets = self._get_flat(name)
+        if flat_offsets is None:
+            flat, offsets = ragged.concatenate(self[name])
+        else:
+            (flat,), offsets = flat_offsets
+        flat = flat.view()
+        flat.flags.writeable = False
+        return flat, offsets
+
     ## Single-spot shortcuts
     def __getattr__(self, name):
         """Single-channel shortcuts for per-channel fields.
@@ -724,6 +954,8 @@ class Data(DataContainer):
         Appending a '_' to a per-channel field avoids specifying the channel.
         For example use d.nd_ instead if d.nd[0].
         """
+        if self._materialize(name):
+            return dict.__getitem__(self, name)
         msg_missing_attr = "'%s' object has no attribute '%s'" % \
                                             (self.__class__.__name__, name)
         if name.startswith('_') or not name.endswith('_'):
@@ -743,42 +975,151 @@ class Data(DataContainer):
             raise ValueError('Name "%s" is not a per-channel field.' % field)
 
 
+    @profiled
     def copy(self, mute=False):
-        """Copy data in a new object. All arrays copied except for ph_times_m
+        """Copy data in a new object with copy-on-write burst and bg arrays.
+
+        The burst and background arrays are not copied: the two objects
+        share the data as read-only arrays. A method modifying the arrays
+        in-place (i.e. the corrections) first makes a private copy of the
+        arrays it modifies (see :meth:`_cow_writeable`), so changes in one
+        object never affect the other. The timestamps (`ph_times_m`) are
+        always shared.
+
+        Note that also the arrays of the original object become read-only:
+        after a copy, in-place assignments like `d.nd[0][0] = 1` raise a
+        ValueError on both objects. To modify the arrays in-place, first
+        replace them with copies, i.e. `d.add(nd=[nd.copy() for nd in d.nd])`.
         """
-        pprint('Deep copy executed.\n', mute)
-        new_d = Data(**self) # this make a shallow copy (like a pointer)
+        pprint('Copy-on-write copy executed.\n', mute)
+        new_d = self._shallow_copy()
 
-        ## Deep copy (not just reference) or array data
+        ## New per-channel lists sharing read-only arrays
         for field in self.burst_fields + self.bg_fields:
             # Making sure k is defined
-            if field in self:
+            if dict.__contains__(self, field):
+                new_d.add(**{field: _cow_share(self[field])})
+        return new_d
 
-                # Make a deepcopy of the per-channel lists
-                new_d[field] = copy.deepcopy(self[field])
+    def _shallow_copy(self):
+        """Return a new Data object sharing all the fields of this object.
 
-                # Set the attribute: new_d.k = new_d[k]
-                setattr(new_d, field, new_d[field])
+        Use this method instead of `Data(**self)`: the fields not yet
+        extracted from a lazy selection (see :func:`Sel_mask_apply`) are not
+        dict items and stay lazy in the new object.
+        """
+        new_d = Data(**self)
+        if self.__dict__.get('_sel_pending'):
+            new_d._sel_pending = dict(self._sel_pending)
         return new_d
 
+    def _cow_writeable(self, *fields):
+        """Make writeable the arrays in `fields` before in-place changes.
+
+        Read-only arrays (shared with a copy, see :meth:`copy`) are replaced
+        by private copies, in a new per-channel list.
+        """
+        for field in fields:
+            if field not in self:
+                continue
+            values = self[field]
+            if any(isinstance(v, np.ndarray) and not v.flags.writeable
+                   for v in values):
+                self.add(**{field: [v.copy() if isinstance(v, np.ndarray)
+                                    and not v.flags.writeable else v
+                                    for v in values]})
+
+    ##
+    # Profiling methods
+    #
+    def enable_profiling(self, reset=True):
+        """Record time and memory usage of the analysis methods.
+
+        See :mod:`fretbursts.utils.profiling` for the recorded quantities.
+
+        Arguments:
+            reset (bool): if True, discards any previously recorded log.
+        """
+        if reset or self.__dict__.get('_profile_log') is None:
+            self.__dict__['_profile_log'] = []
+
+    def disable_profiling(self):
+        """Stop recording the profiling log (the log is discarded)."""
+        self.__dict__.pop('_profile_log', None)
+
+    @property
+    def profile_log(self):
+        """List of profiling records (empty if profiling is disabled)."""
+        return self.__dict__.get('_profile_log') or []
+
+    def profile_dataframe(self, per_channel=False):
+        """Return the profiling log as a pandas DataFrame.
+
+        Arguments:
+            per_channel (bool): if True, returns one row for each call and
+                channel, with the per-channel number of photons and bursts.
+        """
+        return profiling.log_to_dataframe(self.profile_log,
+                                          per_channel=per_channel)
+
+    def profile_json(self, fname=None):
+        """Return the profiling log as a JSON string (optionally saved to
+        the file `fname`).
+        """
+        return profiling.log_to_json(self.profile_log, fname=fname)
+
     ##
     # Methods for photon timestamps (ph_times_m) access
     #
     def ph_times_hash(self, hash_name='md5', hexdigest=True):
         """Return an hash for the timestamps arrays.
+
+        On-disk timestamps are hashed chunk by chunk. This is a cryptographic
+        hash of all the data, see :meth:`ph_times_fingerprint` for a faster
+        alternative.
         """
         m = hashlib.new(hash_name)
         for ph in self.iter_ph_times():
             if type(ph) is np.ndarray:
                 m.update(ph.data)
             else:
-                # TODO Handle ph_times in PyTables files
-                raise NotImplementedError
+                for chunk in iter_slices(ph):
+                    m.update(np.ascontiguousarray(chunk, dtype=ph.dtype).data)
         if hexdigest:
             return m.hexdigest()
         else:
             return m
 
+    def ph_times_fingerprint(self, num_threads=None):
+        """Return a fast fingerprint (a string) of the timestamps arrays.
+
+        The fingerprint is a non-cryptographic hash computed in parallel
+        over the channels and chunk by chunk for on-disk timestamps (see
+        :mod:`fretbursts.utils.fingerprint`). It is computed once and kept
+        until `ph_times_m` is replaced. Files saved with
+        :func:`fretbursts.hdf5.store` contain the fingerprint, so
+        :func:`fretbursts.loader.hdf5` sets it without reading the data.
+
+        Note that the fingerprint is not updated when the timestamps
+        arrays are modified in-place.
+        """
+        refs, value = self.__dict__.get('_ph_fingerprint', (None, None))
+        if refs is None or len(refs) != len(self.ph_times_m) or \
+                any(ref() is not ph for ref, ph in zip(refs, self.ph_times_m)):
+            value = fingerprint.fingerprint(self.ph_times_m,
+                                            num_threads=num_threads)
+            self.set_ph_times_fingerprint(value)
+        return value
+
+    def set_ph_times_fingerprint(self, value):
+        """Set the fingerprint of the current timestamps arrays (`value`).
+
+        Only weak references to the arrays are kept, so the arrays replaced
+        in `ph_times_m` can be freed.
+        """
+        self._ph_fingerprint = ([weakref.ref(ph) for ph in self.ph_times_m],
+                                value)
+
     @property
     def ph_data_sizes(self):
         """Array of total number of photons (ph-data) for each channel.
@@ -815,7 +1156,7 @@ class Data(DataContainer):
 
         return ph_sel
 
-    def get_ph_mask(self, ich=0, ph_sel=Ph_sel('all')):
+    def get_ph_mask(self, ich=0, ph_sel=Ph_sel('all'), ph_slice=None):
         """Returns a mask for `ph_sel` photons in channel `ich`.
 
         The masks are either boolean arrays or slices (full or empty). In
@@ -825,6 +1166,9 @@ class Data(DataContainer):
         Arguments:
             ph_sel (Ph_sel object): object defining the photon selection.
                 See :mod:`fretbursts.ph_sel` for details.
+            ph_slice (slice or None): if not None, returns the mask only for
+                the photons in `ph_slice`. On-disk masks are read only in
+                this range.
         """
         assert type(ich) == int
         ph_sel = self._check_ph_sel(ph_sel)
@@ -840,29 +1184,30 @@ class Data(DataContainer):
 
         # Base selections
         elif ph_sel == Ph_sel(Dex='Dem'):
-            return self.get_D_em_D_ex(ich)
+            return self.get_D_em_D_ex(ich, ph_slice)
         elif ph_sel == Ph_sel(Dex='Aem'):
-            return self.get_A_em_D_ex(ich)
+            return self.get_A_em_D_ex(ich, ph_slice)
         elif ph_sel == Ph_sel(Aex='Dem'):
-            return self.get_D_em(ich)*self.get_A_ex(ich)
+            return self.get_D_em(ich, ph_slice)*self.get_A_ex(ich, ph_slice)
         elif ph_sel == Ph_sel(Aex='Aem'):
-            return self.get_A_em(ich)*self.get_A_ex(ich)
+            return self.get_A_em(ich, ph_slice)*self.get_A_ex(ich, ph_slice)
 
         # Selection of all photon in one emission ch
         elif ph_sel == Ph_sel(Dex='Dem', Aex='Dem'):
-            return self.get_D_em(ich)
+            return self.get_D_em(ich, ph_slice)
         elif ph_sel == Ph_sel(Dex='Aem', Aex='Aem'):
-            return self.get_A_em(ich)
+            return self.get_A_em(ich, ph_slice)
 
         # Selection of all photon in one excitation period
         elif ph_sel == Ph_sel(Dex='DAem'):
-            return self.get_D_ex(ich)
+            return self.get_D_ex(ich, ph_slice)
         elif ph_sel == Ph_sel(Aex='DAem'):
-            return self.get_A_ex(ich)
+            return self.get_A_ex(ich, ph_slice)
 
         # Selection of all photons except for Dem during Aex
         elif ph_sel == Ph_sel(Dex='DAem', Aex='Aem'):
-            return self.get_D_ex(ich) + self.get_A_em(ich)*self.get_A_ex(ich)
+            return self.get_D_ex(ich, ph_slice) + \
+                    self.get_A_em(ich, ph_slice)*self.get_A_ex(ich, ph_slice)
 
         else:
             raise ValueError('Selection not implemented.')
@@ -889,17 +1234,23 @@ class Data(DataContainer):
         """
         ph = self.ph_times_m[ich]
 
-        # If not a list is an on-disk array, and needs to be loaded (with [:])
-        if type(self.ph_times_m) is not list:
+        # If not a numpy array is an on-disk array, and needs to be loaded
+        # (with [:])
+        if not isinstance(ph, np.ndarray):
             ph = ph[:]
 
         return ph[self.get_ph_mask(ich, ph_sel=ph_sel)]
 
-    def _get_ph_mask_single(self, ich, mask_name, negate=False):
+    def _get_ph_mask_single(self, ich, mask_name, negate=False,
+                            ph_slice=None):
         """Get the bool array `mask_name` for channel `ich`.
         If the internal "bool array" is a scalar return a slice (full or empty)
+        If `ph_slice` is not None, only the elements in `ph_slice` are read.
         """
-        mask = np.asarray(getattr(self, mask_name)[ich])
+        mask = getattr(self, mask_name)[ich]
+        if ph_slice is not None and np.ndim(mask) > 0:
+            mask = mask[ph_slice]
+        mask = np.asarray(mask)
         if negate:
             mask = np.logical_not(mask)
         if len(mask.shape) == 0:
@@ -907,38 +1258,39 @@ class Data(DataContainer):
             mask = slice(None) if mask else slice(0)
         return mask
 
-    def get_A_em(self, ich=0):
+    def get_A_em(self, ich=0, ph_slice=None):
         """Returns a mask to select photons detected in the acceptor ch."""
-        return self._get_ph_mask_single(ich, 'A_em')
+        return self._get_ph_mask_single(ich, 'A_em', ph_slice=ph_slice)
 
-    def get_D_em(self, ich=0):
+    def get_D_em(self, ich=0, ph_slice=None):
         """Returns a mask to select photons detected in the donor ch."""
-        return self._get_ph_mask_single(ich, 'A_em', negate=True)
+        return self._get_ph_mask_single(ich, 'A_em', negate=True,
+                                        ph_slice=ph_slice)
 
-    def get_A_ex(self, ich=0):
+    def get_A_ex(self, ich=0, ph_slice=None):
         """Returns a mask to select photons in acceptor-excitation periods."""
-        return self._get_ph_mask_single(ich, 'A_ex')
+        return self._get_ph_mask_single(ich, 'A_ex', ph_slice=ph_slice)
 
-    def get_D_ex(self, ich=0):
+    def get_D_ex(self, ich=0, ph_slice=None):
         """Returns a mask to select photons in donor-excitation periods."""
         if self.ALEX:
-            return self._get_ph_mask_single(ich, 'D_ex')
+            return self._get_ph_mask_single(ich, 'D_ex', ph_slice=ph_slice)
         else:
             return slice(None)
 
-    def get_D_em_D_ex(self, ich=0):
+    def get_D_em_D_ex(self, ich=0, ph_slice=None):
         """Returns a mask of donor photons during donor-excitation."""
         if self.ALEX:
-            return self.get_D_em(ich)*self.get_D_ex(ich)
+            return self.get_D_em(ich, ph_slice)*self.get_D_ex(ich, ph_slice)
         else:
-            return self.get_D_em(ich)
+            return self.get_D_em(ich, ph_slice)
 
-    def get_A_em_D_ex(self, ich=0):
+    def get_A_em_D_ex(self, ich=0, ph_slice=None):
         """Returns a mask of acceptor photons during donor-excitation."""
         if self.ALEX:
-            return self.get_A_em(ich)*self.get_D_ex(ich)
+            return self.get_A_em(ich, ph_slice)*self.get_D_ex(ich, ph_slice)
         else:
-            return self.get_A_em(ich)
+            return self.get_A_em(ich, ph_slice)
 
     def iter_ph_times_period(self, ich=0, ph_sel=Ph_sel('all')):
         """Iterate through arrays of ph timestamps in each background period.
@@ -950,11 +1302,15 @@ class Data(DataContainer):
     def get_ph_times_period(self, period, ich=0, ph_sel=Ph_sel('all'),
                             mask=None):
         """Return the array of ph_times in `period`, `ich` and `ph_sel`.
+
+        When the timestamps are on disk (see `lazy` in
+        :func:`fretbursts.loader.hdf5`), reads only the timestamps in
+        `period`.
         """
         istart, iend = self.Lim[ich][period]
         period_slice = slice(istart, iend + 1)
 
-        ph_times = self.get_ph_times(ich=ich)
+        ph_times = self.ph_times_m[ich]
         if mask is None:
             mask = self.get_ph_mask(ich=ich, ph_sel=ph_sel)
 
@@ -975,6 +1331,9 @@ class Data(DataContainer):
     @property
     def num_bursts(self):
         """Array of number of bursts in each channel."""
+        pending = self.__dict__.get('_sel_pending', {})
+        if 'mburst' in pending:
+            return np.array([index.size for index in pending['mburst'][1]])
         return np.array([mb.shape[0] for mb in self.mburst])
 
     @property
@@ -1033,7 +1392,7 @@ class Data(DataContainer):
         if np.isscalar(N1): N1 = [N1]*self.nch
         if np.isscalar(N2): N2 = [N2]*self.nch
         assert len(N1) == len(N2) == self.nch
-        d = Data(**self)
+        d = self._shallow_copy()
         d.add(mburst=[b[n1:n2, :] for b, n1, n2 in zip(d.mburst, N1, N2)])
         d.add(nt=[nt[n1:n2] for nt, n1, n2 in zip(d.nt, N1, N2)])
         d.add(nd=[nd[n1:n2] for nd, n1, n2 in zip(d.nd, N1, N2)])
@@ -1052,6 +1411,21 @@ class Data(DataContainer):
     ##
     # Methods for high-level data transformation
     #
+    def select(self, expr, negate=False, nofret=False, lazy=False):
+        """Return a new Data object with the bursts satisfying `expr`.
+
+        `expr` is a string with a boolean expression combining per-burst
+        quantities and selection functions, for example
+        `'nt > 30 & 0.2 < E < 0.8 & na_bg_p(P=0.01)'`. See
+        :func:`select_bursts.expression` for the syntax. All the criteria
+        are applied at once, with a single copy of the burst data.
+
+        The arguments `negate`, `nofret` and `lazy` are passed to
+        :func:`Select_bursts`.
+        """
+        return Select_bursts(self, select_bursts.expression, negate=negate,
+                             nofret=nofret, lazy=lazy, expr=expr)
+
     def slice_ph(self, time_s1=0, time_s2=None, s='slice'):
         """Return a new Data object with ph in [`time_s1`,`time_s2`] (seconds)
         """
@@ -1064,7 +1438,7 @@ class Data(DataContainer):
 
         masks = [(ph >= t1_clk)*(ph <= t2_clk) for ph in self.iter_ph_times()]
 
-        new_d = Data(**self)
+        new_d = self._shallow_copy()
         for name in self.ph_fields:
             if name in self:
                 #if name == 'A_em':
@@ -1080,26 +1454,53 @@ class Data(DataContainer):
         new_d.s.append(s)
         return new_d
 
-    def collapse(self, update_gamma=True):
+    def collapse(self, update_gamma=True, lazy=False, backend=None):
         """Returns an object with 1-ch data joining the multi-ch data.
 
-        The argument `update_gamma` (bool, default True) allows to avoid
-        recomputing gamma as the average of the original gamma. This flag
-        should be always True. Set False only for testing/debugging.
-        """
-        dc = Data(**self)
-
-        mburst = np.vstack(self.mburst)
-        burst_start = b_start(mburst)
-        sort_index = burst_start.argsort()
-
-        ich_burst = [i*np.ones(nb) for i, nb in enumerate(self.num_bursts)]
-        dc.add(ich_burst=np.hstack(ich_burst)[sort_index])
+        The bursts of each channel are already sorted by start time, so the
+        order of the collapsed bursts is obtained with a k-way merge of the
+        channels (the 'merge_bursts_order' kernel in :mod:`backends`). The
+        new field `ich_burst` contains the channel of each burst (uint8,
+        or int16 for more than 256 channels).
 
-        for name in self.burst_fields:
-            if name in self:
-                # Concatenate arrays along axis = 0
-                value = [ np.concatenate(self[name])[sort_index] ]
+        Arguments:
+            update_gamma (bool): allows to avoid recomputing gamma as the
+                average of the original gamma. This flag should be always
+                True. Set False only for testing/debugging.
+            lazy (bool): if True, the burst fields of the returned object
+                are extracted only when accessed, as in a lazy selection
+                (see :func:`Sel_mask_apply`). The burst arrays are shared
+                (copy-on-write) and concatenated only when accessed
+                (never with the flat layout, see :meth:`flatten_bursts`).
+                Default False.
+            backend (string or None): compute backend for the merge.
+                See :mod:`fretbursts.backends`.
+        """
+        dc = self._shallow_copy()
+
+        mburst, offsets = self.burst_flat('mburst')
+        merge_bursts_order = backends.get('merge_bursts_order', backend)
+        sort_index, ich_burst = merge_bursts_order(b_start(mburst), offsets)
+        dc.add(ich_burst=ich_burst)
+
+        used_fields = [name for name in self.burst_fields if name in self]
+        if lazy:
+            dc.delete(*[name for name in used_fields if name in dc])
+            sort_index = [sort_index.astype(np.int32)]
+            dc._sel_pending = {}
+        for name in used_fields:
+            if lazy:
+                shared = _cow_share(self[name])
+                if self._get_flat(name) is not None:
+                    # The flat array is shared (its views are now read-only)
+                    source = self.burst_flat(name)[0]
+                else:
+                    # The per-channel arrays are concatenated on access
+                    source = shared
+                dc._sel_pending[name] = ([source], sort_index)
+            else:
+                # Concatenated arrays (no copy with the flat layout)
+                value = [ self.burst_flat(name)[0][sort_index] ]
                 dc.add(**{name: value})
         dc.add(nch=1)
         dc.add(chi_ch=1.)
@@ -1280,7 +1681,7 @@ class Data(DataContainer):
     def _get_num_periods(self, time_s):
         """Return the number of periods using `time_s` as period duration.
         """
-        t_max_mch = np.array([ph[-1] for ph in self.iter_ph_times()])
+        t_max_mch = np.array([ph[-1] for ph in self.ph_times_m])
         # Take the ceil to have at least 1 periods
         # Take the min to avoid having ch with 0 photons in the last period
         nperiods = np.ceil(t_max_mch*self.clk_p/time_s).min().astype('int32')
@@ -1292,8 +1693,9 @@ class Data(DataContainer):
                 nperiods -= 1
         return int(nperiods)
 
+    @profiled
     def calc_bg(self, fun, time_s=60, tail_min_us=500, F_bg=2,
-                error_metrics='KS'):
+                error_metrics='KS', backend=None):
         """Compute time-dependent background rates for all the channels.
 
         Compute background rates for donor, acceptor and both detectors.
@@ -1319,6 +1721,8 @@ class Data(DataContainer):
                 threshold.
             error_metrics (string): Specifies the error metric to use.
                 See :func:`fretbursts.background.exp_fit` for more details.
+            backend (string or None): compute backend for the built-in
+                background fits. See :mod:`fretbursts.backends`.
 
         The background estimation functions are defined in the module
         `background` (conventionally imported as `bg`).
@@ -1332,7 +1736,7 @@ class Data(DataContainer):
         Returns:
             None, all the results are saved in the object itself.
         """
-        pprint(" - Calculating BG rates ... ")
+        logger.info(" - Calculating BG rates ... ")
         self._clean_bg_data()
 
         if tail_min_us == 'auto':
@@ -1342,6 +1746,7 @@ class Data(DataContainer):
             bg_auto_th = False
             Th_us = self._get_bg_th_arrays(tail_min_us)
 
+        fun = _get_bg_fit_func(fun, backend=backend)
         kwargs = dict(clk_p=self.clk_p, error_metrics=error_metrics)
         nperiods = self._get_num_periods(time_s)
         bg_time_clk = time_s/self.clk_p
@@ -1349,7 +1754,12 @@ class Data(DataContainer):
         BG, BG_dd, BG_ad, BG_da, BG_aa, Lim, Ph_p = [], [], [], [], [], [], []
         rate_m, rate_dd, rate_ad, rate_da, rate_aa = [], [], [], [], []
         BG_err, BG_dd_err, BG_ad_err, BG_da_err, BG_aa_err = [], [], [], [], []
-        for ich, ph_ch in enumerate(self.iter_ph_times()):
+        # Index of the first photon after the end of each period
+        period_ends = (np.arange(nperiods) + 1)*bg_time_clk
+        for ich in xrange(self.nch):
+            # On-disk timestamps are read one period at the time
+            ph_ch = self.ph_times_m[ich]
+            I1 = _searchsorted(ph_ch, period_ends)
             th_us_ch_all = Th_us[Ph_sel('all')][ich]
             th_us_ch_dd = Th_us[Ph_sel(Dex='Dem')][ich]
             th_us_ch_ad = Th_us[Ph_sel(Dex='Aem')][ich]
@@ -1357,19 +1767,15 @@ class Data(DataContainer):
                 th_us_ch_da = Th_us[Ph_sel(Aex='Dem')][ich]
                 th_us_ch_aa = Th_us[Ph_sel(Aex='Aem')][ich]
 
-            dd_mask = self.get_ph_mask(ich, ph_sel=Ph_sel(Dex='Dem'))
-            ad_mask = self.get_ph_mask(ich, ph_sel=Ph_sel(Dex='Aem'))
-            if self.ALEX:
-                da_mask = self.get_ph_mask(ich, ph_sel=Ph_sel(Aex='Dem'))
-                aa_mask = self.get_ph_mask(ich, ph_sel=Ph_sel(Aex='Aem'))
-
             lim, ph_p = [], []
             bg, bg_dd, bg_ad, bg_da, bg_aa = [zeros(nperiods) for _ in range(5)]
             zeros_list = [zeros(nperiods) for _ in range(5)]
             bg_err, bg_dd_err, bg_ad_err, bg_da_err, bg_aa_err = zeros_list
             for ip in xrange(nperiods):
+                progress.report('calc_bg', (ich + float(ip)/nperiods)/self.nch,
+                                ich)
                 i0 = 0 if ip == 0 else i1           # pylint: disable=E0601
-                i1 = (ph_ch < (ip+1)*bg_time_clk).sum()
+                i1 = int(I1[ip])
                 lim.append((i0, i1-1))
                 ph_p.append((ph_ch[i0], ph_ch[i1-1]))
 
@@ -1377,34 +1783,41 @@ class Data(DataContainer):
                 bg[ip], bg_err[ip] = fun(ph_i, tail_min_us=th_us_ch_all,
                                          **kwargs)
 
+                # The masks are read only for the photons in the period
+                # (on-disk masks are never loaded entirely)
+                period = slice(i0, i1)
+                dd_mask_i = self.get_ph_mask(ich, Ph_sel(Dex='Dem'), period)
+                ad_mask_i = self.get_ph_mask(ich, Ph_sel(Dex='Aem'), period)
+
                 # This supports cases of D-only or A-only timestamps
                 # where self.A_em[ich] is a bool and not a bool-array
                 # In this case, either `dd_mask` or `ad_mask` is
                 # slice(None) (all-elements selection)
-                if type(dd_mask) is slice and dd_mask == slice(None):
+                if type(dd_mask_i) is slice and dd_mask_i == slice(None):
                     bg_dd[ip], bg_dd_err[ip] = bg[ip], bg_err[ip]
                     continue
-                if type(ad_mask) is slice and ad_mask == slice(None):
+                if type(ad_mask_i) is slice and ad_mask_i == slice(None):
                     bg_ad[ip], bg_ad_err[ip] = bg[ip], bg_err[ip]
                     continue
 
-                dd_mask_i = dd_mask[i0:i1]
                 if dd_mask_i.any():
                     bg_dd[ip], bg_dd_err[ip] = fun(ph_i[dd_mask_i],
                                        tail_min_us=th_us_ch_dd, **kwargs)
 
-                ad_mask_i = ad_mask[i0:i1]
                 if ad_mask_i.any():
                     bg_ad[ip], bg_ad_err[ip] = fun(ph_i[ad_mask_i],
                                        tail_min_us=th_us_ch_ad, **kwargs)
 
-                if self.ALEX and aa_mask.any():
-                    da_mask_i = da_mask[i0:i1]
-                    bg_da[ip], bg_da_err[ip] = fun(ph_i[da_mask_i],
-                                       tail_min_us=th_us_ch_da, **kwargs)
-                    aa_mask_i = aa_mask[i0:i1]
-                    bg_aa[ip], bg_aa_err[ip] = fun(ph_i[aa_mask_i],
-                                       tail_min_us=th_us_ch_aa, **kwargs)
+                if self.ALEX:
+                    aa_mask_i = self.get_ph_mask(ich, Ph_sel(Aex='Aem'),
+                                                 period)
+                    if aa_mask_i.any():
+                        da_mask_i = self.get_ph_mask(ich, Ph_sel(Aex='Dem'),
+                                                     period)
+                        bg_da[ip], bg_da_err[ip] = fun(ph_i[da_mask_i],
+                                           tail_min_us=th_us_ch_da, **kwargs)
+                        bg_aa[ip], bg_aa_err[ip] = fun(ph_i[aa_mask_i],
+                                           tail_min_us=th_us_ch_aa, **kwargs)
 
             Lim.append(lim);     Ph_p.append(ph_p)
             BG.append(bg);       BG_err.append(bg_err)
@@ -1427,7 +1840,9 @@ class Data(DataContainer):
                  rate_dd=rate_dd, rate_ad=rate_ad,
                  rate_da=rate_da, rate_aa=rate_aa,
                  bg_th_us=Th_us, bg_auto_th=bg_auto_th)
-        pprint("[DONE]\n")
+        progress.report('calc_bg', 1., None)
+        logger.info(" - BG rates computed: %d channels, %d periods.",
+                    self.nch, nperiods)
 
     def recompute_bg_lim_ph_p(self, ph_sel=Ph_sel(Dex='Dem'), mute=False):
         """Recompute self.Lim and selp.Ph_p relative to ph selection `ph_sel`
@@ -1533,50 +1948,78 @@ class Data(DataContainer):
                  rate_th=rate_th)
 
     def _burst_search_rate(self, m, L, min_rate_cps, ph_sel=Ph_sel('all'),
-                           verbose=True, pure_python=False):
+                           verbose=False, pure_python=False, backend=None,
+                           num_threads=None):
         """Compute burst search using a fixed minimum photon rate.
 
         Arguments:
             min_rate_cps (float or array): minimum photon rate for burst start
                 if array if one value per channel.
         """
-        bsearch = _get_bsearch_func(pure_python=pure_python)
+        bsearch = _get_bsearch_func(pure_python=pure_python, backend=backend,
+                                    num_threads=num_threads)
 
         Min_rate_cps = self._param_as_mch_array(min_rate_cps)
         mburst = []
         T_clk = (1.*m/Min_rate_cps)/self.clk_p
-        for ich, (ph, t_clk) in enumerate(zip(self.iter_ph_times(ph_sel),
-                                          T_clk)):
+        all_photons = self._check_ph_sel(ph_sel) == Ph_sel('all')
+        for ich, t_clk in enumerate(T_clk):
             label = '%s CH%d' % (ph_sel, ich+1) if verbose else None
-            mb = bsearch(ph, L, m, t_clk, label=label, verbose=verbose)
+            ph = self.ph_times_m[ich]
+            if all_photons and is_on_disk(ph):
+                # Out-of-core search streaming the on-disk timestamps
+                mb = bslib.bsearch_chunks(iter_slices(ph), L, m, t_clk,
+                                          bsearch=bsearch, label=label,
+                                          verbose=verbose)
+            else:
+                ph = self.get_ph_times(ich, ph_sel=ph_sel)
+                mb = bsearch(ph, L, m, t_clk, label=label, verbose=verbose)
             mburst.append(mb)
+            progress.report('burst_search', (ich + 1.)/self.nch, ich)
         self.add(mburst=mburst, min_rate_cps=Min_rate_cps, T=T_clk*self.clk_p)
 
-    def _burst_search_TT(self, m, L, ph_sel=Ph_sel('all'), verbose=True,
-                         pure_python=False, mute=False):
+    def _burst_search_TT(self, m, L, ph_sel=Ph_sel('all'), verbose=False,
+                         pure_python=False, mute=False, backend=None,
+                         num_threads=None):
         """Compute burst search with params `m`, `L` on ph selection `ph_sel`
 
         Requires the list of arrays `self.TT` with the max time-thresholds in
         the different burst periods for each channel (use `._calc_T()`).
         """
-        bsearch = _get_bsearch_func(pure_python=pure_python)
+        bsearch = _get_bsearch_func(pure_python=pure_python, backend=backend,
+                                    num_threads=num_threads)
 
         self.recompute_bg_lim_ph_p(ph_sel=ph_sel, mute=mute)
         MBurst = []
         label = ''
-        for ich, (ph, T) in enumerate(zip(self.iter_ph_times(ph_sel),
-                                          self.TT)):
+        all_photons = self._check_ph_sel(ph_sel) == Ph_sel('all')
+        for ich, T in enumerate(self.TT):
+            if all_photons:
+                # Sliced below, so on-disk timestamps are never entirely
+                # loaded in memory
+                ph = self.ph_times_m[ich]
+            else:
+                ph = self.get_ph_times(ich, ph_sel=ph_sel)
             MB = []
             Tck = T/self.clk_p
             for ip, (l0, l1) in enumerate(self.Lim[ich]):
                 if verbose:
                     label='%s CH%d-%d' % (ph_sel, ich+1, ip)
-                mb = bsearch(ph[l0:l1+1], L, m, Tck[ip], label=label,
-                        verbose=verbose)
+                if is_on_disk(ph):
+                    # Out-of-core search streaming the period in chunks
+                    mb = bslib.bsearch_chunks(iter_slices(ph, l0, l1 + 1),
+                                              L, m, Tck[ip], bsearch=bsearch,
+                                              label=label, verbose=verbose)
+                else:
+                    mb = bsearch(ph[l0:l1+1], L, m, Tck[ip], label=label,
+                                 verbose=verbose)
                 if mb.size > 0: # if we found at least one burst
                     mb[:, iistart] += l0
                     mb[:, iiend] += l0
                     MB.append(mb)
+                progress.report('burst_search',
+                                (ich + (ip + 1.)/len(self.Lim[ich]))/self.nch,
+                                ich)
             if len(MB) > 0:
                 MBurst.append(np.vstack(MB))
             else:
@@ -1594,6 +2037,7 @@ class Data(DataContainer):
         """
         assert type(ph_sel) is Ph_sel and ph_sel != Ph_sel('all')
         pprint(' - Fixing  burst data to refer to ph_times_m ... ', mute)
+        self._cow_writeable('mburst')
         old_MBurst = [mb.copy() for mb in self.mburst]
 
         # Note that mburst is modified in-place
@@ -1611,9 +2055,11 @@ class Data(DataContainer):
             assert (mb[:, inum_ph] >= old_mb[:, inum_ph]).all()
         pprint('[DONE]\n', mute)
 
+    @profiled
     def burst_search_t(self, L=10, m=10, P=None, F=6., min_rate_cps=None,
             nofret=False, max_rate=False, dither=False, ph_sel=Ph_sel('all'),
-            verbose=False, mute=False, pure_python=False):
+            verbose=False, mute=False, pure_python=False, backend=None,
+            num_threads=None):
         """Performs a burst search with specified parameters.
 
         This method performs a sliding-window burst search without
@@ -1643,6 +2089,14 @@ class Data(DataContainer):
                 See :mod:`fretbursts.ph_sel` for details.
             pure_python (bool): if True, uses the pure python functions even
                 when the optimized Cython functions are available.
+            backend (string or None): compute backend for the burst search
+                and photon counting ('numpy', 'cython' or 'numba'). If None,
+                uses the global selection. See :mod:`fretbursts.backends`.
+            num_threads (int or None): if not None, the timestamps of each
+                channel are split in `num_threads` blocks searched in parallel
+                (see :func:`burstsearch.burstsearchlib.bsearch_parallel`).
+                The bursts are identical to the serial search. Effective
+                with a backend releasing the GIL ('numba').
 
         Note:
             when using `P` or `F` the background rates are needed, so
@@ -1661,13 +2115,15 @@ class Data(DataContainer):
         if min_rate_cps is not None:
             self._burst_search_rate(m=m, L=L, min_rate_cps=min_rate_cps,
                                     ph_sel=ph_sel, verbose=verbose,
-                                    pure_python=pure_python)
+                                    pure_python=pure_python, backend=backend,
+                                    num_threads=num_threads)
         else:
             # Compute TT
             self._calc_T(m=m, P=P, F=F, ph_sel=ph_sel)
             # Use TT and compute mburst
             self._burst_search_TT(L=L, m=m, ph_sel=ph_sel, verbose=verbose,
-                                  pure_python=pure_python, mute=mute)
+                                  pure_python=pure_python, mute=mute,
+                                  backend=backend, num_threads=num_threads)
         pprint("[DONE]\n", mute)
 
         pprint(" - Calculating burst periods ...", mute)
@@ -1686,14 +2142,40 @@ class Data(DataContainer):
         if not nofret:
             pprint(" - Counting D and A ph and calculating FRET ... \n", mute)
             self.calc_fret(count_ph=True, corrections=True, dither=dither,
-                           mute=mute, pure_python=pure_python)
+                           mute=mute, pure_python=pure_python,
+                           backend=backend)
             pprint("   [DONE Counting D/A]\n", mute)
         if max_rate:
             pprint(" - Computing max rates in burst ...", mute)
-            self.calc_max_rate(m=m)
+            self.calc_max_rate(m=m, backend=backend)
             pprint("[DONE]\n", mute)
 
-    def calc_ph_num(self, alex_all=False, pure_python=False):
+    def burst_search_cache(self, L=10, m=10, P=None, F=6., min_rate_cps=None,
+                           nofret=False, max_rate=False, dither=False,
+                           ph_sel=Ph_sel('all'), recompute=False, mute=False,
+                           **kwargs):
+        """Performs a burst search, loading the results from cache if found.
+
+        This version is the cached version of :meth:`burst_search_t`.
+        This method tries to load the burst data (bursts, photon counts, E
+        and S) from the HDF5 file in self.bg_data_file. If a saved burst
+        search with the same signature (timestamps, background and
+        parameters) is not found, it performs the burst search and stores
+        the results to the HDF5 file (see :mod:`fretbursts.burst_cache`).
+
+        The arguments are the same as :meth:`burst_search_t` with the only
+        addition of `recompute` (bool) to force a new burst search even if
+        a cached version is found.
+        """
+        burst_cache.burst_search_cache(self, L=L, m=m, P=P, F=F,
+                                       min_rate_cps=min_rate_cps,
+                                       nofret=nofret, max_rate=max_rate,
+                                       dither=dither, ph_sel=ph_sel,
+                                       recompute=recompute, mute=mute,
+                                       **kwargs)
+
+    @profiled
+    def calc_ph_num(self, alex_all=False, pure_python=False, backend=None):
         """Computes number of D, A (and AA) photons in each burst.
 
         Arguments:
@@ -1701,17 +2183,24 @@ class Data(DataContainer):
                 donor channel photons during acceptor excitation (`nda`)
             pure_python (bool): if True, uses the pure python functions even
                 when the optimized Cython functions are available.
+            backend (string or None): compute backend for photon counting.
+                See :mod:`fretbursts.backends`.
 
         Returns:
             Saves `nd`, `na`, `nt` (and eventually `naa`, `nda`) in self.
             Returns None.
         """
-        mch_count_ph_in_bursts = _get_mch_count_ph_in_bursts_func(pure_python)
+        mch_count_ph_in_bursts = _get_mch_count_ph_in_bursts_func(
+            pure_python, backend=backend)
 
         if not self.ALEX:
             nt = [b_size(b).astype(float) if b.size > 0 else np.array([])\
                         for b in self.mburst]
-            A_em = [self.get_A_em(ich) for ich in xrange(self.nch)]
+            if is_on_disk(self.A_em[0]):
+                # Out-of-core: on-disk masks are streamed in chunks below
+                A_em = self.A_em
+            else:
+                A_em = [self.get_A_em(ich) for ich in xrange(self.nch)]
             if type(A_em[0]) is slice:
                 # This to support the case of A-only or D-only data
                 n0 = [np.zeros(mb.shape[0]) for mb in self.mburst]
@@ -1719,6 +2208,10 @@ class Data(DataContainer):
                     nd, na = n0, nt    # A-only case
                 elif A_em[0] == slice(0):
                     nd, na = nt, n0    # D-only case
+            elif is_on_disk(A_em[0]):
+                na = [bslib.count_ph_in_bursts_chunks(mb, iter_slices(a_em))
+                      for mb, a_em in zip(self.mburst, A_em)]
+                nd = [t - a for t, a in zip(nt, na)]
             else:
                 # This is the usual case with photons in both D and A channel
                 na = mch_count_ph_in_bursts(self.mburst, Mask=A_em)
@@ -1747,7 +2240,8 @@ class Data(DataContainer):
                  dir_ex_corrected=False, dithering=False)
 
 
-    def fuse_bursts(self, ms=0, process=True, mute=False):
+    @profiled
+    def fuse_bursts(self, ms=0, process=True, mute=False, backend=None):
         """Return a new :class:`Data` object with nearby bursts fused together.
 
         Arguments:
@@ -1757,11 +2251,14 @@ class Data(DataContainer):
             process (bool): if True (default), reprocess the burst data in
                 the new object applying corrections and computing FRET.
             mute (bool): if True suppress any printed output.
+            backend (string or None): compute backend for the burst fusion.
+                See :mod:`fretbursts.backends`.
 
         """
         if ms < 0: return self
-        mburst = mch_fuse_bursts(self.mburst, ms=ms, clk_p=self.clk_p)
-        new_d = Data(**self)
+        mburst = mch_fuse_bursts(self.mburst, ms=ms, clk_p=self.clk_p,
+                                 backend=backend)
+        new_d = self._shallow_copy()
         for k in ['E', 'S', 'nd', 'na', 'naa', 'nt', 'lsb', 'bp']:
             if k in new_d: new_d.delete(k)
         new_d.add(bg_corrected=False, leakage_corrected=False,
@@ -1783,6 +2280,7 @@ class Data(DataContainer):
         """
         if self.bg_corrected: return -1
         pprint("   - Applying background correction.\n", mute)
+        self._cow_writeable('nd', 'na', 'nt', 'naa', 'nda')
         self.add(bg_corrected=True)
         for ich, mb in enumerate(self.mburst):
             if mb.size == 0: continue  # if no bursts skip this ch
@@ -1807,6 +2305,7 @@ class Data(DataContainer):
         if self.leakage_corrected: return -1
         pprint("   - Applying leakage correction.\n", mute)
         assert (size(self.leakage) == 1) or (size(self.leakage) == self.nch)
+        self._cow_writeable('na')
         Lk = self.get_leakage_array()
         for i in range(self.nch):
             if self.na[i].size == 0: continue  # if no bursts skip this ch
@@ -1822,6 +2321,7 @@ class Data(DataContainer):
         """
         if self.dir_ex_corrected: return -1
         pprint("   - Applying direct excitation correction.\n", mute)
+        self._cow_writeable('na')
         for i in range(self.nch):
             if self.na[i].size == 0: continue  # if no bursts skip this ch
             self.na[i] -= self.naa[i]*self.dir_ex
@@ -1835,6 +2335,7 @@ class Data(DataContainer):
         """
         if self.dithering: return -1
         pprint("   - Applying burst-size dithering.\n", mute)
+        self._cow_writeable('nd', 'na', 'naa', 'nda')
         self.add(dithering=True)
         for nd, na in zip(self.nd, self.na):
             nd += lsb*(np.random.rand(nd.size)-0.5)
@@ -1861,6 +2362,7 @@ class Data(DataContainer):
         chi_ch = (1/EE - 1)/(1/self.E_fit - 1)
         return chi_ch
 
+    @profiled
     def corrections(self, mute=False):
         """Apply corrections on burst-counts: nd, na, nda, naa.
 
@@ -1991,14 +2493,18 @@ class Data(DataContainer):
         return sbr
 
 
-    def calc_max_rate(self, m, ph_sel=Ph_sel('all')):
+    @profiled
+    def calc_max_rate(self, m, ph_sel=Ph_sel('all'), backend=None):
         """Compute the max m-photon rate reached in each burst.
 
         Arguments:
             m (int): number of timestamps to use to compute the rate
             ph_sel (Ph_sel object): object defining the photon selection.
                 See :mod:`fretbursts.ph_sel` for details.
+            backend (string or None): compute backend. See
+                :mod:`fretbursts.backends`.
         """
+        b_rate_max = backends.get('b_rate_max', backend)
         if ph_sel == Ph_sel('all'):
             Max_Rate = [b_rate_max(ph_data=ph, m=m, bursts=mb)
                     for ph, mb in zip(self.iter_ph_times(), self.mburst)]
@@ -2013,8 +2519,9 @@ class Data(DataContainer):
         self.add(max_rate=Max_Rate)
 
 
+    @profiled
     def calc_fret(self, count_ph=False, corrections=True, dither=False,
-                  mute=False, pure_python=False):
+                  mute=False, pure_python=False, backend=None):
         """Compute FRET (and stoichiometry if ALEX) for each burst.
 
         This is an high-level functions that can be run after burst search.
@@ -2032,12 +2539,15 @@ class Data(DataContainer):
             mute (bool): whether to mute all the printed output. Default False.
             pure_python (bool): if True, uses the pure python functions even
                 when the optimized Cython functions are available.
+            backend (string or None): compute backend for photon counting.
+                See :mod:`fretbursts.backends`.
 
         Returns:
             None, all the results are saved in the object.
         """
         if count_ph:
-            self.calc_ph_num(pure_python=pure_python, alex_all=True)
+            self.calc_ph_num(pure_python=pure_python, alex_all=True,
+                             backend=backend)
         if dither:
             self.dither(mute=mute)
         if corrections:
@@ -2053,12 +2563,26 @@ class Data(DataContainer):
     def calculate_fret_eff(self):
         """Compute FRET efficiency (`E`) for each burst."""
         G = self.get_gamma_array()
+        flat = self._get_flat('nd', 'na')
+        if flat is not None:
+            # Flat layout: compute all the channels at once
+            (nd, na), offsets = flat
+            g = np.repeat(G, np.diff(offsets))
+            self._add_flat('E', 1.*na/(g*nd+na), offsets)
+            return
         E = [1.*na/(g*nd+na) for nd, na, g in zip(self.nd, self.na, G)]
         self.add(E=E)
 
     def calculate_stoich(self):
         """Compute "stoichiometry" (the `S` parameter) for each burst."""
         G = self.get_gamma_array()
+        flat = self._get_flat('nd', 'na', 'naa')
+        if flat is not None:
+            # Flat layout: compute all the channels at once
+            (d, a, aa), offsets = flat
+            g = np.repeat(G, np.diff(offsets))
+            self._add_flat('S', 1.0*(g*d+a)/(g*d+a+aa), offsets)
+            return
         S = [1.0*(g*d+a)/(g*d+a+aa) for d, a, aa, g in
                 zip(self.nd, self.na, self.naa, G)]
         self.add(S=S)
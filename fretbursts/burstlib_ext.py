@@ -51,6 +51,7 @@ import tables
 
 from ph_sel import Ph_sel
 import burstsearch.burstsearchlib as bslib
+import backends
 import background as bg
 from utils.misc import pprint
 
@@ -575,7 +576,7 @@ def join_data(d_list, gap=1):
         assert d.nch == nch
         assert d.bg_time_s == bg_time_s
 
-    new_d = Data(**d_list[0])
+    new_d = d_list[0]._shallow_copy()
     new_d.delete('ph_times_m')
 
     # Set the bursts fields by concatenation along axis = 0
@@ -625,12 +626,12 @@ def join_data(d_list, gap=1):
             mask = new_d.i_origin[ich] == i_orig
             new_d.mburst[ich][mask, itstart] += offset_clk
             new_d.mburst[ich][mask, itend] += offset_clk
-        offset_clk += (d_orig.time_max() + gap)/d_orig.clk_p
+        offset_clk += int((d_orig.time_max() + gap)/d_orig.clk_p)
 
     return new_d
 
 def burst_search_and_gate(dx, F=6, m=10, ph_sel1=Ph_sel(Dex='DAem'),
-                          ph_sel2=Ph_sel(Aex='Aem'), mute=False):
+                          ph_sel2=Ph_sel(Aex='Aem'), mute=False, backend=None):
     """Return a Data object containing bursts obtained by and-gate burst-search.
 
     The and-gate burst search is a composition of 2 burst searches performed
@@ -650,6 +651,8 @@ def burst_search_and_gate(dx, F=6, m=10, ph_sel1=Ph_sel(Dex='DAem'),
         ph_sel1 (Ph_sel object): photon selections used for bursts search 1.
         ph_sel2 (Ph_sel object): photon selections used for bursts search 2.
         mute (bool): if True nothing is printed. Default: False.
+        backend (string or None): compute backend for the burst search and
+            intersection. See :mod:`fretbursts.backends`.
 
     Return:
         A new `Data` object containing bursts from the and-gate search.
@@ -660,12 +663,15 @@ def burst_search_and_gate(dx, F=6, m=10, ph_sel1=Ph_sel(Dex='DAem'),
     dx_a = dx.copy(mute=mute)
     dx_and = dx.copy(mute=mute)
 
-    dx_d.burst_search_t(L=m, m=m, F=F, ph_sel=ph_sel1, mute=mute)
-    dx_a.burst_search_t(L=m, m=m, F=F, ph_sel=ph_sel2, mute=mute)
+    dx_d.burst_search_t(L=m, m=m, F=F, ph_sel=ph_sel1, mute=mute,
+                        backend=backend)
+    dx_a.burst_search_t(L=m, m=m, F=F, ph_sel=ph_sel2, mute=mute,
+                        backend=backend)
 
+    burst_and = backends.get('burst_and', backend)
     mburst_and = []
     for mburst_d, mburst_a in zip(dx_d.mburst, dx_a.mburst):
-        mburst_and.append(bslib.burst_and(mburst_d, mburst_a))
+        mburst_and.append(burst_and(mburst_d, mburst_a))
 
     dx_and.add(mburst=mburst_and)
 
@@ -39,8 +39,12 @@ To obtain the burst size (number of photons) for the 10-th to 20-th burst::
 """
 
 from __future__ import division
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from fretbursts.utils.misc import pprint
+from fretbursts.utils.progress import logger
+from fretbursts import backends
 
 
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -87,7 +91,7 @@ def b_separation(bursts):
 #  LOW-LEVEL BURST SEARCH FUNCTIONS
 #
 
-def bsearch_py(t, L, m, T, label='Burst search', verbose=True):
+def bsearch_py(t, L, m, T, label='Burst search', verbose=False):
     """Sliding window burst search. Pure python implementation.
 
     Finds bursts in the array `t` (int64). A burst starts when the photon rate
@@ -102,8 +106,9 @@ def bsearch_py(t, L, m, T, label='Burst search', verbose=True):
             (or counts) < L are discarded.
         m (int): number of consecutive photons used to compute the rate.
         T (float): max time separation of `m` photons to be inside a burst
-        label (string): a label printed when the function is called
-        verbose (bool): if False, the function does not print anything.
+        label (string): a label logged when the function is called
+        verbose (bool): if True, logs `label` (logger 'fretbursts', level
+            DEBUG). Default False.
 
     Returns:
         2D array of burst data, one row per burst, shape (N, 6), type int64.
@@ -112,7 +117,7 @@ def bsearch_py(t, L, m, T, label='Burst search', verbose=True):
         To extract burst information it's safer to use the utility functions
         `b_*` (i.e. :func:`b_start`, :func:`b_size`, :func:`b_width`, etc...).
     """
-    if verbose: pprint('Python search (v): %s\n' % label)
+    if verbose: logger.debug('Python search (v): %s', label)
     bursts = []
     in_burst = False
     above_min_rate = (t[m-1:] - t[:t.size-m+1]) <= T
@@ -135,6 +140,172 @@ def bsearch_py(t, L, m, T, label='Burst search', verbose=True):
     return np.array(bursts, dtype=np.int64)
 
 
+def _open_burst_start(t, m, T):
+    """Return the index of the first photon needed to continue the search.
+
+    This is the start of the burst still in progress at the end of `t` or,
+    if there is no burst in progress, the first of the last `m` - 1 photons.
+    """
+    if t.size < m:
+        return 0
+    num_windows = t.size - m + 1
+    if t[-1] - t[-m] > T:
+        return num_windows
+    # Scan backward, in growing blocks, for the last window below rate
+    size = 1024
+    while True:
+        i0 = max(0, num_windows - size)
+        above_min_rate = (t[i0+m-1:] - t[i0:num_windows]) <= T
+        below = np.nonzero(~above_min_rate)[0]
+        if below.size > 0:
+            return i0 + below[-1] + 1
+        if i0 == 0:
+            return 0
+        size *= 4
+
+def bsearch_chunks(chunks, L, m, T, bsearch=bsearch_py, label='Burst search',
+                   verbose=False):
+    """Sliding window burst search on timestamps split in consecutive chunks.
+
+    The result is identical to `bsearch(np.hstack(chunks), L, m, T)` but only
+    the current chunk and the photons of the burst in progress (which are
+    carried to the next chunk) are kept in memory. This allows to search
+    bursts in on-disk arrays of any size.
+
+    Arguments:
+        chunks (iterable): sequence of consecutive arrays of timestamps.
+        L, m, T: burst search parameters, see :func:`bsearch_py`.
+        bsearch (function): burst search function used on each chunk.
+        label (string): a label logged when the function is called
+        verbose (bool): if True, logs `label` (logger 'fretbursts', level
+            DEBUG). Default False.
+
+    Returns:
+        2D array of burst data, one row per burst, shape (N, 6), type int64.
+        The photon indexes are relative to the start of the first chunk.
+    """
+    if verbose: logger.debug('Chunked search: %s', label)
+    bursts = []
+    carry = np.zeros(0, dtype=np.int64)
+    offset = 0   # index of the first photon in `carry`
+    for chunk in chunks:
+        t = np.hstack([carry, chunk]) if carry.size > 0 else chunk
+        if t.size >= m:
+            mburst = bsearch(t, L, m, T)
+            if mburst.size > 0:
+                mburst[:, iistart] += offset
+                mburst[:, iiend] += offset
+                bursts.append(mburst)
+        i_carry = _open_burst_start(t, m, T)
+        carry = t[i_carry:]
+        offset += i_carry
+    if len(bursts) == 0:
+        return np.array([], dtype=np.int64)
+    return np.vstack(bursts)
+
+
+def _bsearch_block(t, m, T, bsearch, start, stop):
+    """Search the rate-windows from `start` to `stop` (excluded) in `t`.
+
+    Returns the (start, stop) window indexes of the bursts ending in the
+    block, whether the first window is above the rate threshold and the
+    start window of the burst still in progress at the end of the block
+    (None if no burst is in progress).
+    """
+    t_block = t[start:stop + m - 1]
+    mburst = bsearch(t_block, 0, m, T)
+    if mburst.size > 0:
+        run_start = mburst[:, iistart] + start
+        run_stop = mburst[:, iiend] + start - m + 2
+    else:
+        run_start = run_stop = np.zeros(0, dtype=np.int64)
+    first_above = t_block[m-1] - t_block[0] <= T
+    open_start = _open_burst_start(t_block, m, T)
+    open_start = None if open_start == stop - start else open_start + start
+    return run_start, run_stop, first_above, open_start
+
+def bsearch_parallel(t, L, m, T, bsearch=bsearch_py, num_threads=None,
+                     num_blocks=None, label='Burst search', verbose=False):
+    """Sliding window burst search on time blocks searched in parallel.
+
+    The timestamps are split in `num_blocks` blocks overlapping by `m` - 1
+    photons (so that each rate-window belongs to exactly one block). The
+    blocks are searched concurrently and the bursts crossing the block
+    edges are stitched together. The result is identical to
+    `bsearch(t, L, m, T)`, including the photon indexes.
+
+    The blocks are searched by a pool of threads, therefore the speed-up
+    is significant only when `bsearch` releases the GIL (i.e. the numba
+    backend, see :func:`burstsearchlib_numba.bsearch_numba`).
+
+    Arguments:
+        t (array, int64): array of timestamps on which to perform the search
+        L, m, T: burst search parameters, see :func:`bsearch_py`.
+        bsearch (function): burst search function used on each block.
+        num_threads (int or None): number of threads. If None, uses the
+            number of CPUs.
+        num_blocks (int or None): number of blocks. If None, uses
+            `num_threads`.
+        label (string): a label logged when the function is called
+        verbose (bool): if True, logs `label` (logger 'fretbursts', level
+            DEBUG). Default False.
+
+    Returns:
+        2D array of burst data, one row per burst, shape (N, 6), type int64.
+    """
+    if verbose: logger.debug('Parallel search: %s', label)
+    if num_threads is None:
+        num_threads = multiprocessing.cpu_count()
+    if num_blocks is None:
+        num_blocks = num_threads
+    num_windows = t.size - m + 1
+    if num_blocks <= 1 or num_windows < num_blocks:
+        return bsearch(t, L, m, T)
+
+    edges = np.linspace(0, num_windows, num_blocks + 1).astype(np.int64)
+    search_block = lambda i: _bsearch_block(t, m, T, bsearch,
+                                            edges[i], edges[i + 1])
+    pool = ThreadPool(num_threads)
+    try:
+        blocks = pool.map(search_block, range(num_blocks))
+    finally:
+        # Wait for the worker threads to exit (the pool is not reused)
+        pool.close()
+        pool.join()
+
+    # Stitch the bursts in progress at the block edges
+    starts, stops = [], []
+    carry = None   # start window of the burst in progress
+    for edge, (run_start, run_stop, first_above, open_start) in \
+            zip(edges[:-1], blocks):
+        if carry is not None:
+            if not first_above:
+                # The burst ends exactly at the block edge
+                starts.append([carry]), stops.append([edge])
+                carry = None
+            elif run_start.size > 0:
+                # The first burst of the block started in a previous block
+                run_start = run_start.copy()
+                run_start[0] = carry
+                carry = None
+            else:
+                # The burst continues through the whole block
+                continue
+        starts.append(run_start), stops.append(run_stop)
+        carry = open_start
+    start, stop = np.hstack(starts), np.hstack(stops)
+
+    # Build the burst array as in `bsearch_py`
+    i_end = stop + m - 1
+    valid = i_end - start >= L
+    start, i_end = start[valid], i_end[valid]
+    if start.size == 0:
+        return np.array([], dtype=np.int64)
+    burst_start, burst_end = t[start], t[i_end - 1]
+    return np.vstack([burst_start, burst_end - burst_start, i_end - start,
+                      start, i_end - 1, burst_end]).T.astype(np.int64)
+
+
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #  Functions to count D and A photons in bursts
 #
@@ -193,25 +364,60 @@ def mch_count_ph_in_bursts_py(Mburst, Mask):
     return Num_ph
 
 
+def count_ph_in_bursts_chunks(bursts, mask_chunks):
+    """Counts number of photons in each burst counting only photons in `mask`.
+
+    Same as :func:`count_ph_in_bursts_py` but the boolean mask is passed as
+    a sequence of consecutive chunks, so that it is never entirely loaded
+    in memory. The memory usage is O(chunk size + number of bursts).
+
+    Arguments:
+        bursts (2D array, int64): burst-array.
+        mask_chunks (iterable): sequence of consecutive chunks of the
+            boolean photon mask.
+
+    Returns:
+        1D array (float) with the number of photons in the photon selection
+        `mask` for each burst.
+    """
+    if bursts.size == 0:
+        return np.zeros(0)
+    # Number of photons in `mask` before each burst start and after the end
+    positions = np.hstack([bursts[:, iistart], bursts[:, iiend] + 1])
+    order = positions.argsort(kind='mergesort')
+    sorted_pos = positions[order]
+    num_before = np.zeros(positions.size, dtype=np.int64)
+    i0, num_ph, k = 0, 0, 0   # chunk start, counts before i0, position index
+    for chunk in mask_chunks:
+        cum_num_ph = np.hstack([0, np.cumsum(chunk, dtype=np.int64)])
+        i1 = i0 + chunk.size
+        k1 = np.searchsorted(sorted_pos, i1, side='right')
+        num_before[order[k:k1]] = num_ph + cum_num_ph[sorted_pos[k:k1] - i0]
+        num_ph += cum_num_ph[-1]
+        i0, k = i1, k1
+    nbursts = bursts.shape[0]
+    return (num_before[nbursts:] - num_before[:nbursts]).astype(float)
+
+
 ##
-#  Try to import the optimized Cython functions
+#  Default implementations: the fastest available backend, chosen at the
+#  first call (see :mod:`fretbursts.backends`) so that importing this
+#  module does not import the optional backends (i.e. numba).
 #
 
-try:
-    from burstsearchlib_c import bsearch_c
-    bsearch = bsearch_c
-    print " - Optimized (cython) burst search loaded."
-except ImportError:
-    bsearch = bsearch_py
-    print " - Fallback to pure python burst search."
-
-try:
-    from burstsearchlib_c import mch_count_ph_in_bursts_c
-    mch_count_ph_in_bursts = mch_count_ph_in_bursts_c
-    print " - Optimized (cython) photon counting loaded."
-except ImportError:
-    mch_count_ph_in_bursts = mch_count_ph_in_bursts_py
-    print " - Fallback to pure python photon counting."
+def bsearch(t, L, m, T, label='Burst search', verbose=False):
+    """Sliding window burst search with the fastest available backend.
+
+    Same arguments and return value of :func:`bsearch_py`.
+    """
+    return backends.get('bsearch')(t, L, m, T, label=label, verbose=verbose)
+
+def mch_count_ph_in_bursts(Mburst, Mask):
+    """Count photons in bursts with the fastest available backend.
+
+    Same arguments and return value of :func:`mch_count_ph_in_bursts_py`.
+    """
+    return backends.get('mch_count_ph_in_bursts')(Mburst, Mask)
 
 ##
 #  Additional functions processing burst data
@@ -250,9 +456,10 @@ def burst_and(bursts_d, bursts_a):
             continue
 
         # Assign start and stop according the AND rule
-        if bstart_a[i_a] < bstart_d[i_d] < bend_a[i_a]:
+        # (the bursts overlap, the intersection starts at the later start)
+        if bstart_d[i_d] >= bstart_a[i_a]:
             start_burst = bursts_d[i_d]
-        elif bstart_d[i_d] < bstart_a[i_a] < bend_d[i_d]:
+        else:
             start_burst = bursts_a[i_a]
 
         if bend_d[i_d] < bend_a[i_a]:
@@ -274,7 +481,27 @@ def burst_and(bursts_d, bursts_a):
 
         bursts.append(burst)
 
-    return np.vstack(bursts)
+    return np.array(bursts, dtype=np.int64)
+
+def merge_bursts_order(starts, offsets):
+    """Return the order of the bursts of all the channels by start time.
+
+    Arguments:
+        starts (array): start times of the bursts of all the channels
+            concatenated (see :mod:`fretbursts.utils.ragged`). The bursts
+            of each channel are sorted.
+        offsets (array): channel offsets in `starts` (size nch + 1).
+
+    Returns:
+        An index array sorting `starts` (bursts with equal start keep the
+        channel order) and the array of the channel of each sorted burst
+        (uint8, or int16 for more than 256 channels).
+    """
+    nch = offsets.size - 1
+    dtype = 'uint8' if nch <= 256 else 'int16'
+    sort_index = starts.argsort(kind='mergesort')
+    ich_burst = np.repeat(np.arange(nch, dtype=dtype), np.diff(offsets))
+    return sort_index, ich_burst[sort_index]
 
 
 #
\ No newline at end of file
@@ -11,17 +11,13 @@ To compile run::
 
 """
 
-import sys
 import numpy as np
 cimport numpy as np
 
-cdef pprint(s):
-    """Print immediately, even if inside a busy loop."""
-    sys.stdout.write(s)
-    sys.stdout.flush()
+from fretbursts.utils.progress import logger
 
 def bsearch_c(np.int64_t[:] t, np.int16_t L, np.int16_t m, np.float64_t T,
-              label='burst search', verbose=True):
+              label='burst search', verbose=False):
     """Sliding window burst search. Cython implementation (fastest version).
 
     Finds bursts in the array `t` (int64). A burst starts when the photon rate
@@ -36,8 +32,9 @@ def bsearch_c(np.int64_t[:] t, np.int16_t L, np.int16_t m, np.float64_t T,
             (or counts) < L are discarded.
         m (int16): number of consecutive photons used to compute the rate.
         T (float64): max time separation of `m` photons to be inside a burst
-        label (string): a label printed when the function is called
-        verbose (bool): if False, the function does not print anything.
+        label (string): a label logged when the function is called
+        verbose (bool): if True, logs `label` (logger 'fretbursts', level
+            DEBUG). Default False.
 
     Returns:
         2D array of burst data, one row per burst, shape (N, 6), type int64.
@@ -51,7 +48,7 @@ def bsearch_c(np.int64_t[:] t, np.int16_t L, np.int16_t m, np.float64_t T,
     cdef np.int8_t[:] above_min_rate = np.empty(t.size - m + 1, dtype='int8')
     cdef np.int8_t in_burst = False
 
-    if verbose: pprint('C Burst search: %s\n' % label)
+    if verbose: logger.debug('C Burst search: %s', label)
     bursts = []
 
     for i in xrange(t.size-m+1):
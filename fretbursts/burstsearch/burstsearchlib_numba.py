@@ -0,0 +1,351 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Numba-compiled version of the burst search and burst-data functions.
+
+This module requires `numba` and it is an alternative to the Cython
+extension :mod:`burstsearchlib_c` that needs no compilation step.
+The functions are compiled on first call and the compiled code is cached
+on disk, so the compilation overhead is paid only once.
+
+The functions have the same signature and return the same results of the
+reference implementations in :mod:`burstsearchlib` and
+:mod:`fretbursts.burstlib`. They are selected through
+:mod:`fretbursts.backends` (backend 'numba').
+"""
+
+from __future__ import division
+import numpy as np
+import numba
+
+from fretbursts.utils.progress import logger
+from burstsearchlib import itstart, iwidth, inum_ph, iistart, iiend, itend
+
+
+## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#  Burst search
+#
+
+@numba.njit(cache=True, nogil=True)
+def _bsearch(t, L, m, T):
+    bursts = np.zeros((1024, 6), dtype=np.int64)
+    num_bursts = 0
+    in_burst = False
+    i_start = 0
+    for i in range(t.size - m + 1):
+        if (t[i + m - 1] - t[i]) <= T:
+            if not in_burst:
+                i_start = i
+                in_burst = True
+        elif in_burst:
+            in_burst = False
+            i_end = i + m - 1
+            if i_end - i_start >= L:
+                if num_bursts == bursts.shape[0]:
+                    # Grow the burst array
+                    new_bursts = np.zeros((2*num_bursts, 6), dtype=np.int64)
+                    new_bursts[:num_bursts] = bursts
+                    bursts = new_bursts
+                burst_start, burst_end = t[i_start], t[i_end - 1]
+                bursts[num_bursts, itstart] = burst_start
+                bursts[num_bursts, iwidth] = burst_end - burst_start
+                bursts[num_bursts, inum_ph] = i_end - i_start
+                bursts[num_bursts, iistart] = i_start
+                bursts[num_bursts, iiend] = i_end - 1
+                bursts[num_bursts, itend] = burst_end
+                num_bursts += 1
+    return bursts[:num_bursts].copy()
+
+def bsearch_numba(t, L, m, T, label='Burst search', verbose=False):
+    """Sliding window burst search. Numba implementation.
+
+    Finds bursts in the array `t` (int64). A burst starts when the photon rate
+    is above a minimum threshold, and ends when the rate falls below the same
+    threshold. The rate-threshold is defined by the ratio `m`/`T` (`m` photons
+    in a time interval `T`). A burst is discarded if it has less than `L`
+    photons.
+
+    Arguments:
+        t (array, int64): array of timestamps on which to perform the search
+        L (int): minimum number of photons in a bursts. Bursts with size
+            (or counts) < L are discarded.
+        m (int): number of consecutive photons used to compute the rate.
+        T (float): max time separation of `m` photons to be inside a burst
+        label (string): a label logged when the function is called
+        verbose (bool): if True, logs `label` (logger 'fretbursts', level
+            DEBUG). Default False.
+
+    Returns:
+        2D array of burst data, one row per burst, shape (N, 6), type int64.
+        See :func:`burstsearchlib.bsearch_py` for details.
+    """
+    if verbose: logger.debug('Numba search: %s', label)
+    bursts = _bsearch(np.asarray(t, dtype=np.int64), int(L), int(m),
+                      float(T))
+    if bursts.shape[0] == 0:
+        # Same as the other implementations
+        return np.array([], dtype=np.int64)
+    return bursts
+
+
+## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#  Functions to count D and A photons in bursts
+#
+
+@numba.njit(cache=True)
+def _count_ph_in_bursts(bursts, mask):
+    num_ph = np.zeros(bursts.shape[0], dtype=np.int64)
+    for i in range(bursts.shape[0]):
+        n = 0
+        for ii in range(bursts[i, iistart], bursts[i, iiend] + 1):
+            if mask[ii]:
+                n += 1
+        num_ph[i] = n
+    return num_ph
+
+def mch_count_ph_in_bursts_numba(Mburst, Mask):
+    """Counts number of photons in each burst counting only photons in `Mask`.
+
+    Arguments:
+        Mburst (list of 2D arrays, int64): a list of burst-arrays, one per ch.
+        Mask (list of 1D boolean arrays): a list of photon masks (one per ch),
+            For each channel, the boolean mask must be of the same size of the
+            timestamp array used for burst search.
+
+    Returns:
+        A list of 1D arrays, each containing the number of photons in the
+        photon selection mask.
+    """
+    Num_ph = []
+    for bursts, mask in zip(Mburst, Mask):
+        if bursts.size == 0:
+            Num_ph.append(np.zeros(0))
+            continue
+        num_ph = _count_ph_in_bursts(bursts, np.asarray(mask, dtype=bool))
+        Num_ph.append(num_ph.astype(float))
+    return Num_ph
+
+
+## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#  Functions processing burst data
+#
+
+@numba.njit(cache=True)
+def _burst_and(bursts_d, bursts_a):
+    bursts = np.zeros((bursts_d.shape[0] + bursts_a.shape[0], 6),
+                      dtype=np.int64)
+    num_bursts = 0
+    i_d, i_a = 0, 0
+    while i_d < bursts_d.shape[0] and i_a < bursts_a.shape[0]:
+        # Skip any disjoint burst
+        if bursts_a[i_a, itend] < bursts_d[i_d, itstart]:
+            i_a += 1
+            continue
+        if bursts_d[i_d, itend] < bursts_a[i_a, itstart]:
+            i_d += 1
+            continue
+
+        # Assign start and stop according the AND rule
+        if bursts_d[i_d, itstart] >= bursts_a[i_a, itstart]:
+            start_burst = bursts_d[i_d]
+        else:
+            start_burst = bursts_a[i_a]
+
+        if bursts_d[i_d, itend] < bursts_a[i_a, itend]:
+            end_burst = bursts_d[i_d]
+            i_d += 1
+        else:
+            end_burst = bursts_a[i_a]
+            i_a += 1
+
+        burst = bursts[num_bursts]
+        burst[itstart] = start_burst[itstart]
+        burst[iistart] = start_burst[iistart]
+        burst[itend] = end_burst[itend]
+        burst[iiend] = end_burst[iiend]
+
+        # Compute new width and size
+        burst[iwidth] = burst[itend] - burst[itstart]
+        burst[inum_ph] = burst[iiend] - burst[iistart] + 1
+        num_bursts += 1
+    return bursts[:num_bursts].copy()
+
+def burst_and_numba(bursts_d, bursts_a):
+    """From 2 burst arrays return bursts defined as intersection (AND rule).
+
+    See :func:`burstsearchlib.burst_and` for details.
+    """
+    if bursts_d.size == 0 or bursts_a.size == 0:
+        return np.array([], dtype=np.int64)
+    bursts = _burst_and(bursts_d, bursts_a)
+    if bursts.shape[0] == 0:
+        return np.array([], dtype=np.int64)
+    return bursts
+
+@numba.njit(cache=True)
+def _fuse_bursts(bursts, max_delay_clk):
+    fused_bursts = np.zeros_like(bursts)
+    num_bursts = 0
+    fused_burst = bursts[0].copy()
+    for i in range(1, bursts.shape[0]):
+        burst2 = bursts[i]
+        separation = burst2[itstart] - fused_burst[itend]
+        if separation <= max_delay_clk:
+            width = fused_burst[iwidth] + burst2[iwidth]
+            num_ph = fused_burst[inum_ph] + burst2[inum_ph]
+            if fused_burst[iiend] >= burst2[iistart]:
+                num_ph -= fused_burst[iiend] - burst2[iistart] + 1
+                width -= fused_burst[itend] - burst2[itstart]
+            fused_burst[iwidth] = width
+            fused_burst[inum_ph] = num_ph
+            fused_burst[iiend] = burst2[iiend]
+            fused_burst[itend] = burst2[itend]
+        else:
+            fused_bursts[num_bursts] = fused_burst
+            num_bursts += 1
+            fused_burst = burst2.copy()
+    fused_bursts[num_bursts] = fused_burst
+    num_bursts += 1
+    return fused_bursts[:num_bursts].copy()
+
+def fuse_bursts_numba(bursts, ms=0, clk_p=12.5e-9, verbose=False):
+    """Fuse bursts separated by less than `ms` (milli-secs).
+
+    Single-pass implementation giving the same result as
+    :func:`fretbursts.burstlib.fuse_bursts_iter`.
+
+    Parameters:
+        bursts (2D array): Nx6 array of burst data, one row per burst
+            See `burstseach.burstseachlib.py` for details.
+        ms (float):
+            minimum waiting time between bursts (in millisec). Burst closer
+            than that will be fused in a single burst.
+        clk_p (float): clock period or timestamp units in seconds.
+        verbose (bool): if True log a summary of fused bursts (logger
+            'fretbursts', level INFO).
+
+    Returns:
+        new_bursts (2D array): new array of burst data
+    """
+    init_nburst = bursts.shape[0]
+    if init_nburst == 0:
+        return bursts
+    max_delay_clk = (ms*1e-3)/clk_p
+    new_bursts = _fuse_bursts(bursts, max_delay_clk)
+    if verbose:
+        delta_b = init_nburst - new_bursts.shape[0]
+        logger.info(" --> END Fused %d bursts (%.1f%%)",
+                    delta_b, 100.*delta_b/init_nburst)
+    return new_bursts
+
+@numba.njit(cache=True, error_model='numpy')
+def _b_rate_max(ph_data, bursts, m, mask, use_mask):
+    rates = np.zeros(bursts.shape[0])
+    max_size = 0
+    for i in range(bursts.shape[0]):
+        max_size = max(max_size, bursts[i, iiend] - bursts[i, iistart] + 1)
+    burst_ph = np.zeros(max_size, dtype=ph_data.dtype)
+    for i in range(bursts.shape[0]):
+        # Copy the (selected) photons of current burst
+        size = 0
+        for ii in range(bursts[i, iistart], bursts[i, iiend] + 1):
+            if not use_mask or mask[ii]:
+                burst_ph[size] = ph_data[ii]
+                size += 1
+        if size < m:
+            rates[i] = np.nan
+            continue
+        rate_max = -np.inf
+        for j in range(size - m + 1):
+            rate = m/(burst_ph[j + m - 1] - burst_ph[j])
+            if rate > rate_max:
+                rate_max = rate
+        rates[i] = rate_max
+    return rates
+
+def b_rate_max_numba(ph_data, bursts, m, mask=None):
+    """Returns the max m-photons rate reached inside each burst.
+
+    See :func:`fretbursts.burstlib.b_rate_max` for details.
+    """
+    if bursts.size == 0:
+        return np.zeros(0)
+    use_mask = mask is not None
+    if not use_mask:
+        mask = np.zeros(1, dtype=bool)
+    return _b_rate_max(ph_data, bursts, int(m), np.asarray(mask, dtype=bool),
+                       use_mask)
+
+@numba.njit(cache=True)
+def _merge_bursts_order(starts, offsets, sort_index, ich_burst):
+    """K-way merge of the channels using a binary heap of channels.
+
+    The heap contains the start of the next burst of each channel
+    (`heap_start`) and the channel (`heap_ch`). Channels with equal start
+    are ordered by channel number.
+    """
+    nch = offsets.size - 1
+    pos = offsets[:-1].copy()
+    heap_start = np.zeros(nch, dtype=np.int64)
+    heap_ch = np.zeros(nch, dtype=np.int64)
+    size = 0
+    for ich in range(nch):
+        if offsets[ich + 1] == offsets[ich]:
+            continue
+        # Push `ich` on the heap
+        i = size
+        size += 1
+        start = starts[pos[ich]]
+        while i > 0:
+            parent = (i - 1)//2
+            if heap_start[parent] < start or \
+               (heap_start[parent] == start and heap_ch[parent] < ich):
+                break
+            heap_start[i], heap_ch[i] = heap_start[parent], heap_ch[parent]
+            i = parent
+        heap_start[i], heap_ch[i] = start, ich
+    for j in range(starts.size):
+        ich = heap_ch[0]
+        sort_index[j] = pos[ich]
+        ich_burst[j] = ich
+        pos[ich] += 1
+        if pos[ich] < offsets[ich + 1]:
+            start = starts[pos[ich]]
+        else:
+            size -= 1
+            start, ich = heap_start[size], heap_ch[size]
+        # Sift down the new top element
+        i = 0
+        while True:
+            child = 2*i + 1
+            if child >= size:
+                break
+            if child + 1 < size and \
+               (heap_start[child + 1] < heap_start[child] or
+                (heap_start[child + 1] == heap_start[child] and
+                 heap_ch[child + 1] < heap_ch[child])):
+                child += 1
+            if start < heap_start[child] or \
+               (start == heap_start[child] and ich < heap_ch[child]):
+                break
+            heap_start[i], heap_ch[i] = heap_start[child], heap_ch[child]
+            i = child
+        heap_start[i], heap_ch[i] = start, ich
+
+def merge_bursts_order_numba(starts, offsets):
+    """Return the order of the bursts of all the channels by start time.
+
+    K-way merge of the (sorted) channels in O(N log k). See
+    :func:`burstsearchlib.merge_bursts_order` for details.
+    """
+    nch = offsets.size - 1
+    sort_index = np.zeros(starts.size, dtype=np.int64)
+    ich_burst = np.zeros(starts.size, dtype=np.uint8 if nch <= 256
+                         else np.int16)
+    _merge_bursts_order(np.asarray(starts, dtype=np.int64),
+                        np.asarray(offsets, dtype=np.int64), sort_index,
+                        ich_burst)
+    return sort_index, ich_burst
@@ -0,0 +1,171 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Array-like access to photon data stored on disk in HDF5 files.
+
+The loader :func:`fretbursts.loader.hdf5` with `lazy=True` does not read
+the photon data in memory. Each per-channel array is instead either:
+
+- a `numpy.memmap` when the array is stored uncompressed and contiguous
+  (requires `h5py` to find the position of the data in the file). The OS
+  loads in memory only the pages which are accessed.
+- a :class:`H5Array` otherwise. Indexing an `H5Array` with a slice or an
+  integer reads from disk only the requested elements.
+
+In both cases slicing returns in-memory numpy arrays and the arrays can be
+consumed in chunks (see :func:`iter_slices`).
+"""
+
+import numpy as np
+
+
+# Default number of elements read at once when processing on-disk arrays
+default_chunksize = 2**22
+
+
+class H5Array(object):
+    """Read-only array-like wrapper of an on-disk PyTables array.
+
+    Indexing with a slice or an integer reads only the requested elements,
+    any other index (i.e. a boolean mask) reads the whole array first.
+    The optional function `transform` is applied to the data after each read
+    (for example to convert a detectors array in a boolean mask).
+    """
+    def __init__(self, node, transform=None, chunksize=None):
+        self.node = node
+        self.transform = transform
+        self.chunksize = chunksize or default_chunksize
+        self.shape = node.shape
+        self.dtype = self._apply(node[:0]).dtype
+
+    def _apply(self, data):
+        if self.transform is None:
+            return data
+        return self.transform(data)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return '<H5Array %s, shape %s, dtype %s>' % (
+            self.node._v_pathname, self.shape, self.dtype)
+
+    def __getitem__(self, index):
+        if isinstance(index, (slice, int, long, np.integer)):
+            return self._apply(self.node[index])
+        return self.read()[index]
+
+    def __array__(self, dtype=None):
+        data = self.read()
+        return data if dtype is None else data.astype(dtype)
+
+    def read(self, start=None, stop=None):
+        """Read in memory the elements from `start` to `stop`."""
+        return self._apply(self.node.read(start, stop))
+
+    def iter_chunks(self, chunksize=None):
+        """Iterate over (start index, array) reading `chunksize` elements.
+        """
+        chunksize = chunksize or self.chunksize
+        for start in xrange(0, self.shape[0], chunksize):
+            yield start, self.read(start, start + chunksize)
+
+    def searchsorted(self, values):
+        """Like `numpy.searchsorted` (side='left') for a sorted array.
+
+        Performs a bisection reading a single element at each step.
+        """
+        values = np.atleast_1d(values)
+        index = np.zeros(values.size, dtype=np.int64)
+        for i, value in enumerate(values):
+            lo, hi = 0, self.shape[0]
+            while lo < hi:
+                mid = (lo + hi)//2
+                if self[mid] < value:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            index[i] = lo
+        return index
+
+    def negated(self):
+        """Return a new H5Array with the logical negation of the data."""
+        if self.transform is None:
+            transform = np.logical_not
+        else:
+            transform = lambda data: np.logical_not(self.transform(data))
+        return H5Array(self.node, transform=transform,
+                       chunksize=self.chunksize)
+
+
+def is_on_disk(array):
+    """Return True if `array` is an on-disk array not loaded in memory.
+
+    On-disk arrays are :class:`H5Array` and PyTables arrays. Numpy arrays,
+    including memory-mapped arrays, are not considered on-disk.
+    """
+    return hasattr(array, 'shape') and not isinstance(array, np.ndarray)
+
+def iter_slices(array, start=0, stop=None, chunksize=None):
+    """Iterate over consecutive slices of `array` from `start` to `stop`.
+
+    Each slice has `chunksize` elements (except the last one). If
+    `chunksize` is None, uses the `chunksize` attribute of `array` (i.e. for
+    an :class:`H5Array`) or :data:`default_chunksize`. Works with numpy
+    arrays, PyTables arrays and :class:`H5Array`.
+    """
+    if stop is None:
+        stop = array.shape[0]
+    if chunksize is None:
+        chunksize = getattr(array, 'chunksize', default_chunksize)
+    for i in xrange(start, stop, chunksize):
+        yield array[i:min(i + chunksize, stop)]
+
+def _get_data_offset(node):
+    """Return the offset in bytes of the data of `node` in the HDF5 file.
+
+    Returns None if `h5py` is not installed or the data is not allocated.
+    """
+    try:
+        import h5py
+    except ImportError:
+        return None
+    with h5py.File(node._v_file.filename, 'r') as h5file:
+        return h5file[node._v_pathname].id.get_offset()
+
+def open_array(node, transform=None, mmap=True, chunksize=None):
+    """Return an array-like object to access the data in `node` lazily.
+
+    Arguments:
+        node (PyTables array): array to be accessed.
+        transform (function or None): function applied to the data after
+            reading (see :class:`H5Array`).
+        mmap (bool): if True, and the data is uncompressed, contiguous and
+            no `transform` is requested, returns a read-only `numpy.memmap`.
+        chunksize (int or None): number of elements read at once when the
+            array is processed in chunks. If None, uses
+            :data:`default_chunksize`.
+
+    Returns:
+        A `numpy.memmap` or an :class:`H5Array`.
+    """
+    contiguous = node.chunkshape is None and node.filters.complevel == 0
+    if mmap and contiguous and transform is None and node.nrows > 0:
+        offset = _get_data_offset(node)
+        if offset is not None:
+            byteorder = '>' if node.byteorder == 'big' else '<'
+            dtype = node.atom.dtype.newbyteorder(byteorder)
+            return np.memmap(node._v_file.filename, dtype=dtype, mode='r',
+                             offset=offset, shape=node.shape)
+    return H5Array(node, transform=transform, chunksize=chunksize)
@@ -8,8 +8,12 @@ This module contains core functions to read and process timestamps
 generated by Manta detector or by NI hardware.
 """
 
+import itertools
+from multiprocessing.pool import ThreadPool
 import numpy as np
+import tables
 from pytables_array_list import PyTablesList
+from fretbursts import backends
 
 
 def load_manta_timestamps(fname, format='xa', full_output=False,
@@ -97,6 +101,24 @@ def load_xavier_manta_data(fname, skip_lines=3, dtype='>u4',
     buff = f.read(dt.itemsize*i_stop)
     return np.ndarray(shape=(len(buff)/dt.itemsize,), dtype=dt, buffer=buff)
 
+def iter_xavier_manta_data(fname, chunksize=2**22, skip_lines=3,
+                           dtype='>u4'):
+    """Iterate over the raw words of a file saved from Xavier VI in chunks.
+
+    Yields arrays of `chunksize` unprocessed uint32 words (see
+    :func:`load_xavier_manta_data`), to be processed with
+    :func:`process_store_chunks`.
+    """
+    with open(fname, 'rb') as f:
+        # Discard a some lines used for header
+        for x in range(skip_lines):
+            f.readline()
+        while True:
+            data = np.fromfile(f, dtype=dtype, count=chunksize)
+            if data.size == 0:
+                break
+            yield data
+
 def load_raw_manta_data(fname, dtype='<u4'):
     """Load manta-timestamps data from `fname` saved from Luca's VI.
     Returns the unprocessed uint32 words containing detetctor and timestamp.
@@ -111,10 +133,105 @@ def get_timestamps_detectors(data, nbits=24):
     timestamps = np.bitwise_and(data,  2**nbits - 1)
     return timestamps, det
 
+def demux_detectors(det, num_det=64):
+    """Group the photons by detector (stable counting sort).
+
+    This is the numpy implementation of the 'demux_detectors' kernel
+    (see :mod:`fretbursts.backends`). It uses a single stable sort of
+    `det`. The numba implementation is a single-pass counting sort.
+
+    Arguments:
+        det (array): detector number of each photon. Photons with
+            detector >= `num_det` are discarded.
+        num_det (int): number of possible detector values.
+
+    Returns:
+        An index array sorting the photons by detector (photons of the
+        same detector keep their order) and an array `bounds` of size
+        `num_det` + 1. The photons of detector `i` are
+        `index[bounds[i]:bounds[i+1]]`.
+    """
+    counts = np.bincount(det, minlength=num_det)[:num_det]
+    bounds = np.hstack([0, np.cumsum(counts)])
+    # Detectors >= num_det are sorted last and then discarded
+    index = det.argsort(kind='mergesort')[:bounds[-1]]
+    return index, bounds
+
+def _decode_fifo_flags(det):
+    """Return detectors without the FIFO flags, big and small FIFO flags.
+    """
+    full_big_fifo = np.bitwise_and(1, np.right_shift(det,7)).astype(bool)
+    full_small_fifo = np.bitwise_and(1, np.right_shift(det,6)).astype(bool)
+    det = np.bitwise_and(det, 0x3F)
+    return det, full_big_fifo, full_small_fifo
+
+def _demux_channels(timestamps, det, fifo_flag=True, debug=False):
+    """Split the raw stream in the 48 channels with a single sort.
+
+    Returns a list of tuples (timestamps, big-FIFO flags, small-FIFO flags),
+    one per channel. The flags are None if `fifo_flag` is False.
+    """
+    zero_data = (det == 0)
+    det = det[~zero_data]
+    timestamps = timestamps[~zero_data]
+
+    full_big_fifo = full_small_fifo = None
+    if fifo_flag:
+        det, full_big_fifo, full_small_fifo = _decode_fifo_flags(det)
+
+    if debug :
+        assert (det < 49).all()
+
+    index, bounds = backends.get('demux_detectors')(det)
+    timestamps = timestamps[index]
+    if fifo_flag:
+        full_big_fifo = full_big_fifo[index]
+        full_small_fifo = full_small_fifo[index]
+    del index
+
+    channels = []
+    for CH in range(1, 49):
+        segment = slice(bounds[CH], bounds[CH+1])
+        if fifo_flag:
+            channels.append((timestamps[segment], full_big_fifo[segment],
+                             full_small_fifo[segment]))
+        else:
+            channels.append((timestamps[segment], None, None))
+    return channels
+
+def _unroll_channel(times32, delta_rollover, max_ts, previous=None,
+                    num_rollover=0):
+    """Correct the rollover of the timestamps of one channel.
+
+    The first timestamp of a channel is invalid and it is discarded. To
+    process a channel in chunks, pass the last 32bit timestamp and the
+    number of rollovers of the previous chunk (`previous`, `num_rollover`).
+
+    Returns:
+        The 64bit timestamps, the last 32bit timestamp and the number of
+        rollovers (to be passed for the next chunk).
+    """
+    times32 = times32.astype('int32')
+    if previous is not None:
+        times32 = np.hstack([np.array([previous], dtype='int32'), times32])
+    if times32.size == 0:
+        return np.zeros(0, dtype='int64'), previous, num_rollover
+    times64 = (np.diff(times32) < -delta_rollover).astype('int64')
+    np.cumsum(times64, out=times64)
+    times64 += num_rollover
+    if times64.size > 0:
+        num_rollover = times64[-1]
+    times64 *= max_ts
+    times64 += times32[1:]
+    return times64, times32[-1], num_rollover
+
 def process_timestamps(timestamps, det, delta_rollover=1, nbits=24,
                        fifo_flag=True, debug=False):
     """Process 32bit timestamps to correct rollover and sort channels.
 
+    The photons are grouped by channel with a single stable sort (see
+    :func:`demux_detectors`).
+
     Parameters
     ----------
     timestamps : array (uint32)
@@ -134,39 +251,20 @@ def process_timestamps(timestamps, det, delta_rollover=1, nbits=24,
     3 lists of arrays (one per ch) for timestamps (int64), big-FIFO full-flags
     (bool) and small-FIFO full flags (bool).
     """
-    cumsum, diff = np.cumsum, np.diff
     max_ts = 2**nbits
-
-    zero_data = (det == 0)
-    det = det[-zero_data]
-    timestamps = timestamps[-zero_data]
-
-    if fifo_flag:
-        full_big_fifo = np.bitwise_and(1, np.right_shift(det,7)).astype(bool)
-        full_small_fifo = np.bitwise_and(1, np.right_shift(det,6)).astype(bool)
-        det = np.bitwise_and(det, 0x3F)
-
-    if debug :
-        assert (det < 49).all()
-
     full_big_fifo_m = []
     full_small_fifo_m = []
     timestamps_m = []
-    for CH in range(1, 49):
-        mask = (det == CH)
-        times32 = timestamps[mask].astype('int32')
+    channels = _demux_channels(timestamps, det, fifo_flag=fifo_flag,
+                               debug=debug)
+    for times32, big_fifo, small_fifo in channels:
         if fifo_flag:
-            full_big_fifo_m.append(full_big_fifo[mask])
-            full_small_fifo_m.append(full_small_fifo[mask])
-        del mask
+            full_big_fifo_m.append(big_fifo)
+            full_small_fifo_m.append(small_fifo)
 
         if times32.size >= 3:
             # We need at least 2 valid timestamps and the first is invalid
-            times64 = (diff(times32) < -delta_rollover).astype('int64')
-            cumsum(times64, out=times64)
-            times64 *= max_ts
-            times64 += times32[1:]
-            del times32
+            times64 = _unroll_channel(times32, delta_rollover, max_ts)[0]
         else:
             # Return an array of size 0 for current ch
             times64 = np.zeros(0, dtype='int64')
@@ -174,6 +272,23 @@ def process_timestamps(timestamps, det, delta_rollover=1, nbits=24,
 
     return timestamps_m, full_big_fifo_m, full_small_fifo_m
 
+def _create_store(out_fname):
+    """Create the lists of arrays used to store the processed timestamps.
+    """
+    array_list_descr = 'List of arrays of %s (one per ch).'
+    timestamps_m = PyTablesList(
+            out_fname, overwrite=True, group_name='timestamps_list',
+            group_descr=(array_list_descr % 'timestamps'))
+    full_big_fifo_m = PyTablesList(timestamps_m.data_file,
+            parent_node='/timestamps_list',
+            group_name='big_fifo_full_list',
+            group_descr=(array_list_descr % 'big-FIFO'))
+    full_small_fifo_m = PyTablesList(timestamps_m.data_file,
+            parent_node='/timestamps_list',
+            group_name='small_fifo_full_list',
+            group_descr=(array_list_descr % 'small-FIFO'))
+    return timestamps_m, full_big_fifo_m, full_small_fifo_m
+
 def process_store(timestamps, det, out_fname, delta_rollover=1, nbits=24,
                   fifo_flag=True, debug=False):
     """Process 32bit timestamps to correct rollover and sort channels.
@@ -199,58 +314,93 @@ def process_store(timestamps, det, out_fname, delta_rollover=1, nbits=24,
     3 lists of arrays (one per ch) for timestamps (int64), big-FIFO full-flags
     (bool) and small-FIFO full flags (bool).
     """
-    cumsum, diff = np.cumsum, np.diff
-    max_ts = 2**nbits
-
-    zero_data = (det == 0)
-    det = det[-zero_data]
-    timestamps = timestamps[-zero_data]
+    timestamps_m, full_big_fifo_m, full_small_fifo_m = \
+            _create_store(out_fname)
+    processed = process_timestamps(timestamps, det,
+                                   delta_rollover=delta_rollover, nbits=nbits,
+                                   fifo_flag=fifo_flag, debug=debug)
+    for times64, big_fifo_i, small_fifo_i in zip(*processed):
+        timestamps_m.append(times64)
+        if fifo_flag:
+            full_big_fifo_m.append(big_fifo_i)
+            full_small_fifo_m.append(small_fifo_i)
+    timestamps_m.data_file.flush()
+    return timestamps_m, full_big_fifo_m, full_small_fifo_m
 
-    if fifo_flag:
-        full_big_fifo = np.bitwise_and(1, np.right_shift(det,7)).astype(bool)
-        full_small_fifo = np.bitwise_and(1, np.right_shift(det,6)).astype(bool)
-        det = np.bitwise_and(det, 0x3F)
+def process_store_chunks(data_chunks, out_fname, delta_rollover=1, nbits=24,
+                         fifo_flag=True, num_threads=None, debug=False):
+    """Process and store raw manta data read in chunks.
 
-    if debug :
-        assert (det < 49).all()
+    Same result as :func:`process_store` but the raw data is passed as a
+    sequence of chunks (see :func:`iter_xavier_manta_data`) and the
+    processed timestamps are appended to the HDF5 file chunk by chunk.
+    The rollover correction carries its state from one chunk to the next.
 
-    array_list_descr = 'List of arrays of %s (one per ch).'
-    timestamps_m = PyTablesList(
-            out_fname, overwrite=True, group_name='timestamps_list',
-            group_descr=(array_list_descr % 'timestamps'))
-    full_big_fifo_m = PyTablesList(out_fname,
-            parent_node='/timestamps_list',
-            group_name='big_fifo_full_list',
-            group_descr=(array_list_descr % 'big-FIFO'))
-    full_small_fifo_m = PyTablesList(out_fname,
-            parent_node='/timestamps_list',
-            group_name='small_fifo_full_list',
-            group_descr=(array_list_descr % 'small-FIFO'))
+    Parameters
+    ----------
+    data_chunks : iterable
+        sequence of arrays of raw uint32 words.
+    out_fname : string
+        file name where to save the processed timestamps
+    num_threads : integer or None
+        if > 1, the raw chunks are decoded and split in channels by a pool
+        of `num_threads` threads, while the main thread writes the results.
+    Other parameters : see :func:`process_store`.
 
-    for CH in range(1, 49):
-        mask = (det == CH)
-        times32 = timestamps[mask].astype('int32')
+    Returns
+    -------
+    3 lists of on-disk arrays (one per ch) for timestamps (int64), big-FIFO
+    full-flags (bool) and small-FIFO full flags (bool).
+    """
+    max_ts = 2**nbits
+    timestamps_m, full_big_fifo_m, full_small_fifo_m = \
+            _create_store(out_fname)
+    for CH in range(48):
+        timestamps_m.append_empty(tables.Int64Atom())
         if fifo_flag:
-            big_fifo_i = full_big_fifo[mask]
-            #if not big_fifo_i.any(): big_fifo_i = np.array([])
-            full_big_fifo_m.append(big_fifo_i)
-
-            small_fifo_i = full_small_fifo[mask]
-            #if not small_fifo_i.any(): small_fifo_i = np.array([])
-            full_small_fifo_m.append(small_fifo_i)
-        del mask
-
-        if times32.size >= 3:
-            # We need at least 2 valid timestamps and the first is invalid
-            times64 = (diff(times32) < -delta_rollover).astype('int64')
-            cumsum(times64, out=times64)
-            times64 *= max_ts
-            times64 += times32[1:]
-            del times32
-        else:
-            # Return an array of size 0 for current ch
-            times64 = np.zeros(0, dtype='int64')
-        timestamps_m.append(times64)
+            full_big_fifo_m.append_empty(tables.BoolAtom())
+            full_small_fifo_m.append_empty(tables.BoolAtom())
+    previous, num_rollover = [None]*48, [0]*48
+
+    def demux_chunk(data):
+        timestamps, det = get_timestamps_detectors(data, nbits=nbits)
+        return _demux_channels(timestamps, det, fifo_flag=fifo_flag,
+                               debug=debug)
+
+    num_threads = num_threads or 1
+    pool = ThreadPool(num_threads) if num_threads > 1 else None
+    data_chunks = iter(data_chunks)
+    try:
+        while True:
+            # Read at most `num_threads` chunks at the time to bound memory
+            batch = list(itertools.islice(data_chunks, num_threads))
+            if len(batch) == 0:
+                break
+            if pool is None:
+                demuxed = [demux_chunk(data) for data in batch]
+            else:
+                demuxed = pool.map(demux_chunk, batch)
+            del batch
+            for channels in demuxed:
+                for ich, (times32, big_fifo, small_fifo) in \
+                        enumerate(channels):
+                    times64, previous[ich], num_rollover[ich] = \
+                            _unroll_channel(times32, delta_rollover, max_ts,
+                                            previous[ich], num_rollover[ich])
+                    timestamps_m[ich].append(times64)
+                    if fifo_flag:
+                        full_big_fifo_m[ich].append(big_fifo)
+                        full_small_fifo_m[ich].append(small_fifo)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # As in process_timestamps(), channels with less than 3 timestamps
+    # are empty
+    for times64 in timestamps_m:
+        if times64.nrows < 2:
+            times64.truncate(0)
     timestamps_m.data_file.flush()
     return timestamps_m, full_big_fifo_m, full_small_fifo_m
 
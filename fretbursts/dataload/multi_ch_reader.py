@@ -13,6 +13,7 @@ import os
 import numpy as np
 
 from fretbursts.utils.misc import pprint
+from fretbursts import backends
 
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #  DATA LOADING
@@ -38,6 +39,65 @@ def read_int32_int32_file(fname, n_bytes_to_read=-1):
     assert ((detector < 17)*(detector >= 0)).all()
     return ph_times, detector.astype('uint8')
 
+## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#  MERGE OF SORTED TIMESTAMPS
+#
+
+def merge_da(t_d, t_a):
+    """Merge the sorted donor and acceptor timestamps `t_d` and `t_a`.
+
+    This is the numpy implementation of the 'merge_da' kernel (see
+    :mod:`fretbursts.backends`): the position of each acceptor timestamp in
+    the merged array is computed with a binary search in `t_d` and the two
+    inputs are scattered in the output (O(Na log Nd), no full sort). The
+    cython and numba implementations are linear single-pass merges.
+    Donor photons come first when D and A timestamps are equal (same result
+    as a stable sort).
+
+    Returns:
+        The merged timestamps (int64) and the acceptor mask (bool), which is
+        True for the photons coming from `t_a`.
+    """
+    index_a = np.searchsorted(t_d, t_a, side='right')
+    index_a += np.arange(t_a.size)
+    A_em = np.zeros(t_d.size + t_a.size, dtype=bool)
+    A_em[index_a] = True
+    T = np.zeros(A_em.size, dtype='int64')
+    T[index_a] = t_a
+    T[~A_em] = t_d
+    return T, A_em
+
+def merge_timestamps(timestamps_list):
+    """Merge a list of sorted timestamps arrays (k-way merge).
+
+    The arrays are merged pairwise (as in :func:`merge_da`) in a binary
+    tree, so each timestamp is moved log2(k) times for k arrays. When
+    timestamps are equal, the photon from the array coming first in
+    `timestamps_list` comes first.
+
+    Returns:
+        The merged timestamps (int64) and an array with the index of the
+        source array of each photon (uint8, or int16 for more than 256
+        arrays).
+    """
+    dtype = 'uint8' if len(timestamps_list) <= 256 else 'int16'
+    merged = [(np.asarray(t, dtype='int64'), np.zeros(len(t), dtype=dtype) + i)
+              for i, t in enumerate(timestamps_list)]
+    if len(merged) == 0:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype=dtype)
+    while len(merged) > 1:
+        merged_pairs = []
+        for (t1, src1), (t2, src2) in zip(merged[::2], merged[1::2]):
+            T, from_t2 = merge_da(t1, t2)
+            source = np.zeros(T.size, dtype=dtype)
+            source[from_t2] = src2
+            source[~from_t2] = src1
+            merged_pairs.append((T, source))
+        if len(merged) % 2 == 1:
+            merged_pairs.append(merged[-1])
+        merged = merged_pairs
+    return merged[0]
+
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #  DATA CONVERSION
 #
@@ -53,8 +113,14 @@ def swap_donor_acceptor(detectors, nch=4):
     return detectors
 
 def load_data_ordered16(fname, n_bytes_to_read=-1, nch=8, swap_D_A=False,
-                        remap_D=False, remap_A=False):
-    """Load data, unroll the 32bit overflow and order in increasing order."""
+                        remap_D=False, remap_A=False, backend=None):
+    """Load data, unroll the 32bit overflow and order in increasing order.
+
+    The unrolling is performed by the 'unwind_uni' kernel of the selected
+    `backend` (see :mod:`fretbursts.backends`).
+    Returns a list of timestamps arrays and a list of acceptor masks (one
+    per channel).
+    """
     pprint(' - Loading data "%s" ... ' % fname)
     ph_times, detector = read_int32_int32_file(fname, n_bytes_to_read)
     pprint(" [DONE]\n")
@@ -71,10 +137,12 @@ def load_data_ordered16(fname, n_bytes_to_read=-1, nch=8, swap_D_A=False,
         pprint("\n   - Swapping D and A channels ... ")
         detector = swap_donor_acceptor(detector, nch=8)
         pprint(" [DONE]\n")
-    ph_times_m, red, ph_times_ma = unwind_uni(ph_times, detector)
+    unwind = backends.get('unwind_uni', backend)
+    ph_times_m, red = unwind(ph_times, detector, nch=nch)
+    red = [np.asarray(r, dtype=bool) for r in red]
     pprint("   [DONE Processing]\n")
 
-    return ph_times_m, red, ph_times_ma
+    return ph_times_m, red
 
 def unwind_uni(times, det, nch=8, times_nbit=28, debug=True):
     """64bit conversion and merging of corresponding D/A channels."""
@@ -91,27 +159,19 @@ def unwind_uni(times, det, nch=8, times_nbit=28, debug=True):
         #print i, (t < 0).sum(), (diff(t) < 0).sum(), "\n"
 
     ph_times_m, red = nch*[0], nch*[0]
-    bones = lambda n: np.ones(n, dtype=bool)
-    bzeros = lambda n: np.zeros(n, dtype=bool)
     for i in range(nch):
-        # Merge channels and sort
-        ph_times_m[i] = np.hstack([times_ma[i], times_ma[i+nch]])
-        index_sort = ph_times_m[i].argsort()
-        red[i] = np.hstack([bzeros(times_ma[i].size),
-                            bones(times_ma[i+nch].size)])
-        red[i] = red[i][index_sort]
-        ph_times_m[i] = ph_times_m[i][index_sort]
+        # Merge D and A channels (already sorted)
+        ph_times_m[i], red[i] = merge_da(times_ma[i], times_ma[i+nch])
     return ph_times_m, red, times_ma
 
 
 def unwind_uni_c(times, det, nch=8, times_nbit=28, debug=True):
     """64bit conversion and merging of corresponding D/A channels.
-    This version is identical to the cython version but uses numpy sort.
+    This version is identical to the cython version but uses numpy
+    (see :func:`merge_da`).
     """
     cumsum, hstack, int16, int64 = np.cumsum, np.hstack, np.int16, np.int64
     diff = lambda a: a[1:]-a[:-1]
-    bones = lambda n: np.ones(n, dtype=bool)
-    bzeros = lambda n: np.zeros(n, dtype=bool)
 
     num_spad = nch*2
     ts_max = (2**times_nbit)
@@ -125,12 +185,7 @@ def unwind_uni_c(times, det, nch=8, times_nbit=28, debug=True):
         t_a += hstack([0, cumsum((diff(t_a1)<0), dtype=int16)])*ts_max
         del t_d1, t_a1
 
-        T = hstack([t_d, t_a])
-        index_sort = T.argsort(kind='mergesort')
-
-        ph_times_m[ich] = T[index_sort]
-        A_det[ich] = hstack([bzeros(t_d.size), bones(t_a.size)])[index_sort]
-        del index_sort, T
+        ph_times_m[ich], A_det[ich] = merge_da(t_d, t_a)
     return ph_times_m, A_det
 
 def unwind_uni_o(times, det, nch=8, times_nbit=28, debug=True):
@@ -138,8 +193,6 @@ def unwind_uni_o(times, det, nch=8, times_nbit=28, debug=True):
     This version is about 10% faster than unwind_uni().
     """
     diff = lambda a: a[1:]-a[:-1]
-    bones = lambda n: np.ones(n, dtype=bool)
-    bzeros = lambda n: np.zeros(n, dtype=bool)
 
     num_spad = nch*2
     expo = (2**times_nbit)
@@ -158,18 +211,10 @@ def unwind_uni_o(times, det, nch=8, times_nbit=28, debug=True):
         step_d = np.cumsum((diff(t_d) < 0), dtype='int16')
         step_a = np.cumsum((diff(t_a) < 0), dtype='int16')
 
-        t1 = np.hstack([t_d, t_a]).astype('int64')
-        t2 = np.hstack([0, step_d, 0, step_a])
-        #ph_times_m[ich] = NE.evaluate("t1+t2*expo") # this is slower!
-        ph_times_m[ich] = t1 + t2*expo
-        del t1, t2
-        #ph_times_m[ich] = concatenate([t_d,t_a]).astype(int64) + \
-        #        hstack([0,step_d,0,step_a])*expo
-        #ph_times_m[ich] = concatenate([t_d, t_a])
-        index_sort = ph_times_m[ich].argsort(kind='mergesort')
-        ph_times_m[ich] = ph_times_m[ich][index_sort]
-        A_det[ich] = np.hstack([bzeros(t_d.size), bones(t_a.size)])[index_sort]
-        del index_sort
+        t_d64 = t_d.astype('int64') + np.hstack([0, step_d])*expo
+        t_a64 = t_a.astype('int64') + np.hstack([0, step_a])*expo
+        ph_times_m[ich], A_det[ich] = merge_da(t_d64, t_a64)
+        del t_d64, t_a64
     return ph_times_m, A_det
 
 
@@ -1,8 +1,9 @@
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Distutils import build_ext
+import numpy as np
 
-ext_modules = [Extension("uni", ["uni.pyx"])]
+ext_modules = [Extension("uni", ["uni.pyx"], include_dirs=[np.get_include()])]
 
 setup(
   name = 'Data order',
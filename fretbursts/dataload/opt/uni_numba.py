@@ -0,0 +1,125 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Numba-compiled version of the timestamps unwrapping in `uni.pyx`.
+
+This module requires `numba` and needs no compilation step.
+"""
+
+import numpy as np
+import numba
+
+
+@numba.njit(cache=True)
+def _unwrap(t, ts_max):
+    """Convert to int64 the timestamps `t`, removing the overflows."""
+    t64 = np.empty(t.size, dtype=np.int64)
+    offset = 0
+    for i in range(t.size):
+        if i > 0 and t[i] < t[i - 1]:
+            offset += ts_max
+        t64[i] = t[i] + offset
+    return t64
+
+@numba.njit(cache=True)
+def _merge(t_d, t_a):
+    """Merge two sorted arrays. Returns merged array and A-channel mask."""
+    sd, sa = t_d.size, t_a.size
+    T = np.empty(sd + sa, dtype=np.int64)
+    A = np.zeros(sd + sa, dtype=np.bool_)
+    i_d, i_a = 0, 0
+    for ii in range(T.size):
+        if i_a == sa or (i_d < sd and t_d[i_d] <= t_a[i_a]):
+            T[ii] = t_d[i_d]
+            i_d += 1
+        else:
+            T[ii] = t_a[i_a]
+            i_a += 1
+            A[ii] = True
+    return T, A
+
+@numba.njit(cache=True)
+def _merge_source(t1, src1, t2, src2):
+    """Merge two sorted arrays with the index of the source of each element.
+    """
+    s1, s2 = t1.size, t2.size
+    T = np.empty(s1 + s2, dtype=np.int64)
+    S = np.empty(s1 + s2, dtype=src1.dtype)
+    i1, i2 = 0, 0
+    for ii in range(T.size):
+        if i2 == s2 or (i1 < s1 and t1[i1] <= t2[i2]):
+            T[ii], S[ii] = t1[i1], src1[i1]
+            i1 += 1
+        else:
+            T[ii], S[ii] = t2[i2], src2[i2]
+            i2 += 1
+    return T, S
+
+def merge_da_numba(t_d, t_a):
+    """Merge the sorted donor and acceptor timestamps in a single pass.
+
+    Same result as :func:`multi_ch_reader.merge_da`.
+    """
+    return _merge(np.asarray(t_d, dtype=np.int64),
+                  np.asarray(t_a, dtype=np.int64))
+
+def merge_timestamps_numba(timestamps_list):
+    """Merge a list of sorted timestamps arrays (k-way merge).
+
+    Same result as :func:`multi_ch_reader.merge_timestamps`.
+    """
+    dtype = np.uint8 if len(timestamps_list) <= 256 else np.int16
+    merged = [(np.asarray(t, dtype=np.int64), np.zeros(len(t), dtype=dtype) + i)
+              for i, t in enumerate(timestamps_list)]
+    if len(merged) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=dtype)
+    while len(merged) > 1:
+        merged_pairs = [_merge_source(t1, src1, t2, src2)
+                        for (t1, src1), (t2, src2) in
+                        zip(merged[::2], merged[1::2])]
+        if len(merged) % 2 == 1:
+            merged_pairs.append(merged[-1])
+        merged = merged_pairs
+    return merged[0]
+
+@numba.njit(cache=True)
+def _counting_sort(det, num_det):
+    counts = np.zeros(num_det + 1, dtype=np.int64)
+    for i in range(det.size):
+        if det[i] < num_det:
+            counts[det[i] + 1] += 1
+    for i in range(num_det):
+        counts[i + 1] += counts[i]
+    bounds = counts.copy()
+    index = np.empty(counts[num_det], dtype=np.int64)
+    for i in range(det.size):
+        if det[i] < num_det:
+            index[counts[det[i]]] = i
+            counts[det[i]] += 1
+    return index, bounds
+
+def demux_detectors_numba(det, num_det=64):
+    """Group the photons by detector with a single-pass counting sort.
+
+    Same result as :func:`manta_reader.demux_detectors` (photons with
+    detector >= `num_det` are discarded).
+    """
+    return _counting_sort(det, num_det)
+
+def unwind_uni_numba(times, det, nch=8, times_nbit=28, debug=True):
+    """64bit conversion and merging of corresponding D/A channels.
+
+    Same result as :func:`multi_ch_reader.unwind_uni_c` (donor photons come
+    first when D and A timestamps are equal).
+    """
+    ts_max = 2**times_nbit
+    ph_times_m, A_det = [[]]*nch, [[]]*nch
+    for ich in xrange(nch):
+        det_d, det_a = ich+1, ich+1+nch
+        t_d = _unwrap(times[det == det_d], ts_max)
+        t_a = _unwrap(times[det == det_a], ts_max)
+        ph_times_m[ich], A_det[ich] = _merge(t_d, t_a)
+    return ph_times_m, A_det
@@ -94,5 +94,22 @@ class PyTablesList(list):
         self.size += 1
         self.group._v_attrs.size = self.size
 
+    def append_empty(self, atom, expectedrows=None):
+        """Append an empty extendable array of type `atom` (a PyTables atom).
+
+        The array can be filled later calling its `.append()` method.
+        """
+        name = self.get_name()
+        comp_filter = tables.Filters(**self.compression)
+        kwargs = {}
+        if expectedrows is not None:
+            kwargs['expectedrows'] = expectedrows
+        tarray = self.data_file.create_earray(self.group, name, atom=atom,
+                                              shape=(0,), filters=comp_filter,
+                                              **kwargs)
+        super(PyTablesList, self).append(tarray)
+        self.size += 1
+        self.group._v_attrs.size = self.size
+
     def get_array_list(self):
         return [array_[:] for array_ in self]
\ No newline at end of file
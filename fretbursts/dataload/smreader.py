@@ -30,49 +30,116 @@ are the detector.
 
 The data is in unsigned big endian (>) format.
 
-For efficiency the data is read as a list of B.E. (>) uint32 and then
-recomposed in ph_times and det. (NB: Old not very efficient approach)
-
-The proper way to read the data is to read the byte-stream and interpret
-it as a record array in which each element is 12 bytes.
+The file is memory-mapped as an array of 12-byte records (see
+:data:`sm_dtype`) and decoded in blocks, therefore no temporary array of
+the size of the file is created. Only a range of records (or of
+timestamps) can be read passing `start`/`stop` (or `time_range`) to
+:func:`load_sm`.
 """
 
+import os
 import numpy as np
 
 
-def load_sm(fname, header=166):
-    try: f = open(fname, 'rb')
-    except IOError: f = open(fname+'.sm', 'rb')
-    head = f.read(header)
-    raw_data = f.read()
-    raw_data = raw_data[:4*(len(raw_data)/4)]
-    data = np.fromstring(raw_data,'>u4')
-    data = data.reshape(data.size/3,3)[:-20,:]
-    #ph_times = left_shift(data[:,0].astype(uint64),32)+data[:,1].astype(uint64)
-    ph_times = np.left_shift(data[:,0].astype('int64'),32) + \
-                data[:,1].astype('int64')
-    det = data[:,2].astype('uint8') # 8 bit are enough (also bool!)
+# Description of the record element in the file
+sm_dtype = np.dtype([('timestamp', '>i8'), ('detector', '>u4')])
+
+# Number of records at the end of the file which are not photon data
+_num_trailing_records = 20
+
+# Default number of records decoded at once
+default_chunksize = 2**20
+
+
+def _open_file_name(fname):
+    if not os.path.isfile(fname) and os.path.isfile(fname + '.sm'):
+        fname = fname + '.sm'
+    return fname
+
+def open_sm(fname, header=166):
+    """Memory-map the photon records of a .sm file (no data is read).
+
+    Returns:
+        A read-only `numpy.memmap` of records with dtype :data:`sm_dtype`
+        (fields 'timestamp' and 'detector').
+    """
+    fname = _open_file_name(fname)
+    num_bytes = os.path.getsize(fname) - header
+    num_records = max(num_bytes // sm_dtype.itemsize - _num_trailing_records,
+                      0)
+    return np.memmap(fname, dtype=sm_dtype, mode='r', offset=header,
+                     shape=(num_records,))
+
+def _bisect_time(records, time):
+    """Index of the first record with timestamp >= `time` (binary search).
+    """
+    lo, hi = 0, records.shape[0]
+    while lo < hi:
+        mid = (lo + hi)//2
+        if records[mid]['timestamp'] < time:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _get_range(records, start, stop, time_range):
+    if time_range is not None:
+        start = _bisect_time(records, time_range[0])
+        stop = _bisect_time(records, time_range[1])
+    if stop is None:
+        stop = records.shape[0]
+    return start, min(stop, records.shape[0])
+
+def iter_sm(fname, header=166, start=0, stop=None, time_range=None,
+            chunksize=default_chunksize):
+    """Iterate over the photon data of a .sm file in blocks of `chunksize`.
+
+    See :func:`load_sm` for the description of the arguments.
+
+    Yields:
+        2 arrays for each block: timestamps (int64) and detectors (uint8).
+    """
+    records = open_sm(fname, header=header)
+    start, stop = _get_range(records, start, stop, time_range)
+    for i in xrange(start, stop, chunksize):
+        block = records[i:min(i + chunksize, stop)]
+        yield (block['timestamp'].astype('int64'),
+               block['detector'].astype('uint8'))
+
+def load_sm(fname, header=166, start=0, stop=None, time_range=None,
+            chunksize=default_chunksize):
+    """Load the timestamps and detectors from a .sm file.
+
+    The file is memory-mapped and decoded in blocks directly in the
+    output arrays.
+
+    Arguments:
+        fname (string): file name (the extension '.sm' can be omitted).
+        header (int): size of the file header in bytes.
+        start, stop (int or None): range of records to read (a record is
+            12 bytes starting at byte `header` of the file). If None,
+            read until the end.
+        time_range (tuple or None): if not None, a pair (t_start, t_stop)
+            in timestamp units. Only photons with t_start <= timestamp <
+            t_stop are read. Overrides `start` and `stop`.
+        chunksize (int): number of records decoded at once.
+
+    Returns:
+        2 arrays: timestamps (int64) and detectors (uint8).
+    """
+    records = open_sm(fname, header=header)
+    start, stop = _get_range(records, start, stop, time_range)
+    size = max(stop - start, 0)
+    ph_times = np.zeros(size, dtype='int64')
+    det = np.zeros(size, dtype='uint8')
+    i = 0
+    for ph_times_chunk, det_chunk in iter_sm(fname, header, start, stop,
+                                             chunksize=chunksize):
+        ph_times[i:i + ph_times_chunk.size] = ph_times_chunk
+        det[i:i + det_chunk.size] = det_chunk
+        i += ph_times_chunk.size
     return ph_times, det
 
-def load_sm_new(fname, header=166):
-    try: f = open(fname, 'rb')
-    except IOError: f = open(fname+'.sm', 'rb')
-    f.seek(header)
-    byte_string = f.read()
-
-    # Description of the record element in the file
-    sm_dtype = np.dtype([('timestamp', '>i8'), ('detector', '>u4')])
-
-    # Remove the end of the file
-    end_field1 = 4
-    end_str = 'End Of Run'
-    end_field2 = 12
-    valid_size = len(byte_string) - end_field1 - len(end_str) - end_field2
-
-    # View of the binary data as an array (no copy performed)
-    data = np.frombuffer(byte_string[:valid_size], dtype=sm_dtype)
-    return data['timestamp'], data['detector']
-
 def _decode_header(header):
     """Decode the header of a .sm file. UNUSED."""
     # List of ASCII strings in the header
@@ -27,20 +27,33 @@ Drawing (note: each char represents 2 bits)::
     overflow bit: 13, bit_mask = 2^(13-1) = 4096
 """
 
+import os
 import numpy as np
+import tables
 
+from fretbursts import hdf5
+
+
+spc_dtype = np.dtype([('field0', '<u2'), ('b', '<u1'), ('c', '<u1'),
+                      ('a', '<u2')])
+
+# Default number of records read at once (6 MB of data)
+default_chunksize = 2**20
 
-def load_spc(fname):
-    """Load data from Becker&Hickl SPC files.
+
+def _decode_spc(data, num_overflows=0):
+    """Decode an array of SPC records.
+
+    Arguments:
+        data (array): records with dtype :data:`spc_dtype`.
+        num_overflows (int): number of macrotime overflows occurred before
+            the first record in `data`.
 
     Returns:
-        3 numpy arrays: timestamps, detector, nanotime
+        timestamps, detector, nanotime arrays and the number of overflows
+        at the end of `data`.
     """
-    spc_dtype = np.dtype([('field0', '<u2'), ('b', '<u1'), ('c', '<u1'),
-                          ('a', '<u2')])
-    data = np.fromfile(fname, dtype=spc_dtype)
-
-    nanotime =  4095 - np.bitwise_and(data['field0'], 0x0FFF)
+    nanotime = 4095 - np.bitwise_and(data['field0'], 0x0FFF)
     detector = data['c']
 
     # Build the macrotime (timestamps) using in-place operation for efficiency
@@ -51,8 +64,87 @@ def load_spc(fname):
     # extract the 13-th bit from data['field0']
     overflow = np.bitwise_and(np.right_shift(data['field0'], 13), 1)
     overflow = np.cumsum(overflow, dtype='int64')
+    overflow += num_overflows
 
     # Add the overflow bits
     timestamps += np.left_shift(overflow, 24)
 
+    if overflow.size > 0:
+        num_overflows = overflow[-1]
+    return timestamps, detector, nanotime, num_overflows
+
+def iter_spc(fname, chunksize=default_chunksize):
+    """Iterate over the data in a Becker&Hickl SPC file in chunks.
+
+    The file is read `chunksize` records at the time and the macrotime
+    overflows are carried from one chunk to the next one, so the
+    timestamps are the same as returned by :func:`load_spc`.
+
+    Yields:
+        3 numpy arrays for each chunk: timestamps, detector, nanotime
+    """
+    num_overflows = 0
+    with open(fname, 'rb') as f:
+        while True:
+            data = np.fromfile(f, dtype=spc_dtype, count=chunksize)
+            if data.size == 0:
+                break
+            timestamps, detector, nanotime, num_overflows = \
+                    _decode_spc(data, num_overflows)
+            yield timestamps, detector, nanotime
+
+def load_spc(fname, chunksize=default_chunksize):
+    """Load data from Becker&Hickl SPC files.
+
+    The file is decoded in chunks of `chunksize` records written directly
+    in the preallocated output arrays. The peak memory is the size of the
+    output plus one chunk.
+
+    Returns:
+        3 numpy arrays: timestamps, detector, nanotime
+    """
+    num_records = os.path.getsize(fname) // spc_dtype.itemsize
+    timestamps = np.zeros(num_records, dtype='int64')
+    detector = np.zeros(num_records, dtype='uint8')
+    nanotime = np.zeros(num_records, dtype='uint16')
+    i = 0
+    for ts_chunk, det_chunk, nt_chunk in iter_spc(fname, chunksize):
+        i_end = i + ts_chunk.size
+        timestamps[i:i_end] = ts_chunk
+        detector[i:i_end] = det_chunk
+        nanotime[i:i_end] = nt_chunk
+        i = i_end
     return timestamps, detector, nanotime
+
+def spc_to_hdf5(fname, h5_fname, chunksize=default_chunksize,
+                compression=hdf5.default_compression):
+    """Convert a Becker&Hickl SPC file to HDF5 without loading it in memory.
+
+    The data is read in chunks and appended to the arrays `timestamps`,
+    `detectors` and `nanotimes` in the root group of `h5_fname` (which is
+    overwritten).
+
+    Arguments:
+        fname (string): name of the SPC file.
+        h5_fname (string): name of the HDF5 file to create.
+        chunksize (int): number of records decoded at once.
+        compression (dict): arguments of `tables.Filters()`. The default
+            (zlib) is readable by any HDF5 library, use
+            :data:`fretbursts.hdf5.fast_compression` for a faster conversion
+            (see :mod:`fretbursts.hdf5`).
+
+    Returns:
+        The number of photons saved.
+    """
+    names = ('timestamps', 'detectors', 'nanotimes')
+    atoms = (tables.Int64Atom(), tables.UInt8Atom(), tables.UInt16Atom())
+    num_records = os.path.getsize(fname) // spc_dtype.itemsize
+    with tables.open_file(h5_fname, mode='w') as h5file:
+        arrays = [h5file.create_earray('/', name, atom=atom, shape=(0,),
+                                       filters=tables.Filters(**compression),
+                                       expectedrows=num_records)
+                  for name, atom in zip(names, atoms)]
+        for chunks in iter_spc(fname, chunksize):
+            for array, chunk in zip(arrays, chunks):
+                array.append(chunk)
+        return arrays[0].nrows
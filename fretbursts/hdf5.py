@@ -7,14 +7,38 @@
 This module contains a function to store :class:`fretbursts.burstlib.Data`
 objects to disk in **HDF5-smFRET** format.
 
+The photon-data arrays are written in chunks as extendable arrays, so
+the data can also be stored while it is loaded or simulated (see
+:func:`open_store`). The chunk size and the compression filters are
+configurable. The default compression (zlib) can be read by any HDF5
+library, while :data:`fast_compression` (blosc with the LZ4 codec and
+multi-threaded compression) is more than 10 times faster both to write and
+to read, at the cost of a slightly larger file and of requiring PyTables
+(or the blosc HDF5 plugin) to read the file.
+
 Utility functions to print the HDF5 file structure and data-attributes are
 also provided.
 """
 
 import os
+import numpy as np
 import tables
 
 from utils.misc import pprint
+from dataload.lazy_arrays import iter_slices
+from utils import fingerprint
+
+
+# Default compression: portable (zlib) with byte-shuffle, which groups the
+# slowly-varying high bytes of the monotonic int64 timestamps
+default_compression = dict(complevel=6, complib='zlib', shuffle=True)
+
+# Fast compression: multi-threaded blosc with the LZ4 codec
+fast_compression = dict(complevel=5, complib='blosc:lz4', shuffle=True)
+
+# Default chunk size (number of elements) of the photon-data arrays.
+# Large chunks are efficient for the sequential access of the timestamps.
+default_chunksize = 2**16
 
 
 # Metadata for the HDF5 root node
@@ -103,6 +127,20 @@ class H5Writer():
         self._add_data(where, name, self.h5file.create_carray, obj=obj,
                        filters=self.comp_filter)
 
+    def add_earray(self, where, name, dtype, chunkshape=None,
+                   expectedrows=None):
+        """Create an empty extendable array to be filled with `.append()`.
+        """
+        if expectedrows is None:
+            expectedrows = tables.parameters.EXPECTED_ROWS_EARRAY
+        return self.h5file.create_earray(where, name,
+                                         atom=tables.Atom.from_dtype(
+                                                        np.dtype(dtype)),
+                                         shape=(0,), title=_fields_meta[name],
+                                         filters=self.comp_filter,
+                                         chunkshape=chunkshape,
+                                         expectedrows=expectedrows)
+
     def add_array(self, where, name, obj=None):
         self._add_data(where, name, self.h5file.create_array, obj=obj)
 
@@ -113,8 +151,203 @@ class H5Writer():
                                         title=_fields_meta[metakey])
 
 
-def store(d, compression=dict(complevel=6, complib='zlib'), h5_fname=None,
-          verbose=True):
+def _get_filters(compression, num_threads=None):
+    """Return the `tables.Filters` for `compression` (dict).
+
+    When using blosc, `num_threads` sets the number of compression threads
+    (if None, PyTables uses all the cores).
+    """
+    if num_threads is not None:
+        tables.set_blosc_max_threads(num_threads)
+    return tables.Filters(**compression)
+
+def _photon_arrays(d):
+    """Return a list (one item per spot) of the photon-data arrays in `d`.
+
+    Each item is a dict mapping the HDF5 field names to the arrays in `d`
+    (the arrays can be on disk, see :mod:`fretbursts.dataload.lazy_arrays`).
+    """
+    if d.nch == 1:
+        if d.ALEX:
+            arrays = dict(timestamps=d.ph_times_t, detectors=d.det_t)
+            if d.lifetime:
+                arrays['nanotimes'] = d.nanotimes_t
+        else:
+            arrays = dict(timestamps=d.ph_times_m[0], detectors=d.A_em[0])
+            if d.lifetime:
+                nanotimes = d.nanotimes
+                if isinstance(nanotimes, list):
+                    nanotimes = nanotimes[0]
+                arrays['nanotimes'] = nanotimes
+        if 'par' in d:
+            arrays['particles'] = d.par[0]
+        return [arrays]
+
+    arrays_list = []
+    for ich, ph in enumerate(d.iter_ph_times()):
+        arrays = dict(timestamps=ph)
+        # If A_em[ich] is a slice we have a single color so we don't
+        # save the detector (there is only one detector per channel).
+        if type(d.A_em[ich]) is not slice:
+            arrays['detectors'] = d.A_em[ich]
+        arrays_list.append(arrays)
+    return arrays_list
+
+def _write_metadata(writer, d):
+    """Save the root-node metadata and the global parameters of `d`."""
+    for name, value in _format_meta.items():
+        writer.h5file.root._f_setattr(name, value)
+
+    ## Save the mandatory parameters
+    mandatory_fields = ['timestamps_unit', 'num_spots', 'alex', 'lifetime']
+    for field in mandatory_fields:
+        writer.add_array('/', field)
+
+    if d.ALEX:
+        writer.add_array('/', 'alex_period')
+        writer.add_array('/', 'alex_period_donor')
+        writer.add_array('/', 'alex_period_acceptor')
+
+def _create_photon_group(writer, d, ich, dtypes, chunkshape=None,
+                         expectedrows=None):
+    """Create the photon-data group of spot `ich` with empty arrays.
+
+    Returns a dict mapping the field names in `dtypes` to the new
+    extendable arrays.
+    """
+    if d.nch == 1:
+        # Single-spot: using "basic layout"
+        ph_group = writer.add_group('/', 'photon_data')
+    else:
+        # Multi-spot: using "multi-spot layout"
+        ph_group = writer.add_group('/', 'photon_data_%d' % ich,
+                                    metakey='photon_data')
+    # Keep the order of the fields used in the format specs
+    names = [name for name in ('timestamps', 'detectors', 'nanotimes',
+                               'particles') if name in dtypes]
+    arrays = {name: writer.add_earray(ph_group, name, dtypes[name],
+                                      chunkshape=chunkshape,
+                                      expectedrows=expectedrows)
+              for name in names}
+
+    if 'detectors' in dtypes:
+        if d.ALEX:
+            donor, accept = d.det_donor_accept
+        elif d.nch == 1:
+            donor, accept = 0, 1
+        else:
+            donor, accept = False, True
+        det_group = writer.add_group(ph_group, 'detectors_specs')
+        writer.add_array(det_group, 'donor', obj=donor)
+        writer.add_array(det_group, 'acceptor', obj=accept)
+
+    # If present save nanotime data
+    if 'nanotimes' in dtypes:
+        nt_group = writer.add_group(ph_group, 'nanotimes_specs')
+
+        # Mandatory specs
+        nanotimes_specs = ['tcspc_bin', 'tcspc_nbins', 'tcspc_range']
+        for spec in nanotimes_specs:
+            writer.add_array(nt_group, spec, obj=d.nanotimes_params[spec])
+
+        # Optional specs
+        nanotimes_specs = ['tau_accept_only', 'tau_donor_only',
+                           'tau_fret_donor', 'tau_fret_trans']
+        for spec in nanotimes_specs:
+            if spec in d.nanotimes_params:
+                writer.add_array(nt_group, spec,
+                                 obj=d.nanotimes_params[spec])
+    return arrays
+
+def open_store(d, h5_fname, dtypes, compression=default_compression,
+               chunksize=default_chunksize, num_threads=None,
+               expectedrows=None, append=False,
+               title="Confocal smFRET data"):
+    """Open an HDF5-Ph-Data file for streaming writes of the photon data.
+
+    The file is created with the metadata in `d` (that needs no photon
+    data) and with empty extendable photon-data arrays. The photons are
+    then stored, as they are loaded, appending them to the arrays.
+    Example::
+
+        data_file, arrays = open_store(d, h5_fname,
+                                       dict(timestamps='int64',
+                                            detectors='uint8'))
+        for ich, times, det in chunks:
+            arrays[ich]['timestamps'].append(times)
+            arrays[ich]['detectors'].append(det)
+        data_file.close()
+
+    Arguments:
+        d (Data object): the measurement metadata (`nch`, `clk_p`, `ALEX`,
+            `lifetime`, ...).
+        h5_fname (string): name of the HDF5 file.
+        dtypes (dict): data type of each photon-data field ('timestamps',
+            'detectors', 'nanotimes' or 'particles') to be stored.
+        compression (dict): compression type and level, passed to pytables
+            `tables.Filters()` (see also :data:`fast_compression`).
+        chunksize (int or None): number of elements in each chunk of the
+            photon-data arrays. If None, PyTables computes the chunk size
+            from `expectedrows`.
+        num_threads (int or None): number of blosc compression threads.
+        expectedrows (int or None): estimated number of photons per spot.
+        append (bool): if True and `h5_fname` exists, the file is opened in
+            append mode and the existing photon-data arrays are returned
+            (the file must have been created by this function).
+        title (string): title of the HDF5 file.
+
+    Returns:
+        The pytables file object and a list (one item per spot) of dicts
+        mapping the field names in `dtypes` to the extendable arrays.
+    """
+    if append and os.path.exists(h5_fname):
+        data_file = tables.open_file(h5_fname, mode="a")
+        if d.nch == 1:
+            groups = [data_file.root.photon_data]
+        else:
+            groups = [data_file.get_node('/photon_data_%d' % ich)
+                      for ich in range(d.nch)]
+        return data_file, [{name: group._f_get_child(name) for name in dtypes}
+                           for group in groups]
+
+    data_file = tables.open_file(h5_fname, mode="w", title=title)
+    writer = H5Writer(data_file, d, _get_filters(compression, num_threads))
+    _write_metadata(writer, d)
+    chunkshape = None if chunksize is None else (chunksize,)
+    arrays = [_create_photon_group(writer, d, ich, dtypes,
+                                   chunkshape=chunkshape,
+                                   expectedrows=expectedrows)
+              for ich in range(d.nch)]
+    return data_file, arrays
+
+def _timestamps_nodes(data_file):
+    """Return the list of the timestamps arrays (one per spot) in the file.
+    """
+    if '/photon_data' in data_file:
+        return [data_file.root.photon_data.timestamps]
+    num_spots = data_file.root.num_spots.read()
+    return [data_file.get_node('/photon_data_%d/timestamps' % ich)
+            for ich in range(num_spots)]
+
+def store_fingerprint(data_file, value=None):
+    """Save the fingerprint of the timestamps as attribute of the root node.
+
+    The attribute `timestamps_fingerprint` allows getting the fingerprint
+    of the data when loading the file without reading the timestamps (see
+    :meth:`fretbursts.burstlib.Data.ph_times_fingerprint`). If `value` is
+    None the fingerprint is computed reading the timestamps in chunks.
+    Call this function after a streaming write (see :func:`open_store`).
+
+    Returns:
+        The fingerprint (a string).
+    """
+    if value is None:
+        value = fingerprint.fingerprint(_timestamps_nodes(data_file))
+    data_file.root._v_attrs.timestamps_fingerprint = value
+    return value
+
+def store(d, compression=default_compression, h5_fname=None, verbose=True,
+          chunksize=default_chunksize, num_threads=None):
     """
     Saves the `Data` object `d` in the HDF5-Ph-Data format.
 
@@ -124,16 +357,19 @@ def store(d, compression=dict(complevel=6, complib='zlib'), h5_fname=None,
     Arguments:
         d (Data object): the Data object containing the smFRET measurement.
         compression (dict): a dictionary containing the compression type
-            and level. Passed to pytables `tables.Filters()`.
+            and level. Passed to pytables `tables.Filters()`. Use
+            :data:`fast_compression` for faster writes and reads.
         h5_fname (string or None): if not None, contains the file name
             to be used for the HDF5 file. If None, the file name is generated
             from `d.fname`, by replacing the original extension with '.hdf5'.
         verbose (bool): if True prints the name of the saved file.
+        chunksize (int or None): number of elements in each chunk of the
+            photon-data arrays (see :func:`open_store`).
+        num_threads (int or None): number of blosc compression threads.
 
     For description and specs of the HDF5-Ph-Data format see:
     https://github.com/tritemio/FRETBursts/wiki/HDF5-Ph-Data-format-0.2-Draft
     """
-    comp_filter = tables.Filters(**compression)
     if 'lifetime' not in d:
         # Test on different fields for ALEX and non-ALEX
         d.add(lifetime = ('nanotimes_t' in d) or ('nanotimes' in d))
@@ -147,83 +383,25 @@ def store(d, compression=dict(complevel=6, complib='zlib'), h5_fname=None,
         h5_fname = basename + '_new_copy.hdf5'
 
     pprint('Saving: %s' % h5_fname, not verbose)
-    data_file = tables.open_file(h5_fname, mode = "w",
-                                 title = "Confocal smFRET data")
-    writer = H5Writer(data_file, d, comp_filter)
-
-    ## Save the root-node metadata
-    for name, value in _format_meta.items():
-        data_file.root._f_setattr(name, value)
-
-    ## Save the mandatory parameters
-    mandatory_fields = ['timestamps_unit', 'num_spots', 'alex', 'lifetime']
-    for field in mandatory_fields:
-        writer.add_array('/', field)
-
-    if d.ALEX:
-        writer.add_array('/', 'alex_period')
-        writer.add_array('/', 'alex_period_donor')
-        writer.add_array('/', 'alex_period_acceptor')
-
-    ## Save the photon-data
-    if d.nch == 1:
-        # Single-spot: using "basic layout"
-        ph_group = writer.add_group('/', 'photon_data')
-
-        if d.ALEX:
-            for field in ['timestamps', 'detectors']:
-                writer.add_carray(ph_group, field)
-            donor, accept = d.det_donor_accept
-        else:
-            writer.add_carray(ph_group, 'timestamps', obj=d.ph_times_m[0])
-            writer.add_carray(ph_group, 'detectors', obj=d.A_em[0])
-            donor, accept = 0, 1
-
-        det_group = writer.add_group(ph_group, 'detectors_specs')
-        writer.add_array(det_group, 'donor', obj=donor)
-        writer.add_array(det_group, 'acceptor', obj=accept)
-
-        # If present save nanotime data
-        if d.lifetime:
-            if d.ALEX:
-                writer.add_carray(ph_group, 'nanotimes', obj=d.nanotimes_t)
-            else:
-                writer.add_carray(ph_group, 'nanotimes')
-            nt_group = writer.add_group(ph_group, 'nanotimes_specs')
-
-            # Mandatory specs
-            nanotimes_specs = ['tcspc_bin', 'tcspc_nbins', 'tcspc_range']
-            for spec in nanotimes_specs:
-                writer.add_array(nt_group, spec, obj=d.nanotimes_params[spec])
-
-            # Optional specs
-            nanotimes_specs = ['tau_accept_only', 'tau_donor_only',
-                               'tau_fret_donor', 'tau_fret_trans']
-            for spec in nanotimes_specs:
-                if spec in d.nanotimes_params:
-                    writer.add_array(nt_group, spec,
-                                     obj=d.nanotimes_params[spec])
-
-        if 'par' in d:
-            writer.add_carray(ph_group, 'particles', obj=d.par[0])
-
+    photon_arrays = _photon_arrays(d)
+    dtypes = {name: np.asarray(array[:0]).dtype
+              for name, array in photon_arrays[0].items()}
+    num_ph = max(arrays['timestamps'].shape[0] for arrays in photon_arrays)
+    data_file, h5_arrays = open_store(d, h5_fname, dtypes,
+                                      compression=compression,
+                                      chunksize=chunksize,
+                                      num_threads=num_threads,
+                                      expectedrows=max(num_ph, 1))
+    # Write in blocks, to avoid copies of the whole arrays in memory
+    # (and to support on-disk arrays)
+    for arrays, h5arrays in zip(photon_arrays, h5_arrays):
+        for name, array in arrays.items():
+            for chunk in iter_slices(array):
+                h5arrays[name].append(chunk)
+    if d.ALEX and d.nch == 1:
+        store_fingerprint(data_file, fingerprint.fingerprint([d.ph_times_t]))
     else:
-        # Multi-spot: using "multi-spot layout"
-        for ich, ph in enumerate(d.iter_ph_times()):
-            ch_group = writer.add_group('/', 'photon_data_%d' % ich,
-                                        metakey='photon_data')
-
-            writer.add_carray(ch_group, 'timestamps', obj=ph)
-
-            # If A_em[ich] is a slice we have a single color so we don't
-            # save the detector (there is only one detector per channel).
-            a_em = d.A_em[ich]
-            if type(a_em) is not slice:
-                writer.add_carray(ch_group, 'detectors', obj=a_em)
-                # Detector specs
-                det_group = writer.add_group(ch_group, 'detectors_specs')
-                writer.add_array(det_group, 'donor', obj=False)
-                writer.add_array(det_group, 'acceptor', obj=True)
+        store_fingerprint(data_file, d.ph_times_fingerprint())
 
     data_file.flush()
     d.add(data_file=data_file)
@@ -14,22 +14,28 @@ loading and preprocessing can be found in the `dataload` folder.
 """
 
 import os
+import itertools
 import numpy as np
 import cPickle as pickle
 import tables
 
 from dataload.multi_ch_reader import load_data_ordered16
 from dataload.smreader import load_sm
+from dataload import spcreader
 from dataload.spcreader import load_spc
 from dataload.manta_reader import (load_manta_timestamps,
                                    load_xavier_manta_data,
                                    get_timestamps_detectors,
                                    #process_timestamps,
                                    process_store,
+                                   process_store_chunks,
+                                   iter_xavier_manta_data,
                                    load_manta_timestamps_pytables)
 from utils.misc import pprint, deprecate
+from utils.profiling import profiled
 from burstlib import Data
 from dataload.pytables_array_list import PyTablesList
+from dataload.lazy_arrays import open_array, iter_slices, default_chunksize
 from hdf5 import hdf5_data_map
 
 
@@ -47,9 +53,11 @@ def _is_basic_layout(h5file):
 
 class H5Loader():
 
-    def __init__(self, h5file, data):
+    def __init__(self, h5file, data, lazy=False, chunksize=None):
         self.h5file = h5file
         self.data = data
+        self.lazy = lazy
+        self.chunksize = chunksize
 
     def load_data(self, where, name, dest_name=None, ich=None):
         try:
@@ -62,12 +70,18 @@ class H5Loader():
         if ich is None:
             self.data.add(**{dest_name: node.read()})
         else:
+            # Only per-channel photon data is loaded lazily
+            if self.lazy:
+                array = open_array(node, chunksize=self.chunksize)
+            else:
+                array = node.read()
             if ich == 0:
-                self.data.add(**{dest_name: [node.read()]})
+                self.data.add(**{dest_name: [array]})
             else:
-                self.data[dest_name].append(node.read())
+                self.data[dest_name].append(array)
 
-def hdf5(fname):
+@profiled
+def hdf5(fname, lazy=False, chunksize=None):
     """Load a data file saved in HDF5-Ph-Data format version 0.2 or higher.
 
     Any :class:`fretbursts.burstlib.Data` object can be saved in HDF5 format
@@ -75,6 +89,20 @@ def hdf5(fname):
 
     For description and specs of the HDF5-Ph-Data format see:
     https://github.com/tritemio/FRETBursts/wiki/HDF5-Ph-Data-format-0.2-Draft
+
+    Arguments:
+        fname (string): name of the file to load.
+        lazy (bool): if True, the per-channel photon data (`ph_times_m`,
+            `A_em`, `nanotimes`, ...) is not read in memory. The arrays are
+            either memory-mapped (when uncompressed and contiguous) or read
+            from the file on demand (see :mod:`fretbursts.dataload.lazy_arrays`).
+            The analysis runs out-of-core: background estimation reads one
+            background period at the time, burst search (on all photons)
+            and photon counting stream the data in chunks. The file is kept
+            open in `d.data_file`. Single-spot ALEX data is always read in
+            memory.
+        chunksize (int or None): number of photons per chunk in lazy mode.
+            If None, uses `fretbursts.dataload.lazy_arrays.default_chunksize`.
     """
     if not os.path.isfile(fname):
         raise IOError, 'File not found.'
@@ -85,7 +113,7 @@ def hdf5(fname):
     # Default values for some parameters
     params = dict(leakage=0., gamma=1.)
     d = Data(fname=fname, **params)
-    loader = H5Loader(data_file, d)
+    loader = H5Loader(data_file, d, lazy=lazy, chunksize=chunksize)
 
     # Load mandatory parameters
     mandatory_fields = ['timestamps_unit', 'num_spots', 'alex',
@@ -157,7 +185,14 @@ def hdf5(fname):
                 det_specs = ph_group.detectors_specs
                 donor = det_specs.donor.read()
                 accept = det_specs.acceptor.read()
-                if ph_group.detectors.dtype == np.bool:
+                if lazy:
+                    if ph_group.detectors.dtype == np.bool:
+                        transform = None if accept else np.logical_not
+                    else:
+                        transform = lambda det, accept=accept: det == accept
+                    a_em = open_array(ph_group.detectors, transform=transform,
+                                      chunksize=chunksize)
+                elif ph_group.detectors.dtype == np.bool:
                     a_em = ph_group.detectors.read()
                     if not accept:
                         np.logical_not(a_em, out=a_em)
@@ -172,6 +207,10 @@ def hdf5(fname):
             else:
                 d.A_em.append(a_em)
 
+    if 'ph_times_m' in d and \
+            'timestamps_fingerprint' in data_file.root._v_attrs:
+        d.set_ph_times_fingerprint(
+                data_file.root._v_attrs.timestamps_fingerprint)
     d.add(data_file=data_file)
     return d
 
@@ -250,6 +289,7 @@ def hdf5_legacy(fname):
 ##
 # Multi-spot loader functions
 #
+@profiled
 def multispot8(fname, bytes_to_read=-1, swap_D_A=True, leakage=0, gamma=1.):
     """Load a 8-ch multispot file and return a Data() object. Cached version.
     """
@@ -276,7 +316,7 @@ def multispot8_core(fname, bytes_to_read=-1, swap_D_A=True, leakage=0,
     """Load a 8-ch multispot file and return a Data() object.
     """
     dx = Data(fname=fname, clk_p=12.5e-9, nch=8, leakage=leakage, gamma=gamma)
-    ph_times_m, A_em, ph_times_det = load_data_ordered16(fname=fname,
+    ph_times_m, A_em = load_data_ordered16(fname=fname,
             n_bytes_to_read=bytes_to_read, swap_D_A=swap_D_A)
     dx.add(ph_times_m=ph_times_m, A_em=A_em, ALEX=False)
     return dx
@@ -300,9 +340,18 @@ def multispot48_simple(fname, leakage=0, gamma=1.,
         dx.add(ch_fifo=ch_fifo)
     return dx
 
+@profiled
 def multispot48(fname, leakage=0, gamma=1., reprocess=False,
-                i_start=0, i_stop=None, debug=False):
+                i_start=0, i_stop=None, debug=False, chunksize=None,
+                num_threads=None):
     """Load a 48-ch multispot file and return a Data() object.
+
+    The raw DAT file is processed and saved in an HDF5 file which is used
+    in the following loads (unless `reprocess` is True). If `chunksize` is
+    not None, the DAT file is read and processed in chunks of `chunksize`
+    words, using `num_threads` threads (in this case `i_start` and
+    `i_stop` are ignored). See
+    :func:`fretbursts.dataload.manta_reader.process_store_chunks`.
     """
     import tables
     basename, ext = os.path.splitext(fname)
@@ -310,6 +359,15 @@ def multispot48(fname, leakage=0, gamma=1., reprocess=False,
     fname_dat = basename + '.dat'
 
     def load_dat_file():
+        if chunksize is not None:
+            pprint(' - Processing DAT file in chunks: %s ... ' % fname_dat)
+            data_chunks = iter_xavier_manta_data(fname_dat,
+                                                 chunksize=chunksize)
+            ph_times_m, big_fifo, ch_fifo = process_store_chunks(
+                    data_chunks, out_fname=fname_h5, fifo_flag=True,
+                    num_threads=num_threads)
+            pprint('DONE.\n')
+            return ph_times_m, big_fifo, ch_fifo
         pprint(' - Loading DAT file: %s ... ' % fname_dat)
         ## Load data from raw file and store it in a HDF5 file
         data = load_xavier_manta_data(fname_dat, i_start=i_start,
@@ -360,16 +418,152 @@ def multispot48(fname, leakage=0, gamma=1., reprocess=False,
 #
 
 # Build masks for the alternating periods
-def _select_outer_range(times, period, edges):
-    return ((times % period) > edges[0]) + ((times % period) < edges[1])
+def _phase_in_range(phase, edges, wrap=True):
+    """Mask of photons with alternation `phase` inside the window `edges`.
 
-def _select_inner_range(times, period, edges):
-    return ((times % period) > edges[0]) * ((times % period) < edges[1])
+    When `wrap` is True and edges[0] > edges[1] the window wraps around the
+    end of the alternation period.
+    """
+    if edges[0] < edges[1] or not wrap:
+        return (phase > edges[0]) & (phase < edges[1])
+    return (phase > edges[0]) | (phase < edges[1])
+
+# Bits of the stream code returned by _alex_selection()
+_code_a_em, _code_a_ex = 1, 2
+
+def _alex_selection(phase, det, D_ON, A_ON, det_donor_accept,
+                    remove_d_em_a_ex=False, wrap=True):
+    """Select the photons of an ALEX measurement from the alternation phase.
+
+    Arguments:
+        phase (array): alternation phase of each photon (timestamps modulo
+            the alternation period for usALEX).
+        det (array): detector of each photon.
+        D_ON, A_ON (tuples): donor and acceptor excitation windows.
+        det_donor_accept (tuple): donor and acceptor detectors.
+        remove_d_em_a_ex (bool): if True, discard donor-ch photons during
+            acceptor excitation.
+        wrap (bool): if True the excitation windows can wrap around the
+            end of the period (see :func:`_phase_in_range`).
+
+    Returns:
+        The mask of the selected photons and the stream code of the selected
+        photons (uint8): bit 0 is set for acceptor emission and bit 1 for
+        acceptor excitation (otherwise donor emission/excitation).
+    """
+    donor_ch, accept_ch = det_donor_accept
+    a_em = (det == accept_ch)
+    valid = a_em | (det == donor_ch)
+    d_ex = _phase_in_range(phase, D_ON, wrap)
+    a_ex = _phase_in_range(phase, A_ON, wrap)
+    # Safety check: each ph is either D or A ex (not both)
+    assert not (d_ex & a_ex & valid).any()
 
-def _select_range(times, period, edges):
-    return _select_inner_range(times, period, edges) if edges[0] < edges[1] \
-            else _select_outer_range(times, period, edges)
+    mask = valid & (d_ex | a_ex)   # Removes alternation transients
+    if remove_d_em_a_ex:
+        # Removes donor-ch photons during acceptor excitation
+        mask &= a_em | d_ex
+    code = a_em[mask].astype('uint8')
+    code[a_ex[mask]] += _code_a_ex
+    return mask, code
+
+def iter_alex_selection(chunks, D_ON, A_ON, det_donor_accept, period=None,
+                        remove_d_em_a_ex=False):
+    """Apply the ALEX selection block by block to a stream of photon data.
+
+    Arguments:
+        chunks (iterable): sequence of tuples (timestamps, detectors,
+            nanotimes) of consecutive blocks of photons. For usALEX data
+            `nanotimes` is None.
+        D_ON, A_ON (tuples): donor and acceptor excitation windows. They
+            are applied to the nanotimes for nsALEX data and to the
+            timestamps modulo `period` for usALEX data.
+        det_donor_accept (tuple): donor and acceptor detectors.
+        period (int or None): alternation period for usALEX data.
+        remove_d_em_a_ex (bool): if True, discard donor-ch photons during
+            acceptor excitation.
+
+    Yields:
+        For each block, the selected timestamps, the selected nanotimes
+        (None for usALEX data) and the stream code (see
+        :func:`_alex_selection`).
+    """
+    for times, det, nanotimes in chunks:
+        if nanotimes is None:
+            phase, wrap = times % period, True
+        else:
+            phase, wrap = nanotimes, False
+        mask, code = _alex_selection(phase, det, D_ON, A_ON,
+                                     det_donor_accept, remove_d_em_a_ex, wrap)
+        del phase
+        nanotimes = None if nanotimes is None else nanotimes[mask]
+        yield times[mask], nanotimes, code
+
+def _alex_select_chunks(times, det, D_ON, A_ON, det_donor_accept,
+                        period=None, nanotimes=None, remove_d_em_a_ex=False,
+                        chunksize=default_chunksize, in_place=False):
+    """Apply the ALEX selection to the photon arrays in chunks.
+
+    The alternation phase is computed once per photon, and all the
+    temporary arrays have the size of a chunk (see
+    :func:`iter_alex_selection`). If `in_place` is True, the selected
+    timestamps are written at the beginning of `times` and the returned
+    timestamps are a view of `times`.
+
+    Returns:
+        The selected timestamps, the selected nanotimes (None for usALEX
+        data) and the stream code.
+    """
+    if nanotimes is None:
+        chunks = itertools.izip(iter_slices(times, chunksize=chunksize),
+                                iter_slices(det, chunksize=chunksize),
+                                itertools.repeat(None))
+    else:
+        chunks = itertools.izip(iter_slices(times, chunksize=chunksize),
+                                iter_slices(det, chunksize=chunksize),
+                                iter_slices(nanotimes, chunksize=chunksize))
+    ph_times, nanotimes_sel, codes = [], [], []
+    num_ph = 0
+    for times_sel, nanotimes_chunk, code in iter_alex_selection(
+            chunks, D_ON, A_ON, det_donor_accept, period=period,
+            remove_d_em_a_ex=remove_d_em_a_ex):
+        if in_place:
+            # The write position never passes the read position
+            times[num_ph:num_ph + code.size] = times_sel
+        else:
+            ph_times.append(times_sel)
+        nanotimes_sel.append(nanotimes_chunk)
+        codes.append(code)
+        num_ph += code.size
+    ph_times = times[:num_ph] if in_place else _join_chunks(ph_times, times)
+    if nanotimes is not None:
+        nanotimes_sel = _join_chunks(nanotimes_sel, nanotimes)
+    else:
+        nanotimes_sel = None
+    return ph_times, nanotimes_sel, _join_chunks(codes, np.zeros(0, 'uint8'))
+
+def _join_chunks(chunks, empty):
+    """Concatenate a list of arrays (return `empty[:0]` for an empty list).
+    """
+    if len(chunks) == 0:
+        return empty[:0]
+    return np.hstack(chunks)
+
+def _masks_from_code(code):
+    """Return the D_em, A_em, D_ex, A_ex masks from the stream `code`."""
+    a_em = np.bitwise_and(code, _code_a_em).astype(bool)
+    a_ex = np.bitwise_and(code, _code_a_ex).astype(bool)
+    return ~a_em, a_em, ~a_ex, a_ex
+
+def _add_alex_selection(d, ph_times, code, nanotimes=None):
+    """Add to `d` the photon data selected by :func:`_alex_selection`."""
+    d_em, a_em, d_ex, a_ex = _masks_from_code(code)
+    if nanotimes is not None:
+        d.add(nanotimes=nanotimes)
+    d.add(ph_times_m=[ph_times],
+          D_em=[d_em], A_em=[a_em], D_ex=[d_ex], A_ex=[a_ex],)
 
+@profiled
 def usalex(fname, leakage=0, gamma=1., header=166, bytes_to_read=-1, BT=None):
     """Load a usALEX file and return a Data() object.
 
@@ -408,12 +602,20 @@ def usalex(fname, leakage=0, gamma=1., header=166, bytes_to_read=-1, BT=None):
               )
     return dx
 
-def usalex_apply_period(d, delete_ph_t=True, remove_d_em_a_ex=False):
+@profiled
+def usalex_apply_period(d, delete_ph_t=True, remove_d_em_a_ex=False,
+                        chunksize=default_chunksize, in_place=False):
     """Applies to the Data object `d` the alternation period previously set.
 
     Note that you first need to load the data with :func:`usalex` and then
     to set the alternation parameters using `d.add()`.
 
+    The alternation phase is computed once for each photon and the photons
+    are selected in a single pass over chunks of `chunksize` photons, so
+    the temporary arrays have the size of a chunk. If `in_place` is True
+    the selected timestamps overwrite `d.ph_times_t` (no copy of the
+    timestamps is made).
+
     The pattern to load usALEX data is the following::
 
         d = loader.usalex(fname=fname)
@@ -427,42 +629,12 @@ def usalex_apply_period(d, delete_ph_t=True, remove_d_em_a_ex=False):
     Now `d` is ready for futher processing such as background estimation,
     burst search, etc...
     """
-    donor_ch, accept_ch  = d.det_donor_accept
-    # Remove eventual ch different from donor or acceptor
-    d_ch_mask_t = (d.det_t == donor_ch)
-    a_ch_mask_t = (d.det_t == accept_ch)
-    valid_mask = d_ch_mask_t + a_ch_mask_t
-    ph_times_val = d.ph_times_t[valid_mask]
-    d_ch_mask_val = d_ch_mask_t[valid_mask]
-    a_ch_mask_val = a_ch_mask_t[valid_mask]
-    assert (d_ch_mask_val + a_ch_mask_val).all()
-    assert not (d_ch_mask_val * a_ch_mask_val).any()
-
-    # Build masks for excitation windows
-    d_ex_mask_val = _select_range(ph_times_val, d.alex_period, d.D_ON)
-    a_ex_mask_val = _select_range(ph_times_val, d.alex_period, d.A_ON)
-    # Safety check: each ph is either D or A ex (not both)
-    assert not (d_ex_mask_val * a_ex_mask_val).any()
-
-    mask = d_ex_mask_val + a_ex_mask_val  # Removes alternation transients
-
-    # Assign the new ph selection mask
-    ph_times = ph_times_val[mask]
-    d_em = d_ch_mask_val[mask]
-    a_em = a_ch_mask_val[mask]
-    d_ex = d_ex_mask_val[mask]
-    a_ex = a_ex_mask_val[mask]
-
-    if remove_d_em_a_ex:
-        # Removes donor-ch photons during acceptor excitation
-        mask = a_em + d_em*d_ex
-        assert (mask == -(a_ex*d_em)).all()
-
-        ph_times = ph_times[mask]
-        d_em = d_em[mask]
-        a_em = a_em[mask]
-        d_ex = d_ex[mask]
-        a_ex = a_ex[mask]
+    ph_times, _, code = _alex_select_chunks(
+            d.ph_times_t, d.det_t, d.D_ON, d.A_ON, d.det_donor_accept,
+            period=d.alex_period, remove_d_em_a_ex=remove_d_em_a_ex,
+            chunksize=chunksize, in_place=in_place)
+    d_em, a_em, d_ex, a_ex = _masks_from_code(code)
+    del code
 
     assert d_em.sum() + a_em.sum() == ph_times.size
     assert (d_em * a_em).any() == False
@@ -484,7 +656,10 @@ def usalex_apply_period(d, delete_ph_t=True, remove_d_em_a_ex=False):
 # nsALEX loader functions
 #
 
-def nsalex(fname, leakage=0, gamma=1.):
+@profiled
+def nsalex(fname, leakage=0, gamma=1., apply_period=False,
+           D_ON=(10, 1500), A_ON=(2000, 3500), det_donor_accept=(4, 6),
+           chunksize=spcreader.default_chunksize):
     """Load a nsALEX file and return a Data() object.
 
     This function returns a Data() object to which you need to apply
@@ -503,27 +678,43 @@ def nsalex(fname, leakage=0, gamma=1.):
 
     Now `d` is ready for futher processing such as background estimation,
     burst search, etc...
-    """
-    ph_times_t, det_t, nanotimes = load_spc(fname)
 
-    DONOR_ON = (10, 1500)
-    ACCEPT_ON = (2000, 3500)
+    When the excitation windows are known in advance, pass
+    `apply_period=True` (and `D_ON`, `A_ON`, `det_donor_accept`). In this
+    case the SPC file is read and selected block by block (`chunksize`
+    records at the time) and only the selected photons are kept in memory.
+    """
     nanotimes_nbins = 4095
-
     dx = Data(fname=fname, clk_p=50e-9, nch=1, ALEX=True, lifetime=True,
-              D_ON=DONOR_ON, A_ON=ACCEPT_ON,
+              D_ON=D_ON, A_ON=A_ON,
               nanotimes_nbins=nanotimes_nbins,
-              ph_times_t=ph_times_t, det_t=det_t, nanotimes_t=nanotimes,
-              det_donor_accept=(4, 6),
+              det_donor_accept=det_donor_accept,
               )
+    if apply_period:
+        chunks = spcreader.iter_spc(fname, chunksize=chunksize)
+        selected = zip(*iter_alex_selection(chunks, D_ON, A_ON,
+                                            det_donor_accept))
+        if len(selected) == 0:
+            selected = [np.zeros(0, 'int64'), np.zeros(0, 'uint16'),
+                        np.zeros(0, 'uint8')]
+        ph_times, nanotimes, code = [np.hstack(arrays) for arrays in selected]
+        _add_alex_selection(dx, ph_times, code, nanotimes=nanotimes)
+    else:
+        ph_times_t, det_t, nanotimes = load_spc(fname, chunksize=chunksize)
+        dx.add(ph_times_t=ph_times_t, det_t=det_t, nanotimes_t=nanotimes)
     return dx
 
-def nsalex_apply_period(d, delete_ph_t=True):
+@profiled
+def nsalex_apply_period(d, delete_ph_t=True, chunksize=default_chunksize):
     """Applies to the Data object `d` the alternation period previously set.
 
     Note that you first need to load the data with :func:`nsalex` and then
     to set the alternation parameters using `d.add()`.
 
+    The photons are selected in a single pass over chunks of `chunksize`
+    photons (see :func:`iter_alex_selection`), so the temporary arrays have
+    the size of a chunk.
+
     The pattern to load nsALEX data is the following::
 
         d = loader.nsalex(fname=fname)
@@ -537,42 +728,10 @@ def nsalex_apply_period(d, delete_ph_t=True):
     Now `d` is ready for futher processing such as background estimation,
     burst search, etc...
     """
-    # Note: between boolean arrays * is equavilent to logical AND,
-    #       and + is equivalent to logical OR.
-
-    donor_ch, accept_ch  = d.det_donor_accept
-
-    # Mask for donor + acceptor detectors (discard other detectors)
-    d_ch_mask_t = (d.det_t == donor_ch)
-    a_ch_mask_t = (d.det_t == accept_ch)
-    da_ch_mask_t = d_ch_mask_t + a_ch_mask_t
-
-    # Masks for excitation periods
-    d_ex_mask_t = (d.nanotimes_t > d.D_ON[0]) * (d.nanotimes_t < d.D_ON[1])
-    a_ex_mask_t = (d.nanotimes_t > d.A_ON[0]) * (d.nanotimes_t < d.A_ON[1])
-    ex_mask_t = d_ex_mask_t + a_ex_mask_t  # Select only ph during Dex or Aex
-
-    # Total mask: D+A photons, and only during the excitation periods
-    mask = da_ch_mask_t * ex_mask_t  # logical AND
-
-    # Apply selection to timestamps and nanotimes
-    ph_times = d.ph_times_t[mask]
-    nanotimes = d.nanotimes_t[mask]
-
-    # Apply selection to the emission masks
-    d_em = d_ch_mask_t[mask]
-    a_em = a_ch_mask_t[mask]
-    assert (d_em + a_em).all()
-    assert not (d_em * a_em).any()
-
-    # Apply selection to the excitation masks
-    d_ex = d_ex_mask_t[mask]
-    a_ex = a_ex_mask_t[mask]
-    assert (d_ex + a_ex).all()
-    assert not (d_ex * a_ex).any()
-
-    d.add(ph_times_m=[ph_times], nanotimes=nanotimes,
-          D_em=[d_em], A_em=[a_em], D_ex=[d_ex], A_ex=[a_ex],)
+    ph_times, nanotimes, code = _alex_select_chunks(
+            d.ph_times_t, d.det_t, d.D_ON, d.A_ON, d.det_donor_accept,
+            nanotimes=d.nanotimes_t, chunksize=chunksize)
+    _add_alex_selection(d, ph_times, code, nanotimes=nanotimes)
 
     if delete_ph_t:
         d.delete('ph_times_t')
@@ -0,0 +1,153 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Recurrence analysis of single particles (RASP).
+
+In a RASP analysis a set of *initial bursts* is selected (typically by an
+E range) and, for each of them, the bursts that follow within a time
+window are collected. Since the probability that the *same* molecule
+returns to the observation volume decays quickly with the delay, the E
+histogram of these *recurrent bursts* is enriched in the sub-population
+of the initial bursts when the delay is short.
+
+All the functions here rely on the fact that the burst start times
+(`b_start(mburst)`) are sorted. The bursts following an initial burst
+are found with a `searchsorted` on the burst start array, so the cost is
+O(N log N + P) where P is the number of burst pairs in the time window,
+instead of O(N^2) of a naive pair search.
+
+The delay between two bursts is defined as the time between the end of the
+initial burst and the start of the following burst. Bursts starting
+before the end of the initial burst are never paired.
+
+The main function is :func:`recurrence_hist` that computes, in a single
+pass, the E histograms of recurrent bursts for many delay windows.
+"""
+
+from __future__ import division
+import numpy as np
+
+from burstsearch.burstsearchlib import b_start, b_end
+
+
+def burst_pairs(t_start, t_end, i_init, dt_max, dt_min=0):
+    """Find all the bursts following the initial bursts within a time window.
+
+    Arguments:
+        t_start (array): burst start times, must be sorted (increasing).
+        t_end (array): burst end times, same size as `t_start`.
+        i_init (array of ints): indexes of the initial bursts.
+        dt_max (number): max delay (same units as `t_start`) between the
+            end of an initial burst and the start of a following burst.
+        dt_min (number): min delay (same units as `t_start`). Bursts
+            with delay <= `dt_min` are not paired. Default 0.
+
+    Returns:
+        Three arrays of the same size (one element per burst pair):
+        index of the initial burst, index of the following burst and
+        delay between them (start of the second minus end of the first).
+    """
+    i_init = np.asarray(i_init, dtype=np.int64)
+    t_end_init = t_end[i_init]
+    # Following bursts have start in (t_end + dt_min, t_end + dt_max]
+    lo = np.searchsorted(t_start, t_end_init + dt_min, side='right')
+    hi = np.searchsorted(t_start, t_end_init + dt_max, side='right')
+    num_pairs = np.clip(hi - lo, 0, None)
+
+    total = num_pairs.sum()
+    i_pair = np.repeat(i_init, num_pairs)
+    # Build the concatenation of arange(lo[k], hi[k]) for all k
+    # without a python loop: a running index reset at each group start.
+    offsets = np.cumsum(num_pairs) - num_pairs
+    j_pair = np.arange(total, dtype=np.int64)
+    j_pair += np.repeat(lo - offsets, num_pairs)
+
+    delays = t_start[j_pair] - t_end[i_pair]
+    return i_pair, j_pair, delays
+
+def recurrence_pairs(d, ich=0, E1=-np.inf, E2=np.inf, dt_max_ms=100,
+                     dt_min_ms=0):
+    """Return burst pairs and delays for the initial bursts in [E1, E2].
+
+    Arguments:
+        d (Data object): contains the burst data (E is needed).
+        ich (int): channel index.
+        E1, E2 (floats): E range used to select the initial bursts.
+        dt_max_ms, dt_min_ms (floats): delay range (in milli-seconds)
+            in which to search the recurrent bursts.
+
+    Returns:
+        Three arrays (see :func:`burst_pairs`): index of the initial
+        burst, index of the recurrent burst and delay in seconds.
+    """
+    mburst = d.mburst[ich]
+    if mburst.size == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([])
+    E = d.E[ich]
+    i_init = np.nonzero((E >= E1)*(E <= E2))[0]
+    dt_max_clk = dt_max_ms*1e-3/d.clk_p
+    dt_min_clk = dt_min_ms*1e-3/d.clk_p
+    i_pair, j_pair, delays = burst_pairs(b_start(mburst), b_end(mburst),
+                                         i_init, dt_max=dt_max_clk,
+                                         dt_min=dt_min_clk)
+    return i_pair, j_pair, delays*d.clk_p
+
+def recurrence_hist(d, E1=-np.inf, E2=np.inf, delays_ms=(0, 10, 20, 50, 100),
+                    E_bins=None, ich=None, count_initial=False):
+    """Compute E histograms of recurrent bursts for many delay windows.
+
+    For each initial burst (bursts with E in [E1, E2]) all the following
+    bursts within the largest delay are found in one pass. The E values
+    of these recurrent bursts are then histogrammed as a function of the
+    delay, using `delays_ms` as bin edges. Each row of the returned
+    histogram is the E histogram for one delay window.
+
+    Arguments:
+        d (Data object): contains the burst data (E is needed).
+        E1, E2 (floats): E range used to select the initial bursts.
+        delays_ms (sequence of floats): edges (in milli-seconds) of the delay
+            windows. N edges define N - 1 windows between consecutive
+            edges. Must be increasing.
+        E_bins (array or None): E histogram bin edges. If None, uses bins
+            of 0.05 between -0.2 and 1.2.
+        ich (int or None): channel on which to compute the histogram. If
+            None, the histograms of all the channels are summed.
+        count_initial (bool): if True, returns also the number of initial
+            bursts (summed over the channels when `ich` is None).
+
+    Returns:
+        A tuple (hist, delays_ms, E_bins) where `hist` is a 2D array of
+        counts with shape (len(delays_ms) - 1, len(E_bins) - 1).
+        If `count_initial` is True, the number of initial bursts is
+        appended to the tuple.
+    """
+    if E_bins is None:
+        E_bins = np.arange(-0.2, 1.2 + 1e-4, 0.05)
+    delays_ms = np.asarray(delays_ms, dtype=float)
+    assert delays_ms.size >= 2 and (np.diff(delays_ms) > 0).all()
+
+    channels = range(d.nch) if ich is None else [ich]
+    hist = np.zeros((delays_ms.size - 1, np.size(E_bins) - 1))
+    num_initial = 0
+    for ich_i in channels:
+        if d.mburst[ich_i].size == 0:
+            continue
+        i_pair, j_pair, delays_s = recurrence_pairs(
+                d, ich=ich_i, E1=E1, E2=E2, dt_max_ms=delays_ms[-1],
+                dt_min_ms=delays_ms[0])
+        if count_initial:
+            E = d.E[ich_i]
+            num_initial += ((E >= E1)*(E <= E2)).sum()
+        if i_pair.size == 0:
+            continue
+        hist_ch, _, _ = np.histogram2d(delays_s*1e3, d.E[ich_i][j_pair],
+                                       bins=[delays_ms, E_bins])
+        hist += hist_ch
+
+    if count_initial:
+        return hist, delays_ms, E_bins, num_initial
+    return hist, delays_ms, E_bins
@@ -14,13 +14,29 @@ parameter. For example::
 returns a new object `ds` containing only the bursts of `d` that pass the
 specified selection criterium (`E` between 0.2 and 0.6 in this case).
 
+Several criteria can be combined in a single selection with a *selection
+expression* (see :func:`expression` and :meth:`burstlib.Data.select`)::
+
+    ds = d.select('nt > 30 & 0.2 < E < 0.8 & na_bg_p(P=0.01)')
+
 """
 
+import ast
+import tokenize
+import __future__
+from StringIO import StringIO
 import numpy as np
-import scipy.stats as ss
 
 from burstsearch.burstsearchlib import b_start, b_width, b_end, b_separation
 from utils.misc import clk_to_s, deprecate
+from utils.lazy import LazyModule
+
+ss = LazyModule('scipy.stats')
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
 
 
 ## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -348,3 +364,158 @@ def fret_value(d, ich=0, E=0.5, P_th=0.01):
         bursts_mask[indexes] = (d.na[ich][indexes] > min_accept_num)
     return bursts_mask
 
+
+## - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#  SELECTION EXPRESSIONS
+#
+
+# Per-burst quantities usable as names in a selection expression
+expr_fields = ['E', 'S', 'nd', 'na', 'nt', 'nda', 'naa', 'bp', 'max_rate',
+               'sbr', 'width', 'size']
+
+_cmp_ops = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+            ast.Eq: '==', ast.NotEq: '!='}
+_bin_ops = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+            ast.Pow: '**', ast.Mod: '%', ast.BitAnd: '&', ast.BitOr: '|'}
+_unary_ops = {ast.Not: '~', ast.Invert: '~', ast.USub: '-', ast.UAdd: '+'}
+_bool_ops = {ast.And: ' & ', ast.Or: ' | '}
+
+# Compiled expressions: expr -> (source, code, fields, calls)
+_expr_cache = {}
+
+def _sel_functions():
+    """Return the names of the selection functions usable in expressions."""
+    return sorted(name for name, obj in globals().items()
+                  if callable(obj) and not name.startswith('_')
+                  and getattr(obj, '__module__', None) == __name__
+                  and name not in ('str_G', 'expression'))
+
+def _translate(node, fields, calls):
+    """Translate the AST `node` in an (numexpr compatible) array expression.
+
+    The names of the fields used are added to the set `fields` and the
+    selection functions called are appended to `calls` as (name, kwargs).
+    Each call is replaced by a variable named '_sel<index in calls>'.
+    """
+    translate = lambda node: _translate(node, fields, calls)
+    if isinstance(node, ast.Expression):
+        return translate(node.body)
+    elif isinstance(node, ast.Num):
+        return repr(node.n)
+    elif isinstance(node, ast.Name):
+        if node.id in ('True', 'False'):
+            return node.id
+        if node.id not in expr_fields:
+            raise ValueError('Unknown name "%s" in selection expression. '
+                             'Valid names: %s.' % (node.id, expr_fields))
+        fields.add(node.id)
+        return node.id
+    elif isinstance(node, ast.Compare):
+        left = translate(node.left)
+        terms = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _cmp_ops:
+                raise ValueError('Unsupported comparison in selection '
+                                 'expression.')
+            right = translate(comparator)
+            terms.append('(%s %s %s)' % (left, _cmp_ops[type(op)], right))
+            left = right
+        return '(%s)' % ' & '.join(terms)
+    elif isinstance(node, ast.BoolOp):
+        return '(%s)' % _bool_ops[type(node.op)].join(
+            translate(value) for value in node.values)
+    elif isinstance(node, ast.UnaryOp):
+        return '(%s%s)' % (_unary_ops[type(node.op)], translate(node.operand))
+    elif isinstance(node, ast.BinOp) and type(node.op) in _bin_ops:
+        return '(%s %s %s)' % (translate(node.left), _bin_ops[type(node.op)],
+                               translate(node.right))
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or \
+           node.func.id not in _sel_functions():
+            raise ValueError('Unknown selection function in expression. '
+                             'Valid functions: %s.' % _sel_functions())
+        if node.args or node.starargs or node.kwargs:
+            raise ValueError('Selection functions in expressions accept '
+                             'only keyword arguments.')
+        kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+        calls.append((node.func.id, kwargs))
+        return '_sel%d' % (len(calls) - 1)
+    raise ValueError('Unsupported syntax in selection expression.')
+
+def _replace_logical_ops(expr):
+    """Replace `&`, `|`, `~` in `expr` with `and`, `or`, `not`.
+
+    In this way `&` and `|` have lower precedence than the comparisons
+    (i.e. 'nt > 30 & E < 0.5' means '(nt > 30) & (E < 0.5)').
+    """
+    replace = {'&': 'and', '|': 'or', '~': 'not'}
+    tokens = [replace.get(tok_str, tok_str) if tok_type == tokenize.OP
+              else tok_str for tok_type, tok_str, _, _, _ in
+              tokenize.generate_tokens(StringIO(expr.strip()).readline)]
+    return ' '.join(tokens).strip()
+
+def _compile_expr(expr):
+    """Return (source, code, fields, calls) for the selection `expr`."""
+    if expr not in _expr_cache:
+        try:
+            tree = ast.parse(_replace_logical_ops(expr), mode='eval')
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise ValueError('Invalid selection expression "%s": %s' %
+                             (expr, e))
+        fields, calls = set(), []
+        source = _translate(tree, fields, calls)
+        code = compile(source, '<selection>', 'eval',
+                       __future__.division.compiler_flag, True)
+        _expr_cache[expr] = (source, code, fields, calls)
+    return _expr_cache[expr]
+
+def _expr_field(d, ich, name):
+    """Return the array of the per-burst quantity `name` for channel `ich`.
+    """
+    if name == 'width':
+        return b_width(d.mburst[ich])*d.clk_p*1e3
+    elif name == 'size':
+        return d.burst_sizes_ich(ich)
+    return d[name][ich]
+
+def expression(d, ich=0, expr='True'):
+    """Select bursts satisfying the boolean expression `expr` (a string).
+
+    The expression can use the per-burst quantities in :data:`expr_fields`
+    (`width` is the burst duration in ms, `size` is nd + na), numbers,
+    comparisons (also chained as in `0.2 < E < 0.8`), arithmetic operators
+    and `&`, `|`, `~` (or `and`, `or`, `not`). Unlike in python, `&` and
+    `|` have lower precedence than the comparisons. The other selection
+    functions of this module can be called with keyword arguments, for
+    example `na_bg_p(P=0.01)`. For example::
+
+        ds = Sel(d, select_bursts.expression,
+                 expr='nt > 30 & 0.2 < E < 0.8 & na_bg_p(P=0.01)')
+
+    The expression is parsed only once and, for each channel, all the
+    conditions are evaluated in a single pass producing one mask (using
+    `numexpr` when installed).
+    """
+    source, code, fields, calls = _compile_expr(expr)
+    num_bursts = d.num_bursts[ich]
+    if num_bursts == 0:
+        return np.zeros(0, dtype=bool), ''
+    variables = {name: _expr_field(d, ich, name) for name in fields}
+    for i_call, (name, kwargs) in enumerate(calls):
+        mask = globals()[name](d, ich, **kwargs)
+        if isinstance(mask, tuple):
+            mask = mask[0]
+        variables['_sel%d' % i_call] = np.asarray(mask, dtype=bool)
+    if numexpr is not None:
+        burst_mask = numexpr.evaluate(source, local_dict=variables,
+                                      truediv=True)
+    else:
+        burst_mask = eval(code, {'__builtins__': {}, 'True': True,
+                                       'False': False}, variables)
+    burst_mask = np.asarray(burst_mask)
+    if burst_mask.dtype != bool:
+        raise ValueError('The selection expression "%s" is not a boolean '
+                         'condition.' % expr)
+    if burst_mask.shape != (num_bursts,):
+        burst_mask = np.zeros(num_bursts, dtype=bool) | burst_mask
+    return burst_mask, ''
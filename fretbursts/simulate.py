@@ -0,0 +1,385 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Generator of synthetic smFRET photon streams.
+
+The simulated measurement is a sum of a Poisson background and of bursts of
+photons emitted by molecules diffusing through the excitation volume. The
+bursts arrive as a Poisson process, each burst has a gaussian time profile
+and a random brightness (to mimic different paths through the PSF). Each
+burst belongs to a population with a given FRET efficiency `E` and
+(for ALEX data) stoichiometry `S`. Leakage (donor emission detected in the
+acceptor channel) and direct acceptor excitation are added as extra photons
+with the same definitions used by :class:`fretbursts.burstlib.Data` for the
+corrections. Optionally TCSPC nanotimes are simulated as well.
+
+The simulation supports 1, 8 or 48 spots (ALEX only for single-spot). It
+is performed in chunks of time of duration `chunk_s`, so that arbitrary
+large measurements (10^9 photons and more) can be streamed to disk in an
+HDF5-Ph-Data file with bounded memory. The random generator of each spot is
+seeded with `(seed, ich)`: for a given `seed` and `chunk_s` the simulation
+is reproducible and does not depend on the number of spots simulated.
+
+Two high-level functions are provided:
+
+- :func:`simulate_data` returns a :class:`fretbursts.burstlib.Data` object
+  ready for background estimation and burst search.
+- :func:`simulate_hdf5` saves the simulation to an HDF5-Ph-Data file that
+  can be loaded with :func:`fretbursts.loader.hdf5`.
+
+Example::
+
+    d = simulate.simulate_data(num_spots=8, duration_s=30, seed=1)
+    d.calc_bg(bg.exp_fit, time_s=10)
+    d.burst_search_t(L=10, m=10, F=6)
+"""
+
+from __future__ import division
+import os
+import numpy as np
+
+from utils.misc import pprint
+from burstlib import Data
+import hdf5
+import loader
+
+
+# Default parameters of the simulation. Rates are in counts per second.
+default_params = dict(
+    clk_p = 12.5e-9,            # timestamps unit (seconds)
+    populations = ((0.5, 0.5, 1.),),   # (E, S, fraction) of each population
+    burst_rate = 20.,           # bursts per second (per spot)
+    burst_width_ms = 0.5,       # sigma of the burst time profile
+    em_rate = 200e3,            # peak emission rate of a burst
+    bg_rate_d = 1500.,          # background rate in the donor channel
+    bg_rate_a = 800.,           # background rate in the acceptor channel
+    leakage = 0.,               # fraction of D-em photons leaking in A-ch
+    dir_ex = 0.,                # A-ch Dex photons as a fraction of AexAem
+    # usALEX (alex=True, lifetime=False) parameters (in timestamps units)
+    alex_period = 4000,
+    D_ON = (2850, 580),
+    A_ON = (900, 2580),
+    # TCSPC parameters (lifetime=True). For nsALEX (alex=True) D_ON and
+    # A_ON are the nanotimes windows for D and A excitation.
+    tcspc_nbins = 4096,
+    tcspc_bin = 50e-9/4096,     # seconds
+    tcspc_offset = 50,          # bins between laser pulse and window start
+    tau_donor_only = 4e-9,
+    tau_accept_only = 3e-9,
+    ns_D_ON = (10, 1500),
+    ns_A_ON = (2000, 3500),
+)
+
+def _get_params(num_spots, alex, lifetime, **kwargs):
+    """Return a dict with the default parameters updated with `kwargs`.
+    """
+    for name in kwargs:
+        if name not in default_params:
+            raise TypeError("Unknown simulation parameter '%s'." % name)
+    if alex and num_spots != 1:
+        raise ValueError('ALEX simulations are supported only for 1 spot.')
+    p = dict(default_params)
+    if alex and lifetime:
+        # nsALEX: alternation on the nanotime axis, 50ns timestamps
+        p.update(clk_p=50e-9, D_ON=default_params['ns_D_ON'],
+                 A_ON=default_params['ns_A_ON'],
+                 alex_period=default_params['tcspc_nbins'])
+    p.update(**kwargs)
+    pop = np.atleast_2d(np.asarray(p['populations'], dtype=float))
+    p['E'], p['S'] = pop[:, 0], pop[:, 1]
+    p['fractions'] = pop[:, 2]/pop[:, 2].sum()
+    p.update(num_spots=num_spots, alex=alex, lifetime=lifetime)
+    return p
+
+# Burst profiles are gaussians truncated at this number of sigmas
+_max_sigmas = 5.
+
+def _burst_profile_times(rs, ib, centers, sigma):
+    """Draw one time (clock units) for each photon of burst index `ib`."""
+    z = np.clip(rs.standard_normal(ib.size), -_max_sigmas, _max_sigmas)
+    return centers[ib] + sigma[ib]*z
+
+def _max_delay(p):
+    """Max time (clock units) between a photon and the start of its chunk.
+
+    Photons of a chunk can precede the start of the chunk up to this
+    amount (burst tails and usALEX window shifts).
+    """
+    max_delay = _max_sigmas*1.5*p['burst_width_ms']*1e-3/p['clk_p']
+    if p['alex'] and not p['lifetime']:
+        max_delay += p['alex_period']
+    return max_delay
+
+def _sim_bursts(rs, t0, t1, p):
+    """Simulate the burst photons whose burst center is in [t0, t1).
+
+    Returns the arrays: times (float, clock units), A-em mask, A-ex mask,
+    decay kind (0: donor decay, 1: acceptor after FRET, 2: acceptor direct)
+    and E of the burst of origin of each photon.
+    """
+    clk_p = p['clk_p']
+    num_bursts = rs.poisson(p['burst_rate']*(t1 - t0)*clk_p)
+    centers = rs.uniform(t0, t1, size=num_bursts)
+    sigma_s = p['burst_width_ms']*1e-3*rs.uniform(0.5, 1.5, num_bursts)
+    n_mean = (p['em_rate']*np.sqrt(2*np.pi)*sigma_s*
+              rs.exponential(1., num_bursts))
+    sigma = sigma_s/clk_p
+    pop = rs.choice(p['E'].size, size=num_bursts, p=p['fractions'])
+    E_b, S_b = p['E'][pop], p['S'][pop]
+
+    # Photons emitted under D (and A) excitation
+    ib = np.repeat(np.arange(num_bursts), rs.poisson(n_mean))
+    if p['alex']:
+        a_ex = rs.random_sample(ib.size) >= S_b[ib]
+    else:
+        a_ex = np.zeros(ib.size, dtype=bool)
+    fret = ~a_ex * (rs.random_sample(ib.size) < E_b[ib])
+    a_em = a_ex + fret
+    kind = np.where(a_ex, 2, np.where(fret, 1, 0)).astype(np.uint8)
+
+    # Leakage: extra A-em photons, leakage per D-ex D-em photon on average
+    ib_list, a_em_list, a_ex_list, kind_list = [ib], [a_em], [a_ex], [kind]
+    dd = ~a_em
+    if p['leakage'] > 0:
+        ib_lk = np.repeat(ib[dd], rs.poisson(p['leakage'], dd.sum()))
+        ib_list.append(ib_lk)
+        a_em_list.append(np.ones(ib_lk.size, dtype=bool))
+        a_ex_list.append(np.zeros(ib_lk.size, dtype=bool))
+        kind_list.append(np.zeros(ib_lk.size, dtype=np.uint8))
+    # Direct excitation: extra D-ex A-em photons, dir_ex per AexAem photon
+    if p['dir_ex'] > 0:
+        if p['alex']:
+            ib_de = np.repeat(ib[a_ex], rs.poisson(p['dir_ex'], a_ex.sum()))
+        else:
+            # Without A excitation use the FRET photons as reference
+            ib_de = np.repeat(ib[fret], rs.poisson(p['dir_ex'], fret.sum()))
+        ib_list.append(ib_de)
+        a_em_list.append(np.ones(ib_de.size, dtype=bool))
+        a_ex_list.append(np.zeros(ib_de.size, dtype=bool))
+        kind_list.append(2*np.ones(ib_de.size, dtype=np.uint8))
+    ib = np.hstack(ib_list)
+    times = _burst_profile_times(rs, ib, centers, sigma)
+    return (times, np.hstack(a_em_list), np.hstack(a_ex_list),
+            np.hstack(kind_list), E_b[ib])
+
+def _alex_windows(rs, times, a_ex, p):
+    """Move usALEX photons inside the D or A excitation window."""
+    period = p['alex_period']
+    offset = np.zeros(times.size)
+    for mask, (on_start, on_stop) in [(~a_ex, p['D_ON']), (a_ex, p['A_ON'])]:
+        width = (on_stop - on_start) % period
+        offset[mask] = (on_start + 1 + rs.random_sample(mask.sum())*
+                        (width - 2)) % period
+    return np.floor(times/period)*period + offset
+
+def _nanotimes(rs, a_ex, kind, E, p):
+    """Simulate TCSPC nanotimes (in TCSPC bins) for burst photons."""
+    tau_d = p['tau_donor_only']/p['tcspc_bin']
+    tau_a = p['tau_accept_only']/p['tcspc_bin']
+    size = kind.size
+    nt = np.zeros(size)
+    donor_decay = kind < 2
+    # Donor decay (quenched by FRET), followed by acceptor decay after FRET
+    nt[donor_decay] = rs.exponential(1., donor_decay.sum())*\
+                        tau_d*(1 - E[donor_decay])
+    nt[kind > 0] += rs.exponential(tau_a, (kind > 0).sum())
+    if p['alex']:
+        start = np.where(a_ex, p['A_ON'][0], p['D_ON'][0])
+    else:
+        start = 0
+    nt += start + p['tcspc_offset']
+    return np.minimum(nt, p['tcspc_nbins'] - 1).astype(np.uint16)
+
+def _sim_chunk(rs, t0, t1, p, carry, last=False):
+    """Simulate the photons of one spot in the time range [t0, t1).
+
+    `carry` contains the photons generated in the previous chunks and not
+    yet returned. Since the bursts of the next chunk can have photons
+    before t1, only the photons preceding t1 by more than
+    :func:`_max_delay` are returned and the others are returned in the
+    new carry. If `last` is True all the photons before t1 are returned.
+    """
+    times, a_em, a_ex, kind, E = _sim_bursts(rs, t0, t1, p)
+    nanotimes = None
+    if p['lifetime']:
+        nanotimes = _nanotimes(rs, a_ex, kind, E, p)
+    if p['alex'] and not p['lifetime']:
+        times = _alex_windows(rs, times, a_ex, p)
+
+    # Background: uniform in time (and in nanotime) for D and A channels
+    bg_times, bg_a_em = [], []
+    for rate, is_a_em in [(p['bg_rate_d'], False), (p['bg_rate_a'], True)]:
+        num_ph = rs.poisson(rate*(t1 - t0)*p['clk_p'])
+        bg_times.append(rs.uniform(t0, t1, num_ph))
+        bg_a_em.append(np.ones(num_ph, dtype=bool)*is_a_em)
+    fields = dict(times=np.hstack([times] + bg_times),
+                  a_em=np.hstack([a_em] + bg_a_em))
+    if p['lifetime']:
+        num_bg = sum(b.size for b in bg_times)
+        bg_nt = rs.randint(0, p['tcspc_nbins'], num_bg).astype(np.uint16)
+        fields['nanotimes'] = np.hstack([nanotimes, bg_nt])
+
+    # Add the photons carried from the previous chunk and remove the
+    # photons before the start of the measurement.
+    for name in fields:
+        if carry is not None:
+            fields[name] = np.hstack([carry[name], fields[name]])
+    valid = fields['times'] >= 0
+    index = np.argsort(fields['times'][valid], kind='mergesort')
+    for name in fields:
+        fields[name] = fields[name][valid][index]
+    t_end = t1 if last else t1 - _max_delay(p)
+    i_end = np.searchsorted(fields['times'], t_end)
+    new_carry = {name: arr[i_end:] for name, arr in fields.items()}
+    chunk = {name: arr[:i_end] for name, arr in fields.items()}
+    chunk['times'] = chunk['times'].astype(np.int64)
+    return chunk, new_carry
+
+def iter_chunks(num_spots=1, duration_s=10., chunk_s=1., seed=1,
+                alex=False, lifetime=False, **kwargs):
+    """Iterate over the simulated photon data, one time-chunk at the time.
+
+    Arguments:
+        num_spots (int): number of spots (typically 1, 8 or 48).
+        duration_s (float): duration of the measurement in seconds.
+        chunk_s (float): duration in seconds of each chunk. It controls the
+            memory usage.
+        seed (int): seed of the random generators. Each spot uses an
+            independent generator seeded with `(seed, ich)`.
+        alex (bool): if True simulate ALEX data. If `lifetime` is False
+            the simulated data is usALEX, otherwise nsALEX (PIE).
+        lifetime (bool): if True simulate the TCSPC nanotimes.
+        kwargs: simulation parameters overriding the values in
+            :data:`default_params`.
+
+    Yields:
+        A tuple `(ich, chunk)` where `chunk` is a dict with the arrays
+        'times' (int64 timestamps), 'a_em' (bool) and 'nanotimes' (uint16,
+        only if `lifetime` is True) of the spot `ich`. For each spot the
+        chunks are yielded in time order and the timestamps are sorted.
+    """
+    p = _get_params(num_spots, alex, lifetime, **kwargs)
+    duration = duration_s/p['clk_p']
+    chunk_size = chunk_s/p['clk_p']
+    if alex and not lifetime:
+        # Chunk boundaries must be a multiple of the alternation period
+        chunk_size = max(1, np.round(chunk_size/p['alex_period']))*\
+                            p['alex_period']
+    states = [np.random.RandomState([seed, ich]) for ich in range(num_spots)]
+    carry = [None]*num_spots
+    t0 = 0.
+    while t0 < duration:
+        t1 = min(t0 + chunk_size, duration)
+        for ich in range(num_spots):
+            chunk, carry[ich] = _sim_chunk(states[ich], t0, t1, p, carry[ich],
+                                           last=(t1 >= duration))
+            yield ich, chunk
+        t0 = t1
+
+def _init_data(num_spots, alex, lifetime, fname, p):
+    """Return a Data object with all the simulation metadata (no photons).
+    """
+    d = Data(fname=fname, clk_p=p['clk_p'], nch=num_spots, ALEX=alex,
+             lifetime=lifetime, leakage=0., gamma=1.)
+    if alex:
+        d.add(D_ON=p['D_ON'], A_ON=p['A_ON'], alex_period=p['alex_period'],
+              det_donor_accept=(0, 1))
+    if lifetime:
+        d.add(nanotimes_params=dict(
+                tcspc_bin=p['tcspc_bin'], tcspc_nbins=p['tcspc_nbins'],
+                tcspc_range=p['tcspc_bin']*p['tcspc_nbins'],
+                tau_donor_only=p['tau_donor_only'],
+                tau_accept_only=p['tau_accept_only']))
+    return d
+
+def simulate_data(num_spots=1, duration_s=10., chunk_s=1., seed=1,
+                  alex=False, lifetime=False, apply_period=True, **kwargs):
+    """Simulate a smFRET measurement and return a Data object.
+
+    See :func:`iter_chunks` for a description of the arguments and
+    :data:`default_params` for the simulation parameters (`kwargs`).
+
+    For ALEX data, when `apply_period` is True the alternation selection
+    is applied with :func:`fretbursts.loader.usalex_apply_period` (or
+    :func:`fretbursts.loader.nsalex_apply_period`). Otherwise the returned
+    object contains the raw arrays `ph_times_t`, `det_t` (and
+    `nanotimes_t`) as returned by the ALEX loaders.
+    """
+    p = _get_params(num_spots, alex, lifetime, **kwargs)
+    d = _init_data(num_spots, alex, lifetime, 'simulation_seed%d' % seed, p)
+    chunks = [dict(times=[], a_em=[], nanotimes=[]) for _ in range(num_spots)]
+    for ich, chunk in iter_chunks(num_spots, duration_s, chunk_s, seed,
+                                  alex, lifetime, **kwargs):
+        for name, arr in chunk.items():
+            chunks[ich][name].append(arr)
+    ph = [np.hstack(c['times']) for c in chunks]
+    a_em = [np.hstack(c['a_em']) for c in chunks]
+    if lifetime:
+        nanotimes = [np.hstack(c['nanotimes']) for c in chunks]
+
+    if not alex:
+        d.add(ph_times_m=ph, A_em=a_em)
+        if lifetime:
+            d.add(nanotimes=nanotimes)
+        return d
+
+    d.add(ph_times_t=ph[0], det_t=a_em[0].astype(np.uint8))
+    if lifetime:
+        d.add(nanotimes_t=nanotimes[0])
+    if apply_period:
+        if lifetime:
+            loader.nsalex_apply_period(d)
+        else:
+            loader.usalex_apply_period(d)
+    return d
+
+def simulate_hdf5(h5_fname, num_spots=1, duration_s=10., chunk_s=1., seed=1,
+                  alex=False, lifetime=False,
+                  compression=hdf5.default_compression,
+                  chunksize=hdf5.default_chunksize, verbose=True, **kwargs):
+    """Simulate a smFRET measurement and save it in HDF5-Ph-Data format.
+
+    The data is written chunk by chunk (see :func:`iter_chunks` for the
+    arguments), therefore the memory usage does not depend on the
+    measurement duration. The file can be loaded with
+    :func:`fretbursts.loader.hdf5`.
+
+    Arguments:
+        h5_fname (string): name of the file to be created. If the file
+            exists an IOError is raised.
+        compression (dict): compression type and level, passed to pytables
+            `tables.Filters()`.
+        chunksize (int or None): number of elements in each chunk of the
+            HDF5 arrays (see :func:`fretbursts.hdf5.open_store`).
+        verbose (bool): if True prints the name of the saved file.
+
+    Returns:
+        The file name `h5_fname`.
+    """
+    if os.path.exists(h5_fname):
+        raise IOError("File '%s' already exists." % h5_fname)
+    p = _get_params(num_spots, alex, lifetime, **kwargs)
+    d = _init_data(num_spots, alex, lifetime, h5_fname, p)
+
+    pprint('Saving: %s\n' % h5_fname, not verbose)
+    dtypes = dict(timestamps=np.int64,
+                  detectors=np.uint8 if alex else np.bool)
+    if lifetime:
+        dtypes['nanotimes'] = np.uint16
+    data_file, arrays = hdf5.open_store(d, h5_fname, dtypes,
+                                        compression=compression,
+                                        chunksize=chunksize,
+                                        title="Simulated smFRET data")
+    fields = dict(times='timestamps', a_em='detectors', nanotimes='nanotimes')
+    for ich, chunk in iter_chunks(num_spots, duration_s, chunk_s, seed,
+                                  alex, lifetime, **kwargs):
+        if alex:
+            chunk['a_em'] = chunk['a_em'].astype(np.uint8)
+        for name, arr in chunk.items():
+            arrays[ich][fields[name]].append(arr)
+    hdf5.store_fingerprint(data_file)
+    data_file.close()
+    return h5_fname
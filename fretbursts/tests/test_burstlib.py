@@ -11,11 +11,17 @@ Running the tests requires `py.test`.
 
 import pytest
 import numpy as np
+import tables
 
-from fretbursts import loader
+from fretbursts import loader, hdf5
+from fretbursts.dataload import smreader, spcreader
 import fretbursts.background as bg
 import fretbursts.burstlib as bl
 import fretbursts.burstlib_ext as bext
+import fretbursts.burstsearch.burstsearchlib as bslib
+import fretbursts.rasp as rasp
+import fretbursts.select_bursts as select_bursts
+import fretbursts.simulate as simulate
 from fretbursts.ph_sel import Ph_sel
 
 # data subdir in the notebook folder
@@ -451,5 +457,665 @@ def test_collapse(data_8ch):
         if name in d:
             assert np.allclose(dc1[name][0], dc2[name][0])
 
+def test_recurrence_pairs(data):
+    """Test the indexed RASP pair search against a naive O(N^2) search.
+    """
+    d = data
+    dt_max_ms = 50
+    for ich, mb in enumerate(d.mburst):
+        if mb.size == 0: continue  # if no bursts skip this ch
+        i_pair, j_pair, delays = rasp.recurrence_pairs(d, ich=ich, E1=0.5,
+                                                       E2=1,
+                                                       dt_max_ms=dt_max_ms)
+        bstart, bend = bl.b_start(mb), bl.b_end(mb)
+        dt_max_clk = dt_max_ms*1e-3/d.clk_p
+        E = d.E[ich]
+        # Naive search limited to the first 50 initial bursts
+        initial = np.nonzero((E >= 0.5)*(E <= 1))[0][:50]
+        pairs = []
+        for i in initial:
+            for j in xrange(mb.shape[0]):
+                if 0 < bstart[j] - bend[i] <= dt_max_clk:
+                    pairs.append((i, j))
+        initial = set(initial)
+        pairs_fast = [(i, j) for i, j in zip(i_pair, j_pair) if i in initial]
+        assert set(pairs) == set(pairs_fast)
+        assert np.allclose(delays, (bstart[j_pair] - bend[i_pair])*d.clk_p)
+
+def test_recurrence_hist(data):
+    """Test that the RASP histogram counts all the burst pairs.
+    """
+    d = data
+    delays_ms = [0, 5, 10, 50]
+    E_bins = np.arange(-1, 2.01, 0.1)
+    hist, _, _ = rasp.recurrence_hist(d, E1=0.5, E2=1, delays_ms=delays_ms,
+                                      E_bins=E_bins)
+    assert hist.shape == (len(delays_ms) - 1, E_bins.size - 1)
+    num_pairs = 0
+    for ich in range(d.nch):
+        i_pair, j_pair, delays = rasp.recurrence_pairs(d, ich=ich, E1=0.5,
+                                                       E2=1, dt_max_ms=50)
+        E_j = d.E[ich][j_pair]
+        num_pairs += ((E_j >= -1)*(E_j <= 2)).sum()
+    assert hist.sum() == num_pairs
+
+def test_simulate_chunks():
+    """Test that the simulation is seedable and does not depend on num_spots.
+    """
+    d1 = simulate.simulate_data(num_spots=1, duration_s=2, seed=3)
+    d8 = simulate.simulate_data(num_spots=8, duration_s=2, seed=3)
+    assert np.array_equal(d1.ph_times_m[0], d8.ph_times_m[0])
+    assert np.array_equal(d1.A_em[0], d8.A_em[0])
+    for ph in d8.iter_ph_times():
+        assert (np.diff(ph) >= 0).all()
+        assert ph[-1] < 2/d8.clk_p
+    # Chunks shorter than the burst tails
+    for kwargs in [dict(num_spots=8), dict(alex=True, apply_period=False)]:
+        d = simulate.simulate_data(duration_s=2, chunk_s=0.005, **kwargs)
+        for ph in (d.ph_times_m if 'ph_times_m' in d else [d.ph_times_t]):
+            assert (np.diff(ph) >= 0).all()
+
+def test_simulate_hdf5(tmpdir):
+    """Test loading a simulated HDF5 file (usALEX and multi-spot).
+    """
+    for kwargs in [dict(alex=True), dict(num_spots=8)]:
+        fname = str(tmpdir.join('sim_%d.hdf5' % len(tmpdir.listdir())))
+        simulate.simulate_hdf5(fname, duration_s=2, chunk_s=0.5, **kwargs)
+        d = simulate.simulate_data(duration_s=2, chunk_s=0.5,
+                                   apply_period=False, **kwargs)
+        dh = loader.hdf5(fname)
+        if d.ALEX:
+            assert np.array_equal(d.ph_times_t, dh.ph_times_t)
+            assert np.array_equal(d.det_t, dh.det_t)
+        else:
+            assert list_array_equal(d.ph_times_m, dh.ph_times_m)
+            assert list_array_equal(d.A_em, dh.A_em)
+        dh.data_file.close()
+
+def test_hdf5_store(tmpdir):
+    """Test saving and reloading HDF5 files, also in append mode.
+    """
+    for kwargs in [dict(), dict(alex=True), dict(num_spots=8)]:
+        d = simulate.simulate_data(duration_s=2, apply_period=False, **kwargs)
+        fname = str(tmpdir.join('store_%d.hdf5' % len(tmpdir.listdir())))
+        hdf5.store(d, compression=hdf5.fast_compression, h5_fname=fname,
+                   chunksize=1000, num_threads=2, verbose=False)
+        d.data_file.close()
+        dh = loader.hdf5(fname)
+        if d.ALEX:
+            assert np.array_equal(d.ph_times_t, dh.ph_times_t)
+            assert np.array_equal(d.det_t, dh.det_t)
+        else:
+            assert list_array_equal(d.ph_times_m, dh.ph_times_m)
+            assert list_array_equal(d.A_em, dh.A_em)
+        timestamps = dh.data_file.get_node('/photon_data' if d.nch == 1
+                                           else '/photon_data_0/timestamps')
+        if d.nch == 1:
+            timestamps = timestamps.timestamps
+        assert timestamps.chunkshape == (1000,)
+        dh.data_file.close()
+
+    d = simulate.simulate_data(num_spots=2, duration_s=2)
+    fname = str(tmpdir.join('store_append.hdf5'))
+    dtypes = dict(timestamps='int64', detectors='bool')
+    for chunk in (slice(None, 5000), slice(5000, None)):
+        data_file, arrays = hdf5.open_store(d, fname, dtypes, append=True)
+        for ich in range(d.nch):
+            arrays[ich]['timestamps'].append(d.ph_times_m[ich][chunk])
+            arrays[ich]['detectors'].append(d.A_em[ich][chunk])
+        data_file.close()
+    dh = loader.hdf5(fname)
+    assert list_array_equal(d.ph_times_m, dh.ph_times_m)
+    assert list_array_equal(d.A_em, dh.A_em)
+    dh.data_file.close()
+
+def test_burst_cache(tmpdir):
+    """Test saving and loading burst searches from the cache.
+    """
+    from fretbursts import burst_cache
+    d = simulate.simulate_data(duration_s=3, alex=True)
+    d.add(bg_data_file=tables.open_file(str(tmpdir.join('cache.hdf5')), 'w'))
+    d.calc_bg_cache(bg.exp_fit, time_s=1, tail_min_us=300)
+    for kwargs in [dict(F=6), dict(min_rate_cps=50e3, ph_sel=Ph_sel('all')),
+                   dict(F=6, ph_sel=Ph_sel(Dex='Dem'))]:
+        d.burst_search_cache(L=10, m=10, mute=True, **kwargs)
+        dx = d.copy(mute=True)
+        d.burst_search_cache(L=10, m=10, mute=True, **kwargs)
+        for name in ['mburst', 'bp', 'nd', 'na', 'naa', 'E', 'S']:
+            assert list_array_equal(d[name], dx[name])
+        assert d.ph_sel == dx.ph_sel and d.bg_corrected
+    assert len(burst_cache.list_cache(d)) == 3
+    burst_cache._limit_cache_size(d, max_entries=1)
+    assert burst_cache.list_cache(d)[0][1]['ph_sel'] == 'DexDem'
+    burst_cache.remove_cache(d)
+    assert burst_cache.list_cache(d) == []
+    d.bg_data_file.close()
+
+def test_ph_times_fingerprint(tmpdir):
+    """Test the timestamps fingerprint on in-memory and on-disk data.
+    """
+    import weakref
+    import threading
+    from fretbursts.utils import fingerprint
+    d = simulate.simulate_data(num_spots=4, duration_s=2)
+    value = d.ph_times_fingerprint()
+    assert value == fingerprint.fingerprint(d.ph_times_m, num_threads=1,
+                                            chunksize=999)
+    num_threads = threading.active_count()
+    assert value == fingerprint.fingerprint(d.ph_times_m, num_threads=3)
+    assert threading.active_count() == num_threads
+    assert d.ph_times_fingerprint() is value
+    ph_times_m = map(np.copy, d.ph_times_m)
+    ph_times_m[3][-1] += 1
+    old_ref = weakref.ref(d.ph_times_m[3])
+    d.add(ph_times_m=ph_times_m)
+    assert old_ref() is None   # the replaced arrays are freed
+    assert d.ph_times_fingerprint() != value
+    assert d.ph_times_hash() == d.ph_times_hash()
+
+    fname = str(tmpdir.join('sim_fingerprint.hdf5'))
+    simulate.simulate_hdf5(fname, num_spots=4, duration_s=2, verbose=False)
+    dl = loader.hdf5(fname, lazy=True, chunksize=1000)
+    value = dl.data_file.root._v_attrs.timestamps_fingerprint
+    assert dl.ph_times_fingerprint() == value
+    assert fingerprint.fingerprint(dl.ph_times_m) == value
+    assert dl.ph_times_hash() == simulate.simulate_data(
+        num_spots=4, duration_s=2).ph_times_hash()
+    dl.data_file.close()
+
+def test_hdf5_lazy(tmpdir):
+    """Test background and burst search on lazily loaded HDF5 data.
+    """
+    fname = str(tmpdir.join('sim_lazy.hdf5'))
+    simulate.simulate_hdf5(fname, num_spots=4, duration_s=3, chunk_s=1,
+                           verbose=False)
+    d = loader.hdf5(fname)
+    dl = loader.hdf5(fname, lazy=True)
+    assert not isinstance(dl.ph_times_m[0], np.ndarray)
+    assert list_array_equal(d.ph_data_sizes, dl.ph_data_sizes)
+    assert list_array_equal(d.get_ph_times(1), dl.get_ph_times(1))
+    for dx in (d, dl):
+        dx.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+        dx.burst_search_t(L=10, m=10, F=6, mute=True)
+    assert d.Lim == dl.Lim
+    assert list_array_equal(d.bg, dl.bg)
+    assert list_array_equal(d.bg_dd, dl.bg_dd)
+    assert list_array_equal(d.bg_ad, dl.bg_ad)
+    assert not isinstance(dl.A_em[0], np.ndarray)
+    period = slice(1000, 3000)
+    assert np.array_equal(dl.get_ph_mask(0, Ph_sel(Dex='Aem'), period),
+                          d.get_ph_mask(0, Ph_sel(Dex='Aem'))[period])
+    assert list_array_equal(d.mburst, dl.mburst)
+    assert list_array_equal(d.nd, dl.nd)
+    for ich in range(d.nch):
+        assert list_array_equal(d.iter_ph_times_period(ich),
+                                dl.iter_ph_times_period(ich))
+    d.data_file.close()
+    dl.data_file.close()
+
+def test_out_of_core(tmpdir):
+    """Test the chunked burst search and photon counting on on-disk data.
+    """
+    t = np.cumsum(np.random.RandomState(3).exponential(1e4, size=20000))
+    t = t.astype(np.int64)
+    bursts = bslib.bsearch_py(t, 10, 10, 2e4)
+    for chunksize in (7, 500, 5000):
+        chunks = [t[i:i+chunksize] for i in range(0, t.size, chunksize)]
+        bursts_c = bslib.bsearch_chunks(chunks, 10, 10, 2e4)
+        assert np.all(bursts_c == bursts)
+    mask = np.random.RandomState(4).rand(t.size) > 0.3
+    mask_chunks = [mask[i:i+333] for i in range(0, t.size, 333)]
+    assert np.all(bslib.count_ph_in_bursts_chunks(bursts, mask_chunks) ==
+                  bslib.count_ph_in_bursts_py(bursts, mask))
+
+    fname = str(tmpdir.join('sim_ooc.hdf5'))
+    simulate.simulate_hdf5(fname, num_spots=4, duration_s=3, chunk_s=1,
+                           verbose=False)
+    d = loader.hdf5(fname)
+    dl = loader.hdf5(fname, lazy=True, chunksize=1000)
+    for dx in (d, dl):
+        dx.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+        dx.burst_search_t(L=10, m=10, F=6, mute=True)
+    assert list_array_equal(d.bg, dl.bg)
+    assert list_array_equal(d.mburst, dl.mburst)
+    assert list_array_equal(d.nd, dl.nd)
+    assert list_array_equal(d.na, dl.na)
+    for dx in (d, dl):
+        dx.burst_search_t(L=10, m=10, min_rate_cps=50e3, mute=True)
+    assert list_array_equal(d.mburst, dl.mburst)
+    d.data_file.close()
+    dl.data_file.close()
+
+def test_bsearch_parallel():
+    """Test that the parallel burst search gives the serial result.
+    """
+    import threading
+    t = np.cumsum(np.random.RandomState(5).exponential(1e4, size=20000))
+    t = t.astype(np.int64)
+    num_threads = threading.active_count()
+    for L, m, T in [(10, 10, 2e4), (3, 3, 1e4), (30, 5, 3e4)]:
+        bursts = bslib.bsearch_py(t, L, m, T)
+        for num_blocks in (2, 7, 100, 5000):
+            bursts_p = bslib.bsearch_parallel(t, L, m, T, num_threads=2,
+                                              num_blocks=num_blocks)
+            assert np.all(bursts_p == bursts)
+    # The thread pools are joined
+    assert threading.active_count() == num_threads
+
+    d = simulate.simulate_data(num_spots=2, duration_s=2, seed=2)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    mburst = d.mburst
+    d.burst_search_t(L=10, m=10, F=6, mute=True, num_threads=3)
+    assert list_array_equal(mburst, d.mburst)
+
+def test_spc_chunked(tmpdir):
+    """Test the chunked SPC reader against a single-chunk read.
+    """
+    fname = str(tmpdir.join('test.spc'))
+    raw = np.random.RandomState(6).randint(0, 256, size=6*10001)
+    raw.astype(np.uint8).tofile(fname)
+    data = spcreader.load_spc(fname, chunksize=10**6)
+    for data_chunked in (spcreader.load_spc(fname, chunksize=333),
+                         [np.hstack(arrays) for arrays in
+                          zip(*spcreader.iter_spc(fname, chunksize=1000))]):
+        for array, array_chunked in zip(data, data_chunked):
+            assert array.dtype == array_chunked.dtype
+            assert np.all(array == array_chunked)
+    fname_h5 = str(tmpdir.join('test_spc.hdf5'))
+    assert spcreader.spc_to_hdf5(fname, fname_h5, chunksize=999) == 10001
+    h5file = tables.open_file(fname_h5)
+    assert np.all(h5file.root.timestamps.read() == data[0])
+    assert h5file.root.timestamps.filters.complib == 'zlib'
+    h5file.close()
+
+def test_sm_reader(tmpdir):
+    """Test the memory-mapped .sm reader and the record/time ranges.
+    """
+    fname = str(tmpdir.join('test.sm'))
+    num_ph = 10000 + smreader._num_trailing_records
+    records = np.zeros(num_ph, dtype=smreader.sm_dtype)
+    records['timestamp'] = np.arange(num_ph)*1000 + 2**33
+    records['detector'] = np.arange(num_ph) % 2
+    with open(fname, 'wb') as f:
+        f.write(' '*166 + records.tostring())
+    ph_times, det = smreader.load_sm(fname, chunksize=999)
+    assert np.all(ph_times == records['timestamp'][:10000])
+    assert np.all(det == records['detector'][:10000])
+    assert ph_times.dtype == np.int64 and det.dtype == np.uint8
+    ph_times_r, det_r = smreader.load_sm(fname[:-3], start=100, stop=3000)
+    assert np.all(ph_times_r == ph_times[100:3000])
+    assert np.all(det_r == det[100:3000])
+    time_range = (ph_times[2000], ph_times[4000] - 1)
+    ph_times_t, _ = smreader.load_sm(fname, time_range=time_range)
+    assert np.all(ph_times_t == ph_times[2000:4000])
+
+def test_merge_timestamps():
+    """Test the linear merge of sorted timestamps against a stable sort.
+    """
+    from fretbursts.dataload import multi_ch_reader as mcr
+    rs = np.random.RandomState(7)
+    timestamps_list = [np.sort(rs.randint(0, 5000, size=size))
+                       for size in (1000, 0, 300, 2000, 1)]
+    t_d, t_a = timestamps_list[0], timestamps_list[2]
+    ph_times, a_em = mcr.merge_da(t_d, t_a)
+    index_sort = np.hstack([t_d, t_a]).argsort(kind='mergesort')
+    assert np.all(ph_times == np.hstack([t_d, t_a])[index_sort])
+    assert np.all(a_em == (index_sort >= t_d.size))
+
+    ph_times, source = mcr.merge_timestamps(timestamps_list)
+    sources = np.hstack([np.zeros(t.size, dtype='uint8') + i
+                         for i, t in enumerate(timestamps_list)])
+    index_sort = np.hstack(timestamps_list).argsort(kind='mergesort')
+    assert np.all(ph_times == np.hstack(timestamps_list)[index_sort])
+    assert np.all(source == sources[index_sort])
+
+def test_manta_demux(tmpdir):
+    """Test the manta processing (single sort) and the chunked processing.
+    """
+    from fretbursts.dataload import manta_reader as mr
+    rs = np.random.RandomState(8)
+    det = rs.randint(1, 49, size=50000).astype('uint32')
+    det[rs.rand(det.size) < 0.01] += 0x80    # big-FIFO full flags
+    times = np.cumsum(rs.randint(1, 3000, size=det.size)) % 2**24
+    data = (np.left_shift(det - 1, 24) + times).astype('uint32')
+    timestamps, det = mr.get_timestamps_detectors(data)
+    timestamps_m, big_fifo, _ = mr.process_timestamps(timestamps, det)
+    for CH in (1, 30, 48):
+        mask = np.bitwise_and(det, 0x3F) == CH
+        times32 = timestamps[mask].astype('int32')
+        rollover = np.cumsum(np.diff(times32) < -1)
+        assert np.all(timestamps_m[CH-1] == times32[1:] + rollover*2**24)
+        assert np.all(big_fifo[CH-1] == (det[mask] >= 0x80))
+
+    # Detector codes out of range (i.e. with FIFO flags) are discarded
+    from fretbursts import backends
+    codes = np.array([3, 1, 200, 3, 70, 1, 2], dtype='uint8')
+    for backend in backends.available('demux_detectors'):
+        index, bounds = backends.get('demux_detectors', backend)(codes)
+        assert list(index) == [1, 5, 6, 0, 3]
+        assert list(bounds[:5]) == [0, 0, 2, 3, 5] and bounds[-1] == 5
+
+    data_chunks = [data[i:i+3000] for i in range(0, data.size, 3000)]
+    fname = str(tmpdir.join('manta.hdf5'))
+    stored = mr.process_store_chunks(data_chunks, fname, num_threads=2)
+    assert list_array_equal([t.read() for t in stored[0]], timestamps_m)
+    assert list_array_equal([f.read() for f in stored[1]], big_fifo)
+    stored[0].data_file.close()
+
+def test_usalex_apply_period():
+    """Test the chunked and in-place usALEX alternation selection.
+    """
+    def raw_data():
+        d = simulate.simulate_data(duration_s=2, alex=True, apply_period=False)
+        # Add photons from a third detector and during the transients
+        rs = np.random.RandomState(9)
+        d.det_t[rs.rand(d.det_t.size) < 0.1] = 2
+        d.ph_times_t += rs.randint(0, 300, size=d.ph_times_t.size)
+        d.ph_times_t.sort()
+        return d
+    d = raw_data()
+    times, det = d.ph_times_t, d.det_t
+    phase = times % d.alex_period
+    d_ex = (phase > d.D_ON[0]) | (phase < d.D_ON[1])
+    a_ex = (phase > d.A_ON[0]) & (phase < d.A_ON[1])
+    mask = (det < 2) & (d_ex | a_ex)
+    loader.usalex_apply_period(d, chunksize=1000)
+    assert np.all(d.ph_times_m[0] == times[mask])
+    assert np.all(d.A_em[0] == (det[mask] == 1))
+    assert np.all(d.D_ex[0] == d_ex[mask]) and np.all(d.A_ex[0] == a_ex[mask])
+    d2 = raw_data()
+    loader.usalex_apply_period(d2, in_place=True, remove_d_em_a_ex=True)
+    mask_d_em_a_ex = d.D_em[0] & d.A_ex[0]
+    assert np.all(d2.ph_times_m[0] == d.ph_times_m[0][~mask_d_em_a_ex])
+    assert np.all(d2.D_em[0] == d.D_em[0][~mask_d_em_a_ex])
+
+def test_nsalex_apply_period(tmpdir):
+    """Test the chunked nsALEX selection, also while reading the SPC file.
+    """
+    fname = str(tmpdir.join('test_nsalex.spc'))
+    rs = np.random.RandomState(7)
+    records = np.zeros(20001, dtype=spcreader.spc_dtype)
+    records['field0'] = rs.randint(0, 2**14, size=records.size)
+    records['a'] = rs.randint(0, 2**16, size=records.size)
+    records['c'] = rs.choice([4, 6, 1], size=records.size)
+    records.tofile(fname)
+    times, det, nanotimes = spcreader.load_spc(fname)
+    d = loader.nsalex(fname)
+    d_ex = (nanotimes > d.D_ON[0]) & (nanotimes < d.D_ON[1])
+    a_ex = (nanotimes > d.A_ON[0]) & (nanotimes < d.A_ON[1])
+    mask = (det != 1) & (d_ex | a_ex)
+    loader.nsalex_apply_period(d, chunksize=1000)
+    assert np.all(d.ph_times_m[0] == times[mask])
+    assert np.all(d.nanotimes == nanotimes[mask])
+    assert np.all(d.A_em[0] == (det[mask] == 6))
+    assert np.all(d.D_ex[0] == d_ex[mask]) and np.all(d.A_ex[0] == a_ex[mask])
+    assert 'ph_times_t' not in d
+    d2 = loader.nsalex(fname, apply_period=True, chunksize=999)
+    assert np.all(d2.ph_times_m[0] == d.ph_times_m[0])
+    assert np.all(d2.nanotimes == d.nanotimes)
+    assert np.all(d2.A_ex[0] == d.A_ex[0]) and np.all(d2.A_em[0] == d.A_em[0])
+
+def test_copy_on_write():
+    """Test that copies share the arrays and never modify the original.
+    """
+    d = simulate.simulate_data(duration_s=3, alex=True)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    d.update_leakage(0.1)
+    orig = {name: [np.array(v, copy=True) for v in d[name]]
+            for name in d.burst_fields + d.bg_fields if name in d}
+    dc = d.copy(mute=True)
+    assert np.may_share_memory(dc.nd[0], d.nd[0])
+    dc.dither(mute=True)
+    dc.update_dir_ex(0.05)
+    dc2 = dc.copy(mute=True)
+    dc2.burst_search_t(L=10, m=10, F=6, ph_sel=Ph_sel(Dex='Dem'), mute=True)
+    dc2.background_correction_t(relax_nt=True)
+    for name, values in orig.items():
+        assert list_array_equal(d[name], values)
+    assert not list_array_equal(dc.nd, d.nd)
+    assert not np.may_share_memory(dc.nd[0], d.nd[0])
+    assert np.may_share_memory(dc.bg[0], d.bg[0])
+    dx = bext.burst_search_and_gate(dc, mute=True)
+    assert list_array_equal(d.bg, dx.bg)
+    # The arrays of the original are read-only until replaced by copies
+    dc3 = d.copy(mute=True)
+    with pytest.raises(ValueError):
+        d.nd[0][0] = 1
+    d.add(nd=[nd.copy() for nd in d.nd])
+    d.nd[0][0] += 1
+    assert dc3.nd[0][0] == orig['nd'][0][0]
+
+def test_sel_lazy():
+    """Test that lazy (index-based) burst selections match the copying ones.
+    """
+    d = simulate.simulate_data(duration_s=3, alex=True)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    orig = {name: [np.array(v, copy=True) for v in d[name]]
+            for name in d.burst_fields if name in d}
+    ds = bl.Sel(d, select_bursts.size, th1=15)
+    ds = bl.Sel(ds, select_bursts.E, E1=0.2, E2=0.9)
+    dl = bl.Sel(d, select_bursts.size, th1=15, lazy=True)
+    dl = bl.Sel(dl, select_bursts.E, E1=0.2, E2=0.9, lazy=True)
+    assert not dict.__contains__(dl, 'nd') and 'nd' in dl
+    assert dl._sel_pending['nd'][1][0].dtype == np.int32
+    assert (dl.num_bursts == ds.num_bursts).all()
+    # Methods copying the object keep the fields not yet extracted
+    assert list_array_equal(dl.bursts_slice(0, 10).nd,
+                            [nd[:10] for nd in ds.nd])
+    dj = bext.join_data([dl, dl])
+    assert (dj.num_bursts == 2*ds.num_bursts).all()
+    assert list_array_equal(dj.bp, [np.hstack([bp, bp + d.nperiods])
+                                    for bp in ds.bp])
+    assert list_array_equal(dl.fuse_bursts(ms=0).nt,
+                            ds.fuse_bursts(ms=0).nt)
+    for name in orig:
+        assert list_array_equal(dl[name], ds[name])
+    assert dl._sel_pending == {}
+    dl.update_leakage(0.1)
+    for name, values in orig.items():
+        assert list_array_equal(d[name], values)
+
+def test_select_expression():
+    """Test burst selection with a selection expression.
+    """
+    d = simulate.simulate_data(duration_s=3, alex=True)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    ds = bl.Sel(d, select_bursts.nd, th1=10)
+    ds = bl.Sel(ds, select_bursts.E, E1=0.2, E2=0.8)
+    mask = select_bursts.na_bg_p(ds, 0, P=0.01)
+    expr = 'nd >= 10 and 0.2 <= E <= 0.8 & na_bg_p(P=0.01)'
+    numexpr = select_bursts.numexpr
+    for select_bursts.numexpr in set([numexpr, None]):
+        dx = d.select(expr)
+        assert list_array_equal(dx.mburst, [ds.mburst[0][mask]])
+        assert list_array_equal(dx.E, [ds.E[0][mask]])
+    select_bursts.numexpr = numexpr
+    dx = d.select('width > 0', negate=True)
+    assert dx.num_bursts[0] == 0
+    with pytest.raises(ValueError):
+        d.select('mburst > 0')
+
+def test_flatten_bursts():
+    """Test the flat layout of the burst fields.
+    """
+    d = simulate.simulate_data(num_spots=4, duration_s=3, seed=1)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    dc = d.collapse()
+    E = [e.copy() for e in d.E]
+    d.flatten_bursts()
+    nd, offsets = d.burst_flat('nd')
+    assert (np.diff(offsets) == d.num_bursts).all()
+    assert all(np.may_share_memory(nd, d.nd[ich]) for ich in range(d.nch))
+    d.calc_fret(count_ph=False, corrections=False)
+    assert list_array_equal(d.E, E)
+    assert np.may_share_memory(d.burst_flat('E')[0], d.E[0])
+    dc2 = d.collapse()
+    for name in d.burst_fields:
+        if name in dc:
+            assert list_array_equal(dc[name], dc2[name])
+    d.add(nd=[nd_ich.copy() for nd_ich in d.nd])
+    assert d._get_flat('nd') is None
+    assert (d.burst_flat('nd')[0] == nd).all()
+
+def test_collapse_merge():
+    """Test collapse() against sorting all the bursts by start time.
+    """
+    d = simulate.simulate_data(num_spots=8, duration_s=3, seed=2)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    burst_start = np.concatenate([bl.b_start(mb) for mb in d.mburst])
+    sort_index = burst_start.argsort(kind='mergesort')
+    ich_burst = np.repeat(np.arange(d.nch), d.num_bursts)[sort_index]
+    dc = d.collapse()
+    assert dc.ich_burst.dtype == np.uint8
+    assert (dc.ich_burst == ich_burst).all()
+    assert (dc.nd[0] == np.concatenate(d.nd)[sort_index]).all()
+    dl = d.collapse(lazy=True)
+    assert not dict.__contains__(dl, 'nt')
+    # Without the flat layout the per-channel arrays are shared
+    source = dl._sel_pending['nt'][0][0]
+    assert all(s.base is nt for s, nt in zip(source, d.nt))
+    assert dl.num_bursts[0] == d.num_bursts.sum()
+    for name in d.burst_fields:
+        if name in d:
+            assert list_array_equal(dl[name], dc[name])
+
+def test_profiling():
+    """Test the profiling log of Data methods.
+    """
+    from fretbursts.utils import profiling
+    d = simulate.simulate_data(num_spots=8, duration_s=2, seed=1)
+    d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+    assert d.profile_log == []
+    d.enable_profiling()
+    d.burst_search_t(L=10, m=10, F=6, mute=True)
+    d.corrections(mute=True)
+    log = d.profile_log
+    assert [rec['name'] for rec in log if rec['depth'] == 0] == \
+            ['burst_search_t', 'corrections']
+    rec = log[-1]
+    assert rec['num_bursts_ch'] == [mb.shape[0] for mb in d.mburst]
+    assert rec['num_ph'] == sum(d.ph_data_sizes)
+    assert rec['wall_s'] >= 0 and rec['cpu_s'] >= 0
+    if rec['mem_delta_MB'] is not None:
+        # A second identical allocation does not set a new process peak
+        @profiling.profiled
+        def allocate(d):
+            d.add(big=np.ones(2**24))   # 128 MB
+        for _ in range(2):
+            allocate(d)
+            d.delete('big')
+        assert d.profile_log[-1]['mem_delta_MB'] > 100
+    # Profiling does not extract the bursts of a lazy selection
+    dl = bl.Sel(d, select_bursts.size, th1=15, lazy=True)
+    assert not dict.__contains__(dl, 'mburst')
+    assert d.profile_log[-1]['num_bursts_ch'] == list(dl.num_bursts)
+    assert len(d.profile_json()) > 0
+    d.disable_profiling()
+    d.corrections(mute=True)
+    assert d.profile_log == []
+
+def test_progress_callback(capsys):
+    """Test the progress callbacks during background and burst search.
+    """
+    from fretbursts.utils import progress
+    d = simulate.simulate_data(num_spots=8, duration_s=2, seed=1)
+    reports = []
+    def callback(stage, fraction, ich):
+        reports.append((stage, fraction, ich))
+    with progress.callback(callback):
+        d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300)
+        d.burst_search_t(L=10, m=10, F=6, mute=True)
+        d.fuse_bursts(ms=0, mute=True)
+    assert progress._callbacks == []
+    # The progress messages are logged, not printed
+    assert 'BG rates' not in capsys.readouterr()[0]
+    for stage in ['calc_bg', 'burst_search', 'fuse_bursts']:
+        fractions = [f for s, f, ich in reports if s == stage]
+        assert len(fractions) > 0
+        assert (np.diff(fractions) >= 0).all()
+        assert fractions[-1] == 1
+
+def test_lazy_import():
+    """Test that importing fretbursts does not import the heavy modules.
+
+    The optional backends (i.e. numba) are imported only when first used.
+    """
+    import sys
+    import subprocess
+    code = ("import sys, fretbursts; "
+            "print(sorted(m for m in ['scipy', 'matplotlib', 'pandas', "
+            "'lmfit', 'PySide', 'numba', 'llvmlite'] if m in sys.modules))")
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == '[]'
+
+def test_backends_parity():
+    """Test that all the available backends give the same results as numpy.
+    """
+    from fretbursts import backends
+    d = simulate.simulate_data(num_spots=2, duration_s=2, seed=1)
+    ph, mask = d.ph_times_m[0], d.A_em[0]
+    T = 1e-3/d.clk_p
+    mb = bl.bslib.bsearch_py(ph, 10, 10, T)
+    mb_a = bl.bslib.bsearch_py(ph[mask], 10, 10, T)
+    # Timestamps of 16 detectors with 24-bit overflow (multispot8 format)
+    det = np.random.RandomState(1).randint(1, 17, size=ph.size).astype('uint8')
+    times = (ph % 2**24).astype('int32')
+    args = {'bsearch': (ph, 10, 10, T),
+            'mch_count_ph_in_bursts': ([mb, mb], [mask, ~mask]),
+            'burst_and': (mb, mb_a),
+            'fuse_bursts': (mb, 1, d.clk_p),
+            'b_rate_max': (ph, mb, 10, mask),
+            'unwind_uni': (times, det, 8, 24),
+            'merge_da': (ph[~mask], ph[mask]),
+            'merge_timestamps': (d.ph_times_m + [ph[mask]],),
+            'demux_detectors': (det,),
+            'merge_bursts_order': (bl.b_start(np.vstack([mb, mb_a])),
+                                   np.array([0, mb.shape[0],
+                                             mb.shape[0] + mb_a.shape[0]])),
+            'bg.exp_fit': (ph, 300, d.clk_p),
+            'bg.exp_cdf_fit': (ph, 300, d.clk_p)}
+    assert sorted(args) == backends.kernels()
+    for kernel, kernel_args in args.items():
+        assert 'numpy' in backends.available(kernel)
+        ref = backends.get(kernel, 'numpy')(*kernel_args)
+        for backend in backends.available(kernel):
+            res = backends.get(kernel, backend)(*kernel_args)
+            if isinstance(ref, tuple) and isinstance(ref[0], list):
+                for res_i, ref_i in zip(res, ref):
+                    assert list_array_equal(res_i, ref_i)
+            elif isinstance(ref, (list, tuple)):
+                assert list_array_equal(res, ref)
+            else:
+                assert np.allclose(res, ref, equal_nan=True)
+
+    # Global selection, per-call selection and fallback
+    with backends.use_backend('numpy'):
+        assert backends.get('bsearch') is bl.bslib.bsearch_py
+        assert backends.info()['bsearch']['active'] == 'numpy'
+    assert backends.get_backend() is None
+    assert backends.get('bg.exp_fit', 'cython') is bg.exp_fit
+
+    # calc_bg() selects the built-in fits through the registry
+    calls = []
+    def exp_fit_numba(*args, **kwargs):
+        calls.append(args)
+        return bg.exp_fit(*args, **kwargs)
+    backends.register('bg.exp_fit', 'numba', exp_fit_numba)
+    try:
+        d.calc_bg(bg.exp_fit, time_s=1, tail_min_us=300, backend='numba')
+        assert len(calls) > 0
+    finally:
+        del backends._registry['bg.exp_fit']['numba']
+        backends._loaded.pop(('bg.exp_fit', 'numba'), None)
+    assert backends.available('bg.exp_fit') == ['numpy']
+    with pytest.raises(ValueError):
+        backends.set_backend('fortran')
+
 if __name__ == '__main__':
     pytest.main("-x -v fretbursts/tests/test_burstlib.py")
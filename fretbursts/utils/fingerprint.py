@@ -0,0 +1,85 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Fast fingerprint (non-cryptographic hash) of timestamps arrays.
+
+The fingerprint identifies the content of a list of arrays (one per
+channel) and is used as a key for the on-disk caches (see
+:mod:`fretbursts.burst_cache`). The arrays are hashed block by block
+with a streaming checksum (`xxhash` if installed, otherwise CRC32), so
+the arrays can be on disk (see :mod:`fretbursts.dataload.lazy_arrays`)
+and the result does not depend on the block size. The channels are
+hashed in parallel threads.
+
+The values are hashed as little-endian int64, therefore the fingerprint
+does not depend on the storage (in memory, memory-mapped or compressed
+HDF5 array) or on the original integer type.
+"""
+
+import zlib
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from fretbursts.dataload.lazy_arrays import iter_slices
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Name of the checksum used, saved in the fingerprint
+hash_name = 'crc32' if xxhash is None else 'xxh64'
+
+
+def _hash_array(array, chunksize=None):
+    """Return a string with size and checksum of `array` (1D, integers).
+    """
+    if xxhash is not None:
+        hasher = xxhash.xxh64()
+        update = lambda block, crc: hasher.update(block)
+    else:
+        update = zlib.crc32
+    crc = 0
+    for block in iter_slices(array, chunksize=chunksize):
+        block = np.ascontiguousarray(block).astype('<i8', copy=False)
+        crc = update(block.data, crc)
+    if xxhash is not None:
+        crc = hasher.intdigest()
+    return '%d:%x' % (array.shape[0], crc & 0xffffffffffffffff)
+
+def fingerprint(arrays, num_threads=None, chunksize=None):
+    """Return the fingerprint (a string) of the list of arrays `arrays`.
+
+    Arguments:
+        arrays (list): 1D integer arrays (i.e. the timestamps of each
+            channel). Can be on-disk arrays.
+        num_threads (int or None): number of threads hashing the arrays in
+            parallel. If None, uses one thread per array (max the number
+            of CPUs).
+        chunksize (int or None): number of elements hashed at once. If None,
+            uses `fretbursts.dataload.lazy_arrays.default_chunksize`.
+
+    Returns:
+        A string '<hash name>-<hex digest>'.
+    """
+    if num_threads is None:
+        num_threads = min(len(arrays), multiprocessing.cpu_count())
+    hash_array = lambda array: _hash_array(array, chunksize=chunksize)
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+        try:
+            hashes = pool.map(hash_array, arrays)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        hashes = map(hash_array, arrays)
+    # Combine the (small) per-array hashes in a single fixed-size string
+    digest = hashlib.md5(' '.join(hashes)).hexdigest()
+    return '%s-%s' % (hash_name, digest)
@@ -0,0 +1,56 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Lazy loading of modules and functions.
+
+These helpers keep `import fretbursts` fast by deferring the import of
+heavy dependencies (scipy, matplotlib, pandas, lmfit, Qt) to the first time
+they are actually used.
+"""
+
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder for a module that is imported on first attribute access.
+
+    After the first access all the attributes of the real module are copied
+    in the placeholder, so the following accesses have no overhead.
+    """
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name__
+
+
+def lazy_function(module_name, func_name):
+    """Return a function that imports and calls `module_name.func_name`.
+
+    The returned function has the same `__name__` of the wrapped function
+    so it can be used as default argument value in place of the original.
+    """
+    cache = []
+
+    def wrapper(*args, **kwargs):
+        if not cache:
+            module = importlib.import_module(module_name)
+            cache.append(getattr(module, func_name))
+        return cache[0](*args, **kwargs)
+    wrapper.__name__ = func_name
+    wrapper.__module__ = module_name
+    wrapper.__doc__ = 'Lazy-loaded function `%s.%s`.' % (module_name,
+                                                        func_name)
+    return wrapper
@@ -0,0 +1,214 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Opt-in timing and memory instrumentation of the analysis pipeline.
+
+The main :class:`fretbursts.burstlib.Data` methods (`calc_bg`,
+`burst_search_t`, `calc_ph_num`, `corrections`, `fuse_bursts`, ...), the
+burst selection function `Sel` and the loaders are decorated with
+:func:`profiled`. When profiling is disabled (default) the decorator only
+performs a dictionary lookup before calling the wrapped function.
+
+Profiling can be enabled on a single Data object with
+`d.enable_profiling()`, or globally (for all the objects, including the
+ones created by the loaders) with :func:`enable`. Each call of a
+decorated function appends a record (a dict) to the log of the Data
+object when the call returns (so nested calls are logged before the
+calling method). Each record has the following fields:
+
+- `name`: name of the method (or function).
+- `depth`: nesting level (0 for calls made by the user).
+- `start`: start time as returned by `time.time()`.
+- `wall_s`, `cpu_s`: elapsed wall-clock and CPU (user + system) time.
+- `mem_delta_MB`: change of the current resident memory (RSS) of the
+  process during the call (memory freed before returning is not
+  counted). None if the RSS cannot be read (it is read from `/proc` on
+  Linux, or with `psutil` if installed).
+- `new_peak_MB`: increase of the process-lifetime peak resident memory
+  (max RSS) during the call. This is zero when the call does not set a
+  new peak for the process, so it is not the peak memory of the call.
+  None if the `resource` module is not available.
+- `num_ph`, `num_bursts`: total number of photons and bursts after the call
+  (in the returned Data object, if any).
+- `num_ph_ch`, `num_bursts_ch`: per-channel number of photons and bursts.
+  Only the counts are per-channel: time and memory are recorded for the
+  whole call.
+
+The log is returned by `d.profile_log` and can be exported with
+`d.profile_dataframe()` or `d.profile_json()`.
+"""
+
+import os
+import sys
+import time
+import json
+import functools
+
+try:
+    import resource
+except ImportError:
+    has_resource = False
+else:
+    has_resource = True
+
+try:
+    import psutil
+except ImportError:
+    has_psutil = False
+else:
+    has_psutil = True
+
+
+# Global switch, when True all the Data objects record the profiling log
+_enabled = False
+
+# Nesting level of the profiled calls in progress
+_depth = [0]
+
+
+def enable():
+    """Enable profiling globally (for all Data objects and the loaders)."""
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Disable the global profiling (per-object profiling is not changed)."""
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    """Return True if profiling is globally enabled."""
+    return _enabled
+
+def _rss_MB():
+    """Return the current resident memory of the process in MB (or None)."""
+    try:
+        with open('/proc/self/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages*os.sysconf('SC_PAGE_SIZE')/2.**20
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if has_psutil:
+        return psutil.Process(os.getpid()).memory_info().rss/2.**20
+    return None
+
+def _max_rss_MB():
+    """Return the peak resident memory of the process in MB."""
+    if not has_resource:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OSX and in kilobytes on Linux
+    return max_rss/2.**20 if sys.platform == 'darwin' else max_rss/2.**10
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+def _get_log(d):
+    """Return the profiling log of `d` (creating it if globally enabled)."""
+    log = d.__dict__.get('_profile_log')
+    if log is None and _enabled:
+        log = []
+        d.__dict__['_profile_log'] = log
+    return log
+
+def _counts(d):
+    """Return the per-channel number of photons and bursts in `d`."""
+    num_ph_ch, num_bursts_ch = None, None
+    if 'ph_times_m' in d:
+        num_ph_ch = [int(ph.shape[0]) for ph in d.ph_times_m]
+    if 'mburst' in d:
+        # Not `d.mburst`, that extracts the bursts of a lazy selection
+        num_bursts_ch = [int(n) for n in d.num_bursts]
+    return num_ph_ch, num_bursts_ch
+
+def profiled(func):
+    """Decorator recording time and memory usage of a function call.
+
+    The profiling record is saved in the log of the Data object passed as
+    first argument. If the first argument is not a Data object (i.e. a
+    loader function) the record is saved in the returned Data object.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        d = args[0] if args and isinstance(args[0], dict) else None
+        if d is None:
+            if not _enabled:
+                return func(*args, **kwargs)
+            log = None
+        else:
+            log = _get_log(d)
+            if log is None:
+                return func(*args, **kwargs)
+
+        depth = _depth[0]
+        _depth[0] += 1
+        start, cpu0 = time.time(), _cpu_time()
+        rss0, peak0 = _rss_MB(), _max_rss_MB()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _depth[0] -= 1
+        wall, cpu = time.time() - start, _cpu_time() - cpu0
+        rss1, peak1 = _rss_MB(), _max_rss_MB()
+
+        if d is None:
+            if not isinstance(result, dict):
+                return result
+            d = result
+            log = _get_log(d)
+        # Count photons and bursts in the returned object if any (i.e. for
+        # burst selection or fusion), otherwise in the input object.
+        num_ph_ch, num_bursts_ch = _counts(result if isinstance(result, dict)
+                                           else d)
+        log.append(dict(
+            name=name, depth=depth, start=start, wall_s=wall, cpu_s=cpu,
+            mem_delta_MB=None if rss0 is None else rss1 - rss0,
+            new_peak_MB=None if peak0 is None else peak1 - peak0,
+            num_ph=None if num_ph_ch is None else sum(num_ph_ch),
+            num_bursts=None if num_bursts_ch is None else sum(num_bursts_ch),
+            num_ph_ch=num_ph_ch, num_bursts_ch=num_bursts_ch))
+        return result
+    return wrapper
+
+def log_to_dataframe(log, per_channel=False):
+    """Convert a profiling log in a pandas DataFrame.
+
+    Arguments:
+        log (list): list of records as returned by `Data.profile_log`.
+        per_channel (bool): if True, returns one row per call and channel
+            with the columns `ch`, `num_ph` and `num_bursts` containing the
+            per-channel counts. Otherwise one row per call.
+    """
+    import pandas as pd
+    columns = ['name', 'depth', 'start', 'wall_s', 'cpu_s',
+               'mem_delta_MB', 'new_peak_MB', 'num_ph', 'num_bursts']
+    if not per_channel:
+        return pd.DataFrame(log, columns=columns + ['num_ph_ch',
+                                                    'num_bursts_ch'])
+    rows = []
+    for call, rec in enumerate(log):
+        nch = max(len(rec[k] or []) for k in ['num_ph_ch', 'num_bursts_ch'])
+        for ich in range(nch):
+            row = dict(rec, call=call, ch=ich)
+            for k in ['num_ph', 'num_bursts']:
+                row[k] = rec[k + '_ch'][ich] if rec[k + '_ch'] else None
+            rows.append(row)
+    return pd.DataFrame(rows, columns=['call', 'ch'] + columns)
+
+def log_to_json(log, fname=None, **kwargs):
+    """Serialize the profiling log to JSON.
+
+    If `fname` is not None the JSON is also written to the file `fname`.
+    Additional keyword arguments are passed to `json.dumps()`.
+    """
+    text = json.dumps(log, **kwargs)
+    if fname is not None:
+        with open(fname, 'w') as f:
+            f.write(text)
+    return text
@@ -0,0 +1,96 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Logging and progress reporting for long computations.
+
+Messages produced inside the per-channel and per-period loops (and in the
+low-level kernels) are sent to the standard `logging` logger named
+`'fretbursts'` instead of being printed. By default the logger has no
+output; to see the messages configure it, for example::
+
+    from fretbursts.utils import progress
+    progress.log_to_stdout(level=logging.DEBUG)
+
+The progress of the long computations (background estimation, burst search,
+burst fusion, ...) is reported to any registered callback. A callback is a
+function called as `callback(stage, fraction, ich)` where `stage` is a
+string identifying the computation (i.e. 'calc_bg'), `fraction` is the
+fraction of the computation done (0..1) and `ich` is the channel being
+processed (or None). When no callback is registered, reporting has
+negligible overhead. Example::
+
+    def my_callback(stage, fraction, ich):
+        print '%s: %3d%%' % (stage, fraction*100)
+
+    with progress.callback(my_callback):
+        d.burst_search_t(L=10, m=10, F=6)
+
+Ready-made callbacks are :func:`log_progress` and :func:`print_progress`.
+"""
+
+import sys
+import logging
+
+
+logger = logging.getLogger('fretbursts')
+logger.addHandler(logging.NullHandler())
+
+# List of registered progress callbacks
+_callbacks = []
+
+
+def add_callback(func):
+    """Register `func` as a progress callback."""
+    if func not in _callbacks:
+        _callbacks.append(func)
+
+def remove_callback(func):
+    """Unregister the progress callback `func`."""
+    if func in _callbacks:
+        _callbacks.remove(func)
+
+class callback(object):
+    """Context manager registering a progress callback in a `with` block.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __enter__(self):
+        add_callback(self.func)
+        return self.func
+
+    def __exit__(self, *exc_info):
+        remove_callback(self.func)
+
+def report(stage, fraction, ich=None):
+    """Report the progress of `stage` to all the registered callbacks."""
+    if not _callbacks:
+        return
+    for func in list(_callbacks):
+        func(stage, fraction, ich)
+
+def log_progress(stage, fraction, ich=None):
+    """Progress callback sending the progress to the logger (level INFO)."""
+    if ich is None:
+        logger.info('%s: %5.1f%%', stage, fraction*100)
+    else:
+        logger.info('%s: %5.1f%% (CH%d)', stage, fraction*100, ich + 1)
+
+def print_progress(stage, fraction, ich=None):
+    """Progress callback printing a single updating line on stdout."""
+    sys.stdout.write('\r - %s: %5.1f%%' % (stage, fraction*100))
+    if fraction >= 1:
+        sys.stdout.write('\n')
+    sys.stdout.flush()
+
+def log_to_stdout(level=logging.INFO):
+    """Print the FRETBursts log messages with level >= `level` on stdout.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
@@ -0,0 +1,62 @@
+#
+# FRETBursts - A single-molecule FRET burst analysis toolkit.
+#
+# Copyright (C) 2014 Antonino Ingargiola <tritemio@gmail.com>
+#
+"""
+Flat storage of *ragged* per-channel data (lists of arrays, one per channel,
+with different number of elements).
+
+The arrays of all the channels are concatenated in a single *flat* array
+and an `offsets` array (size number of channels + 1) marks where each
+channel starts: the elements of channel `ich` are
+`flat[offsets[ich]:offsets[ich+1]]`. The per-channel arrays are obtained
+as views of the flat array (see :func:`split`), so they can be used as
+the usual lists of arrays while vectorized operations can process all
+the channels at once on the flat array.
+"""
+
+import numpy as np
+
+
+def concatenate(arrays):
+    """Concatenate a list of arrays in a new flat array.
+
+    Empty arrays are skipped, so they can have a different shape or type
+    (i.e. `np.array([])` for a channel without bursts).
+
+    Returns:
+        The flat array and the int64 array of channel offsets.
+    """
+    sizes = [len(a) for a in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype='int64')
+    np.cumsum(sizes, out=offsets[1:])
+    non_empty = [a for a in arrays if len(a) > 0] or list(arrays[:1])
+    if len(non_empty) == 0:
+        return np.zeros(0), offsets
+    return np.concatenate(non_empty), offsets
+
+def split(flat, offsets):
+    """Return the list of per-channel views of the `flat` array."""
+    return [flat[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+def _address(array):
+    return array.__array_interface__['data'][0]
+
+def is_split(arrays, flat, offsets):
+    """Return True if `arrays` are the per-channel views of `flat`.
+
+    This is False when any of the arrays has been replaced (i.e. by a
+    new array or a copy) after calling :func:`split`.
+    """
+    if len(arrays) != len(offsets) - 1:
+        return False
+    for array, start, stop in zip(arrays, offsets[:-1], offsets[1:]):
+        if not isinstance(array, np.ndarray) or \
+           array.shape != flat[start:stop].shape or \
+           array.strides != flat.strides:
+            return False
+        if stop > start and \
+           _address(array) != _address(flat) + start*flat.strides[0]:
+            return False
+    return True
@@ -39,7 +39,9 @@ else:
     has_cython = True
     ext_modules = [Extension("burstsearchlib_c",
                              [project_name + \
-                             "/burstsearch/burstsearchlib_c.pyx"])]
+                             "/burstsearch/burstsearchlib_c.pyx"]),
+                   Extension(project_name + ".dataload.opt.uni",
+                             [project_name + "/dataload/opt/uni.pyx"])]
 
 ## Configure setup.py commands
 cmdclass = versioneer.get_cmdclass()
@@ -69,7 +71,8 @@ setup(name = project_name,
                    'Topic :: Scientific/Engineering',
                    ],
       packages = ['fretbursts', 'fretbursts.utils', 'fretbursts.fit',
-                  'fretbursts.burstsearch', 'fretbursts.dataload'],
+                  'fretbursts.burstsearch', 'fretbursts.dataload',
+                  'fretbursts.dataload.opt'],
       keywords = 'single-molecule FRET smFRET burst-analysis biophysics',
       )
 